@@ -1,8 +1,29 @@
 #! /usr/bin/env python
-"""Ants simulator behavior module."""
+"""Ants simulator behavior module.
+A behavior kernel (see Kernel) moves all the ants of a world by one step; the
+kernels are registered in KERNELS by name, and the configuration selects one
+of them ('behavior', by default 'forage')."""
 
 
+import compiled
+import config
 import motion
+import population
+
+
+# behavior kernels by name (see register)
+KERNELS = dict()
+
+
+
+def food_fitness(cell):
+  """Cell fitness for an ant seeking for food."""
+  return cell.food_fitness()
+
+
+def nest_fitness(cell):
+  """Cell fitness for an ant seeking for its nest."""
+  return cell.nest_fitness()
 
 
 
@@ -14,6 +35,8 @@ def take_food(ant):
     # take the food
     here.food_quantity -= 1
     ant.food_quantity += 1
+    ant.world.mark_food(ant.location)
+    ant.world.mark_dirty(ant.location)
     # clear history and go back
     ant.path.clear()
     motion.turn_around(ant)
@@ -23,9 +46,8 @@ def take_food(ant):
 def approach_food(ant):
   """Moves the ant ahead if that cell contains food."""
   for d in ((ant.direction + x) % 8 for x in range(-1, 2)):
-    idx = motion.neighbor(ant, d)
-    cell = ant.world[idx]
-    if cell.food_quantity > 0 and idx != ant.world.nest:
+    cell = motion.neighbor_cell(ant, d)
+    if cell.food_quantity > 0 and motion.neighbor(ant, d) != ant.world.nest:
       motion.turn(ant, (d - ant.direction) % 8)
       motion.forward(ant)
       return True
@@ -38,7 +60,7 @@ def seek_food(ant, gsp):
     # check if the cell in front contains food_quantity
     if not approach_food(ant):
       # moves the ant according to its neighbors food fitness
-      motion.fitness_step(ant, lambda c: c.food_fitness(), gsp)
+      motion.fitness_step(ant, food_fitness, gsp)
 
 
 def drop_food(ant):
@@ -48,6 +70,7 @@ def drop_food(ant):
     ant.world.nest_food_quantity += ant.food_quantity
     ant.world.food_quantity -= ant.food_quantity
     ant.food_quantity = 0
+    ant.world.mark_dirty(ant.location)
     # clear history and go back
     ant.path.clear()
     motion.turn_around(ant)
@@ -71,7 +94,7 @@ def seek_nest(ant, gsp):
     # check if the nest is ahead
     if not approach_nest(ant):
       # moves the ant according to its neighbors nest fitness
-      motion.fitness_step(ant, lambda c: c.nest_fitness(), gsp)
+      motion.fitness_step(ant, nest_fitness, gsp)
 
 
 def act(ant, go_straight_probability):
@@ -83,3 +106,67 @@ def act(ant, go_straight_probability):
     seek_food(ant, go_straight_probability)
   # get older
   ant.age += 1
+
+
+def wander(ant, go_straight_probability):
+  """Perform a new action ignoring the pheromone: the ant takes the food it
+  finds and brings it to its nest walking at random."""
+  if ant.foraging():
+    if not drop_food(ant) and not approach_nest(ant):
+      motion.random_step(ant, go_straight_probability)
+  elif not take_food(ant) and not approach_food(ant):
+    motion.random_step(ant, go_straight_probability)
+  ant.age += 1
+
+
+
+class Kernel(object):
+  """Behavior of the ants, applied to all the ants of a world at each step.
+  act performs the action of an Ant, batch (if any) the actions of a whole
+  Population at once and compiled (if any) is a native implementation of
+  batch."""
+
+  def __init__(self, name, act, batch=None, compiled=None):
+    """Creates and initializes the Kernel instance."""
+    self.name = name
+    self.act = act
+    self.batch = batch
+    self.compiled = compiled
+
+  def apply(self, ants, go_straight_probability, native=True):
+    """Performs a new action for every ant (with the compiled batch, if any,
+    unless native is False)."""
+    if isinstance(ants, population.Population):
+      if self.batch is None:
+        raise ValueError('The {} behavior has no NumPy kernel'.format(
+          self.name))
+      if native and self.compiled is not None:
+        self.compiled(ants, go_straight_probability)
+      else:
+        self.batch(ants, go_straight_probability)
+    else:
+      for a in ants:
+        self.act(a, go_straight_probability)
+
+
+def register(kernel):
+  """Adds the kernel to KERNELS (and its name to the valid behaviors of the
+  configuration). Returns the kernel."""
+  KERNELS[kernel.name] = kernel
+  config.CHOICES['behavior'].add(kernel.name)
+  return kernel
+
+
+def kernel(configuration):
+  """Gets the Kernel selected by the configuration."""
+  name = configuration.get('behavior', 'forage')
+  if name not in KERNELS:
+    raise ValueError('Unknown behavior: {}'.format(name))
+  return KERNELS[name]
+
+
+register(Kernel('forage', act,
+                population.Population.step,
+                compiled.step if compiled.numba is not None else None))
+register(Kernel('wander', wander,
+                lambda ants, gsp: ants.step(gsp, pheromone=False)))
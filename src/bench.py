@@ -0,0 +1,396 @@
+#! /usr/bin/env python
+"""Ants simulator benchmarks module."""
+
+
+import sys
+import json
+import time
+import random
+import argparse
+import multiprocessing
+import config
+import entity
+import motion
+import behavior
+import population
+import snapshot
+import sim
+import framebuffer
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+
+# world sizes and numbers of ants of the default and of the full matrix
+SIZES = (50, 40), (200, 200), (500, 500)
+ANTS = 10, 100, 1000
+FULL_SIZES = (50, 40), (200, 200), (500, 500), (1000, 1000), (2000, 2000)
+FULL_ANTS = 10, 100, 1000, 10000, 50000
+# world and ants storages
+STORAGES = 'cells', 'numpy'
+BENCHMARKS = ('step', 'evaporate', 'act', 'fitness_step', 'death', 'draw',
+              'render')
+# size (pixels) of the window of the render benchmark
+WINDOW = 1100, 770
+# grids of tiles, world size and number of ants of the tiled benchmark
+TILINGS = (1, 1), (2, 1), (2, 2), (4, 2)
+TILED_SIZE = 1000, 1000
+TILED_ANTS = 20000
+
+
+def arithmetic_neighbor_cell(ant, direction):
+  """Gets the cell of the ant neighbor computing its coordinates on the torus
+  (as done before the neighbors tables), used as reference."""
+  world = ant.world
+  x, y = world.coords(ant.location)
+  width, height = world.size
+  dx, dy = motion.DELTA[direction % 8]
+  return world[(x + dx) % width * height + (y + dy) % height]
+
+
+def populate(world, ants, seed=0):
+  """Places food and the given number of ants in random cells of the world."""
+  rnd = random.Random(seed)
+  width, height = world.size
+  cells = width * height
+  for _ in range(cells // 100):
+    world[rnd.randrange(cells)].food_quantity += 10
+  for _ in range(ants):
+    a = entity.Ant(world, rnd.randrange(8))
+    a.location = rnd.randrange(cells)
+    world.ants.append(a)
+
+
+def neighbors(size, ants, steps):
+  """Measures the neighbor lookups: returns the nanoseconds per lookup of the
+  coordinates arithmetic, of the locations table and of the cells table, and
+  the microseconds per ant step with the arithmetic and with the tables."""
+  world = entity.World(size, (0, 0), 0, 0)
+  populate(world, ants)
+  results = dict()
+  lookups = [(a, d) for a in world.ants for d in range(8)]
+  for name, lookup in (
+      ('arithmetic_ns', arithmetic_neighbor_cell),
+      ('locations_table_ns', lambda a, d: a.world[motion.neighbor(a, d)]),
+      ('cells_table_ns', motion.neighbor_cell)):
+    start = time.time()
+    for _ in range(steps):
+      for a, d in lookups:
+        lookup(a, d)
+    results[name] = (time.time() - start) / (steps * len(lookups)) * 1e9
+  for name, lookup in (('arithmetic_step_us', arithmetic_neighbor_cell),
+                       ('table_step_us', motion.neighbor_cell)):
+    world = entity.World(size, (0, 0), 0, 0)
+    populate(world, ants)
+    table, motion.neighbor_cell = motion.neighbor_cell, lookup
+    try:
+      start = time.time()
+      for _ in range(steps):
+        for a in world.ants:
+          behavior.act(a, 0.9)
+    finally:
+      motion.neighbor_cell = table
+    results[name] = (time.time() - start) / (steps * ants) * 1e6
+  return results
+
+
+def create(storage, size, ants, seed):
+  """Creates a world of the given storage with food and ants."""
+  if storage == 'numpy':
+    world = entity.ArrayWorld(size, (0, 0), 0, seed)
+    world.ants = population.Population(world)
+  else:
+    world = entity.World(size, (0, 0), 0, seed)
+  populate(world, ants, seed)
+  # some pheromone on the trails of the ants
+  for _ in range(10):
+    sim.step(world, 0.9, 0.005, 0.01)
+  return world
+
+
+def draw(world, steps):
+  """Draws the world steps times with AntSimWindow.DrawEntities on an
+  offscreen bitmap. Returns None if wxPython is not available."""
+  try:
+    import wx
+    import wxAntSim
+  except ImportError:
+    return None
+  app = wx.App(False)
+  _, wxAntSim.configuration = config.default()
+  zoom = wxAntSim.configuration['zoom']
+  width, height = world.size
+  class Canvas(object):
+    view = snapshot.WorldView(world.size, world.nest)
+    style = wxAntSim.Style(wxAntSim.configuration)
+  Canvas.view.apply(snapshot.capture(world, full=True))
+  dc = wx.MemoryDC(wx.Bitmap(width * zoom, height * zoom))
+  start = time.time()
+  for _ in range(steps):
+    wxAntSim.AntSimWindow.DrawEntities(Canvas(), dc)
+  elapsed = time.time() - start
+  dc.SelectObject(wx.NullBitmap)
+  app.Destroy()
+  return elapsed
+
+
+def render(world, steps):
+  """Composes the image of the world steps times with a Framebuffer, in a
+  window of the WINDOW size. Returns None if NumPy is not available."""
+  if framebuffer.numpy is None:
+    return None
+  _, configuration = config.default()
+  view = snapshot.WorldView(world.size, world.nest)
+  view.apply(snapshot.capture(world, full=True))
+  colors = {
+    'background': (255, 255, 255), 'colony_pheromone': (255, 0, 0),
+    'food_pheromone': (255, 255, 0), 'food': (255, 255, 0),
+    'nests': [(0, 0, 0)], 'ants': [(0, 128, 0), (128, 0, 128)],
+  }
+  frames = framebuffer.Framebuffer(
+      world.size, view.nests, colors, configuration['zoom'],
+      configuration['pheromone_scale_decreasing_factor'],
+      configuration['nest_size'])
+  frames.update(view)
+  start = time.time()
+  for _ in range(steps):
+    frames.render(view, *WINDOW)
+  return time.time() - start
+
+
+def measure(case):
+  """Runs a single benchmark case (in its own process, so that its peak
+  memory can be measured) and returns its record, or None if the benchmark
+  doesn't apply to the storage."""
+  benchmark, storage, size, ants, steps, seed = case
+  world = create(storage, size, ants, seed)
+  batched = isinstance(world.ants, population.Population)
+  start = time.time()
+  if benchmark == 'step':
+    for _ in range(steps):
+      sim.step(world, 0.9, 0.005, 0.01)
+  elif benchmark == 'evaporate':
+    for _ in range(steps):
+      sim.evaporate(world, 0.005, 0.01)
+  elif benchmark == 'act':
+    if batched:
+      return None
+    for _ in range(steps):
+      for a in world.ants:
+        behavior.act(a, 0.9)
+  elif benchmark == 'fitness_step':
+    if batched:
+      ids = population.numpy.arange(len(world.ants))
+      for _ in range(steps):
+        world.ants.fitness_step(ids, world.food_strengths, world.food_lifespans,
+                                0.9)
+    else:
+      for _ in range(steps):
+        for a in world.ants:
+          motion.fitness_step(a, lambda c: c.food_fitness(), 0.9)
+  elif benchmark == 'death':
+    for _ in range(steps):
+      sim.death(world, -1)
+  elif benchmark in ('draw', 'render'):
+    elapsed = (draw if benchmark == 'draw' else render)(world, steps)
+    if elapsed is None:
+      return None
+    start = time.time() - elapsed
+  elapsed = time.time() - start
+  record = {
+    'benchmark': benchmark,
+    'storage': storage,
+    'size': list(size),
+    'ants': ants,
+    'steps': steps,
+    'seconds': elapsed,
+    'steps_per_sec': steps / elapsed if elapsed else float('inf'),
+    'ns_per_ant_step': elapsed / (steps * max(ants, 1)) * 1e9,
+    'peak_rss_kb': peak_rss(),
+  }
+  return record
+
+
+def tiled(size, ants, grids, steps, seed=0):
+  """Measures the scaling of a TiledSimulation with the given number of ants
+  spread over the world, for each grid of tiles. Each record holds the steps
+  per second of the run and of its critical path: the slowest worker of each
+  step plus the coordinator, that is the speed with a core for each tile.
+  The speedups are relative to the first grid."""
+  # imported here, since the tiles need NumPy
+  import tiles
+  _, configuration = config.default()
+  configuration.update(world_size=size, world_storage='numpy',
+                       ants_storage='numpy', max_ants_number=ants,
+                       nest_location=(size[0] // 2, size[1] // 2),
+                       food_places_number=size[0] * size[1] // 1000)
+  records = []
+  for grid in grids:
+    simulation = tiles.TiledSimulation(configuration, grid, seed)
+    try:
+      world = entity.ArrayWorld(size, (0, 0), 0, seed)
+      world.ants = population.Population(world)
+      populate(world, ants, seed)
+      simulation.route(world.ants.take(
+        population.numpy.arange(len(world.ants))))
+      # a few steps to spread the pheromone
+      for _ in range(10):
+        simulation.advance()
+      busy, critical = simulation.busy[:], simulation.critical
+      start, coordinator = time.time(), time.process_time()
+      for _ in range(steps):
+        simulation.advance()
+      elapsed = time.time() - start
+      coordinator = time.process_time() - coordinator
+      critical = simulation.critical - critical + coordinator
+      work = sum(simulation.busy) - sum(busy) + coordinator
+    finally:
+      simulation.close()
+    records.append({
+      'benchmark': 'tiled',
+      'storage': 'numpy',
+      'size': list(size),
+      'ants': ants,
+      'tiles': list(grid),
+      'steps': steps,
+      'seconds': elapsed,
+      'steps_per_sec': steps / elapsed,
+      'cpu_seconds': work,
+      'critical_steps_per_sec': steps / critical,
+    })
+    records[-1]['speedup'] = (records[-1]['critical_steps_per_sec'] /
+                              records[0]['critical_steps_per_sec'])
+  return records
+
+
+def peak_rss():
+  """Gets the peak resident set size of the process (KB), if available."""
+  if resource is None:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # bytes on Mac OS X, kilobytes elsewhere
+  return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def key(record):
+  """Gets the key that identifies the case of a record."""
+  return (record['benchmark'], record['storage'], tuple(record['size']),
+          record['ants'])
+
+
+def run(benchmarks, storages, sizes, ants, steps, seed=0, report=None):
+  """Runs every case of the matrix, each one in a fresh process. Returns the
+  list of the records."""
+  cases = [(b, st, tuple(sz), n, steps, seed)
+           for st in storages for sz in sizes for n in ants for b in benchmarks]
+  records = []
+  pool = multiprocessing.Pool(1, maxtasksperchild=1)
+  try:
+    for record in pool.imap(measure, cases):
+      if record is not None:
+        records.append(record)
+        if report:
+          report(record)
+  finally:
+    pool.close()
+    pool.join()
+  return records
+
+
+def compare(records, baseline, threshold):
+  """Compares the records with the baseline ones. Returns the list of the
+  (record, baseline record) whose steps per second dropped by more than the
+  threshold (a fraction)."""
+  reference = dict((key(r), r) for r in baseline)
+  regressions = []
+  for r in records:
+    b = reference.get(key(r))
+    if b and r['steps_per_sec'] < b['steps_per_sec'] * (1 - threshold):
+      regressions.append((r, b))
+  return regressions
+
+
+def describe(record):
+  """Gets a one line description of a record."""
+  return ('{benchmark:>12} {storage:>5} {size[0]:>4}x{size[1]:<4} '
+          '{ants:>5} ants: {steps_per_sec:10.1f} steps/sec '
+          '{ns_per_ant_step:12.1f} ns/ant-step').format(**record)
+
+
+
+def main(argv=None):
+  """Runs the benchmarks from the command line."""
+  parser = argparse.ArgumentParser(description='Ants simulator benchmarks.')
+  parser.add_argument('--full', action='store_true',
+                      help='run the full matrix of sizes and ants')
+  parser.add_argument('--sizes', type=int, nargs='+',
+                      help='world sizes, as width height pairs')
+  parser.add_argument('--ants', type=int, nargs='+', help='numbers of ants')
+  parser.add_argument('--storages', nargs='+', choices=STORAGES,
+                      default=STORAGES, help='world and ants storages')
+  parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS,
+                      default=BENCHMARKS, help='benchmarks to run')
+  parser.add_argument('--steps', type=int, default=20,
+                      help='number of steps (default: %(default)s)')
+  parser.add_argument('--seed', type=int, default=0,
+                      help='random seed (default: %(default)s)')
+  parser.add_argument('-o', '--output', help='JSON file of the results')
+  parser.add_argument('--baseline', help='JSON file of the baseline results')
+  parser.add_argument('--threshold', type=float, default=0.2,
+                      help='max slowdown vs the baseline (default: 0.2)')
+  parser.add_argument('--neighbors', action='store_true',
+                      help='only run the neighbor lookup microbenchmark')
+  parser.add_argument('--tiled', type=int, nargs='*', metavar='T',
+                      help='only run the tiled scaling benchmark, with the '
+                      'given grids of tiles (TX TY pairs, default: {})'.format(
+                        ' '.join('{} {}'.format(*g) for g in TILINGS)))
+  args = parser.parse_args(argv)
+  if args.neighbors:
+    size = tuple(args.sizes[:2]) if args.sizes else (500, 500)
+    ants = args.ants[0] if args.ants else 1000
+    results = neighbors(size, ants, args.steps)
+    for name in sorted(results):
+      print('{}: {:.1f}'.format(name, results[name]))
+    return 0
+  if args.tiled is not None:
+    grids = list(zip(args.tiled[::2], args.tiled[1::2])) or TILINGS
+    size = tuple(args.sizes[:2]) if args.sizes else TILED_SIZE
+    ants = args.ants[0] if args.ants else TILED_ANTS
+    records = tiled(size, ants, grids, args.steps, args.seed)
+    for r in records:
+      print('{tiles[0]}x{tiles[1]} tiles: {steps_per_sec:8.1f} steps/sec, '
+            'critical path {critical_steps_per_sec:8.1f} steps/sec '
+            '(speedup {speedup:.2f})'.format(**r))
+    if args.output:
+      with open(args.output, 'w') as f:
+        json.dump(records, f, indent=2, sort_keys=True)
+    return 0
+  if args.sizes:
+    sizes = list(zip(args.sizes[::2], args.sizes[1::2]))
+  else:
+    sizes = FULL_SIZES if args.full else SIZES
+  ants = args.ants or (FULL_ANTS if args.full else ANTS)
+  storages = [st for st in args.storages
+              if st == 'cells' or entity.numpy is not None]
+  report = lambda r: (print(describe(r)), sys.stdout.flush())
+  records = run(args.benchmarks, storages, sizes, ants, args.steps, args.seed,
+                report)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(records, f, indent=2, sort_keys=True)
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      regressions = compare(records, json.load(f), args.threshold)
+    for r, b in regressions:
+      print('REGRESSION {} (baseline {:.1f} steps/sec)'.format(
+        describe(r), b['steps_per_sec']))
+    if regressions:
+      return 1
+  return 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
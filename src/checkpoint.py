@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+"""Ants simulator checkpoints module.
+A checkpoint stores the whole state of a Simulation (configuration, counters,
+cells, ants and random generators) in a compact binary file, so that a run can
+be stopped and resumed later, giving the same results of an uninterrupted run.
+
+The file starts with a fixed prefix: the MAGIC bytes, the format version, the
+length and the offset of the JSON header (little-endian, '<IIQ'). The header
+describes the simulation and the sections: packed little-endian arrays,
+aligned to 8 bytes, that can be read in place from a memory map."""
+
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import entity
+import population
+import rng
+import sim
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+MAGIC = b'ANTSCKPT'
+VERSION = 4
+# versions that can be read (the version 2 has no colonies, the paths of the
+# objects ants of the versions before 4 can't be read)
+READABLE = 2, 3, 4
+# version, header length and header offset
+PREFIX = struct.Struct('<IIQ')
+# NumPy types of the array typecodes used in the sections
+DTYPES = {'B': '<u1', 'i': '<i4', 'q': '<i8', 'Q': '<u8', 'd': '<f8'}
+# sections of the grid, in the same order of Cell.__slots__
+GRID = (('food_quantities', 'q'), ('food_strengths', 'q'),
+        ('food_lifespans', 'd'), ('colony_strengths', 'q'),
+        ('colony_lifespans', 'd'))
+
+
+
+def pack(values, typecode):
+  """Packs the values (a sequence or a NumPy array) as little-endian bytes."""
+  if numpy is not None and isinstance(values, numpy.ndarray):
+    return numpy.ascontiguousarray(values, dtype=DTYPES[typecode]).tobytes()
+  packed = array.array(typecode, values)
+  if sys.byteorder == 'big':
+    packed.byteswap()
+  return packed.tobytes()
+
+
+def unpack(buf, typecode, offset, count):
+  """Reads count values of the section at offset of buf. With NumPy the
+  result is an array that shares the memory of buf, otherwise a copy."""
+  if numpy is not None:
+    return numpy.frombuffer(buf, DTYPES[typecode], count, offset)
+  values = array.array(typecode)
+  values.frombytes(buf[offset:offset + count * values.itemsize])
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return values
+
+
+def columns(world):
+  """Gets the packed (name, typecode, bytes) sections of the grid."""
+  if isinstance(world, entity.ArrayWorld):
+    return [(name, t, pack(getattr(world, name), t)) for name, t in GRID]
+  # the cells never created (None) are empty
+  cells = world.cells
+  return [(name, t, pack([0 if c is None else getattr(c, field)
+                          for c in cells], t))
+          for (name, t), field in zip(GRID, entity.Cell.__slots__)]
+
+
+def ant_sections(ants):
+  """Gets the packed (name, typecode, bytes) sections of the ants table."""
+  if isinstance(ants, population.Population):
+    n = len(ants)
+    return [('location', 'i', pack(ants.location[:n], 'i')),
+            ('direction', 'q', pack(ants.direction[:n], 'q')),
+            ('food', 'q', pack(ants.food[:n], 'q')),
+            ('age', 'q', pack(ants.age[:n], 'q')),
+            ('key', 'Q', pack(ants.key[:n], 'Q')),
+            ('colony', 'q', pack(ants.colony[:n], 'q')),
+            ('path_length', 'q', pack(ants.path_length[:n], 'q')),
+            ('path_head', 'q', pack(ants.path_head[:n], 'q')),
+            ('path', 'i', pack(ants.path[:n].ravel(), 'i'))]
+  return [('location', 'i', pack([a.location for a in ants], 'i')),
+          ('rank', 'q', pack(ants.ranks(), 'q')),
+          ('direction', 'q', pack([a.direction for a in ants], 'q')),
+          ('food', 'q', pack([a.food_quantity for a in ants], 'q')),
+          ('age', 'q', pack([a.age for a in ants], 'q')),
+          ('key', 'Q', pack([a.key for a in ants], 'Q')),
+          ('path_length', 'q', pack([len(a.path) for a in ants], 'q')),
+          ('path', 'i', pack([l for a in ants for l in a.path], 'i'))]
+
+
+def save(simulation, filename):
+  """Writes the checkpoint of the simulation in filename. The file is
+  replaced only once completely written."""
+  world = simulation.world
+  # the pending evaporations are applied, the live cells are the same
+  world.settle()
+  ants = world.ants
+  batched = isinstance(ants, population.Population)
+  sections = columns(world) + [('ants.' + n, t, b)
+                               for n, t, b in ant_sections(ants)]
+  if not isinstance(world, entity.ArrayWorld):
+    sections.append(('live', 'i', pack(sorted(world.live), 'i')))
+  if isinstance(world, entity.ColoniesWorld):
+    storage = 'colonies'
+    sections.append(('nest_food_quantities', 'q',
+                     pack(world.nest_food_quantities, 'q')))
+  elif isinstance(world, entity.NestsWorld):
+    # the other layouts are saved by their own module (see ensemble.save)
+    raise ValueError('Unsupported world: {}'.format(type(world).__name__))
+  elif isinstance(world, entity.ArrayWorld):
+    storage = 'numpy'
+  else:
+    storage = 'cells'
+  header = {
+    'configuration': simulation.configuration,
+    'steps': simulation.steps,
+    'peak_ants': simulation.peak_ants,
+    'initial_food_quantity': simulation.initial_food_quantity,
+    'elapsed': simulation.elapsed,
+    'world': {
+      'storage': storage,
+      'size': list(world.size),
+      'nest': world.nest,
+      'nests': list(world.nests),
+      'food_quantity': world.food_quantity,
+      'nest_food_quantity': world.nest_food_quantity,
+    },
+    'ants': {
+      'storage': 'numpy' if batched else 'objects',
+      'count': len(ants),
+      'memory': ants.memory if batched else None,
+      'age': None if batched else ants.age,
+    },
+    'rng': world.rng.state(),
+  }
+  write(filename, header, sections)
+
+
+def write(filename, header, sections):
+  """Writes a checkpoint file of the header and of the packed (name,
+  typecode, bytes) sections, whose places are added to the header. The file
+  is replaced only once completely written."""
+  header['sections'] = dict()
+  tmp = filename + '.tmp'
+  with open(tmp, 'wb') as f:
+    f.write(MAGIC + PREFIX.pack(VERSION, 0, 0))
+    for name, typecode, data in sections:
+      offset = f.tell()
+      itemsize = struct.calcsize('<' + typecode)
+      header['sections'][name] = typecode, offset, len(data) // itemsize
+      f.write(data)
+      f.write(b'\0' * (-len(data) % 8))
+    offset = f.tell()
+    text = json.dumps(header, sort_keys=True).encode('utf-8')
+    f.write(text)
+    f.seek(len(MAGIC))
+    f.write(PREFIX.pack(VERSION, len(text), offset))
+  os.replace(tmp, filename)
+
+
+def load(filename):
+  """Maps the checkpoint in filename. Returns its header and the function
+  that reads a section by name. The map is private (copy on write): changing
+  the arrays read from it doesn't change the file."""
+  with open(filename, 'rb') as f:
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+  if buf[:len(MAGIC)] != MAGIC:
+    raise ValueError('Not a checkpoint: {}'.format(filename))
+  version, length, offset = PREFIX.unpack_from(buf, len(MAGIC))
+  if version not in READABLE:
+    raise ValueError('Unsupported checkpoint version: {}'.format(version))
+  header = json.loads(buf[offset:offset + length].decode('utf-8'))
+  def section(name):
+    typecode, offset, count = header['sections'][name]
+    return unpack(buf, typecode, offset, count)
+  return header, section
+
+
+def restore_world(header, section):
+  """Rebuilds the world (without its ants) of a checkpoint."""
+  w = header['world']
+  size = tuple(w['size'])
+  if w['storage'] == 'colonies':
+    world = entity.ColoniesWorld(size, [(0, 0)] * len(w['nests']), 0)
+    world.colony_nests[:] = w['nests']
+    world.nest_food_quantities[:] = section('nest_food_quantities')
+  elif w['storage'] == 'numpy':
+    world = entity.ArrayWorld(size, (0, 0), w['nest_food_quantity'])
+  if w['storage'] in ('colonies', 'numpy'):
+    # the arrays are used in place, their pages are copied only when changed
+    for name, _ in GRID:
+      setattr(world, name,
+              section(name).reshape(getattr(world, name).shape))
+  else:
+    if header['configuration'].get('pheromone_decay') == 'lazy':
+      world = entity.LazyWorld(size, (0, 0), w['nest_food_quantity'])
+    else:
+      world = entity.World(size, (0, 0), w['nest_food_quantity'])
+    values = [section(name).tolist() for name, _ in GRID]
+    for location, (fq, fs, fl, cs, cl) in enumerate(zip(*values)):
+      # only the cells that aren't empty are created
+      if not (fq or fs or fl or cs or cl):
+        continue
+      cell = world[location]
+      cell.food_quantity = fq
+      cell.food_strength = fs
+      cell.food_lifespan = fl
+      cell.colony_strength = cs
+      cell.colony_lifespan = cl
+    world.live = set(section('live'))
+    world.food_cells = set(l for l, q in enumerate(values[0]) if q > 0)
+  world.nest = w['nest']
+  world.food_quantity = w['food_quantity']
+  return world
+
+
+def restore_ants(world, header, section):
+  """Rebuilds the ants of a checkpoint in the world."""
+  a = header['ants']
+  n = a['count']
+  def column(name):
+    return section('ants.' + name).tolist()
+  if a['storage'] == 'numpy':
+    ants = population.Population(world, max(64, n), a['memory'])
+    ants.count = n
+    for name in ('location', 'direction', 'food', 'age', 'key', 'path_length',
+                 'path_head'):
+      getattr(ants, name)[:n] = section('ants.' + name)
+    if 'ants.colony' in header['sections']:
+      ants.colony[:n] = section('ants.colony')
+    ants.path[:n] = numpy.reshape(section('ants.path'), (n, a['memory']))
+    world.ants = ants
+    return
+  if header['sections']['ants.path'][0] != 'i':
+    raise ValueError('The paths of the ants of this checkpoint version '
+                     "can't be read")
+  paths = section('ants.path').tolist()
+  start = 0
+  for location, direction, food, age, key, length in zip(
+      column('location'), column('direction'), column('food'), column('age'),
+      column('key'), column('path_length')):
+    ant = entity.Ant(world, direction)
+    ant.location = location
+    ant.food_quantity = food
+    ant.age = age
+    ant.key = key
+    for l in paths[start:start + length]:
+      ant.path.add(l)
+    start += length
+    world.ants.append(ant)
+  if a['age'] is not None:
+    world.ants.rerank(column('rank'), a['age'])
+
+
+def restore(filename):
+  """Rebuilds the Simulation saved in the checkpoint in filename, with the
+  state of its random numbers, so that it continues as it would have."""
+  header, section = load(filename)
+  world = restore_world(header, section)
+  restore_ants(world, header, section)
+  simulation = sim.Simulation(header['configuration'], world=world)
+  simulation.steps = header['steps']
+  simulation.peak_ants = header['peak_ants']
+  simulation.initial_food_quantity = header['initial_food_quantity']
+  simulation.elapsed = header['elapsed']
+  # after the ants, whose creation spawns new keys
+  world.rng = rng.Streams.restore(header['rng'])
+  return simulation
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+"""Ants simulator streaming client module.
+A Client views the simulation streamed by a server.Server in place of a
+worker.SimulationThread (as a replay.Player does): a background thread reads
+the messages and applies them to a WorldView, while the window takes its
+snapshots at its own frame rate.
+A paused Client stops reading: the server skips it to the next keyframe once
+its queue is full, so that when resumed it catches up with the simulation."""
+
+
+import json
+import zlib
+import socket
+import threading
+import server
+import snapshot
+
+
+
+class Client(object):
+  """Views a server stream, with the same interface of a SimulationThread."""
+
+  def __init__(self, host, port):
+    """Connects to the server at host:port and reads the header and the
+    first keyframe. The Client is paused."""
+    self.connection = socket.create_connection((host, port))
+    self.stream = self.connection.makefile('rb')
+    kind, payload = self.receive()
+    if kind != server.HEADER:
+      raise ValueError('Not a simulation stream: {}:{}'.format(host, port))
+    self.header = json.loads(payload.decode('utf-8'))
+    self.configuration = self.header['configuration']
+    self.size = tuple(self.header['size'])
+    self.nest = self.header['nest']
+    self.nests = self.header['nests']
+    self.view = snapshot.WorldView(self.size, self.nest, self.nests)
+    self.changed = None
+    # aggregates of the latest step (see record.FIELDS)
+    self.aggregates = None
+    self.lock = threading.Lock()
+    self.apply()
+    # the server stream is only a view, the speed is the server one
+    self.max_speed = False
+    self.running = threading.Event()
+    self.stopped = False
+    self.finished = False
+    self.reader = threading.Thread(target=self.read)
+    self.reader.daemon = True
+    self.reader.start()
+
+  def receive(self):
+    """Reads the next (kind, payload) message, None at the end of the
+    stream."""
+    head = self.stream.read(server.MESSAGE.size)
+    if len(head) < server.MESSAGE.size:
+      return None, None
+    kind, length = server.MESSAGE.unpack(head)
+    data = self.stream.read(length)
+    if len(data) < length:
+      return None, None
+    return kind, zlib.decompress(data)
+
+  def apply(self):
+    """Reads the next frame and applies it to the view. Returns False at the
+    end of the stream."""
+    kind, payload = self.receive()
+    if kind is None:
+      return False
+    if kind != server.FRAME:
+      return True
+    aggregates, frame = server.frame(payload)
+    with self.lock:
+      changed = self.view.apply(frame)
+      if changed is None or self.changed is None:
+        self.changed = None
+      else:
+        self.changed.update(changed)
+      self.aggregates = aggregates
+    return True
+
+  def read(self):
+    """Applies the frames while running, until the end of the stream or the
+    Client is stopped."""
+    while not self.stopped:
+      if not self.running.wait(0.1):
+        continue
+      try:
+        if self.apply():
+          continue
+      except (OSError, ValueError):
+        if self.stopped:
+          break
+      self.finished = True
+      break
+
+  def snapshot(self, full=False):
+    """Takes the snapshot of the changes of the view since the previous
+    snapshot."""
+    with self.lock:
+      view = self.view
+      if full or self.changed is None:
+        cells = tuple((l,) + v for l, v in view.cells.items())
+        full = True
+      else:
+        cells = tuple((l,) + view.cells.get(l, (0, 0, 0))
+                      for l in self.changed)
+      self.changed = set()
+      return snapshot.Snapshot(view.steps, view.over, view.nest_food_quantity,
+                               view.food_quantity, view.ants, cells, full)
+
+  def pause(self):
+    """Pauses the view, the stream is no longer read."""
+    self.running.clear()
+
+  def resume(self):
+    """Resumes the view."""
+    self.running.set()
+
+  def stop(self):
+    """Disconnects from the server."""
+    self.stopped = True
+    self.running.clear()
+    try:
+      self.connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self.connection.close()
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+"""Ants simulator compiled kernels module.
+The forage behavior (see behavior.KERNELS) of a Population and the pheromone
+evaporation of an ArrayWorld compiled to native code with Numba, when it's
+installed. The ants are moved one by one, but in the same phases of
+Population.step: first the ants drop or take the food (in the order of the
+population), then the others turn and finally move forward, each phase seeing
+the world left by the previous one. Therefore the results are the same of
+Population.step, random numbers included (see rng)."""
+
+
+import entity
+import instrument
+import rng
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  import numba
+except ImportError:
+  numba = None
+
+
+def jit(function):
+  """Compiles the function with Numba (if installed, otherwise the function
+  is left as it is)."""
+  if numba is None:
+    return function
+  return numba.njit(cache=True, nogil=True)(function)
+
+
+if numpy is not None:
+  GAMMA = numpy.uint64(rng.GAMMA)
+  MIX1, MIX2 = numpy.uint64(rng.MIX1), numpy.uint64(rng.MIX2)
+  ANT_DRAWS = numpy.uint64(rng.ANT_DRAWS)
+
+# events counted by forage (see instrument)
+COUNTERS = 'moves', 'deposits', 'fitness_steps', 'random_steps'
+
+
+
+@jit
+def uniform(key, counter):
+  """Gets the number of the stream key at counter (see rng.uniform)."""
+  z = key + counter * GAMMA
+  z = (z ^ (z >> numpy.uint64(30))) * MIX1
+  z = (z ^ (z >> numpy.uint64(27))) * MIX2
+  z ^= z >> numpy.uint64(31)
+  return float(z >> numpy.uint64(11)) * rng.UNIT
+
+
+@jit
+def in_path(path, i, cell):
+  """Returns True if the ant i recently passed through the cell."""
+  for j in range(path.shape[1]):
+    if path[i, j] == cell:
+      return True
+  return False
+
+
+@jit
+def deposit(strengths, lifespans, cells, lengths):
+  """Marks the cells with the pheromone of the paths of the given lengths:
+  the shortest path wins and the lifespan is reinforced once for each one.
+  The strengths (never negative) of the marked cells hold the first path
+  marking them (as -1 - path) while the paths are gathered, without sorting
+  them."""
+  shortest = lengths.copy()
+  times = numpy.zeros(len(cells), dtype=numpy.int64)
+  for i in range(len(cells)):
+    if strengths[cells[i]] >= 0:
+      strengths[cells[i]] = -1 - i
+  for i in range(len(cells)):
+    first = -1 - strengths[cells[i]]
+    shortest[first] = min(shortest[first], lengths[i])
+    times[first] += 1
+  for i in range(len(cells)):
+    if times[i]:
+      strengths[cells[i]] = shortest[i]
+      lifespans[cells[i]] += times[i]
+
+
+@jit
+def forage(count, location, direction, food, age, key, colony, path_length,
+           path_head, path, neighbors, food_quantities, food_strengths,
+           food_lifespans, colony_strengths, colony_lifespans, nests,
+           nest_food, gsp, cells, counts):
+  """Moves the ants of a population (given as its arrays) forward by one
+  step. The pheromone arrays are flattened, with a layer for each colony
+  every cells elements; nests, nest_food and gsp have a value for each
+  colony.
+  The events are added to counts (in the order of COUNTERS). Returns the food
+  dropped in the nests."""
+  foraging = food[:count] > 0
+  moving = numpy.zeros(count, dtype=numpy.bool_)
+  dropped = 0
+  # drop the food in the nest or take the food in the current cell
+  for i in range(count):
+    here, nest = location[i], nests[colony[i]]
+    if foraging[i] and here == nest:
+      nest_food[colony[i]] += food[i]
+      dropped += food[i]
+      food[i] = 0
+    elif not foraging[i] and food_quantities[here] > 0 and here != nest:
+      food_quantities[here] -= 1
+      food[i] += 1
+    else:
+      moving[i] = True
+      continue
+    path[i, :] = -1
+    path_length[i] = 0
+    path_head[i] = 0
+    direction[i] = (direction[i] + 4) % 8
+  # turn towards the nest (or the food) ahead, the pheromone or at random
+  for i in range(count):
+    if not moving[i]:
+      continue
+    here, nest, layer = location[i], nests[colony[i]], colony[i] * cells
+    ahead = direction[i]
+    turned = False
+    if foraging[i]:
+      for t in range(-2, 3):
+        d = (ahead + t) % 8
+        if neighbors[here, d] == nest:
+          direction[i] = d
+          turned = True
+          break
+      strengths, lifespans = colony_strengths, colony_lifespans
+    else:
+      for t in range(-1, 2):
+        d = (ahead + t) % 8
+        cell = neighbors[here, d]
+        if food_quantities[cell] > 0 and cell != nest:
+          direction[i] = d
+          turned = True
+          break
+      strengths, lifespans = food_strengths, food_lifespans
+    if turned:
+      continue
+    best, strongest = -1, 0
+    for t in range(-1, 2):
+      d = (ahead + t) % 8
+      cell = neighbors[here, d] + layer
+      strength = strengths[cell]
+      if strength > 0 and lifespans[cell] > 0 and (best < 0 or
+                                                   strength < strongest):
+        best, strongest = d, strength
+    if best >= 0:
+      direction[i] = best
+      counts[2] += 1
+      continue
+    counts[3] += 1
+    # random step (see Population.random_step)
+    counter = numpy.uint64(age[i]) * ANT_DRAWS
+    p = uniform(key[i], counter)
+    g = gsp[colony[i]]
+    if p < g and not in_path(path, i, neighbors[here, ahead]):
+      turn = 0
+    elif p < g + (1 - g) / 2 and not in_path(
+        path, i, neighbors[here, (ahead - 1) % 8]):
+      turn = 1
+    elif not in_path(path, i, neighbors[here, (ahead + 1) % 8]):
+      turn = -1
+    else:
+      # clockwise, counterclockwise or still
+      move = int(uniform(key[i], counter + numpy.uint64(1)) * 3)
+      turn = (1, -1, 0)[move]
+    direction[i] = (ahead + turn) % 8
+  # move forward, marking the cells not in the path with pheromone
+  food_cells = numpy.empty(count, dtype=numpy.int64)
+  food_lengths = numpy.empty(count, dtype=numpy.int64)
+  colony_cells = numpy.empty(count, dtype=numpy.int64)
+  colony_lengths = numpy.empty(count, dtype=numpy.int64)
+  f = c = 0
+  for i in range(count):
+    if not moving[i]:
+      continue
+    here = location[i]
+    if not in_path(path, i, here):
+      cell, length = here + colony[i] * cells, path_length[i]
+      if foraging[i]:
+        strength = food_strengths[cell]
+        if strength == 0 or strength >= length:
+          food_cells[f], food_lengths[f] = cell, length
+          f += 1
+      else:
+        strength = colony_strengths[cell]
+        if strength == 0 or strength >= length:
+          colony_cells[c], colony_lengths[c] = cell, length
+          c += 1
+      path[i, path_head[i]] = here
+      path_head[i] = (path_head[i] + 1) % path.shape[1]
+      path_length[i] += 1
+    location[i] = neighbors[here, direction[i]]
+  deposit(food_strengths, food_lifespans, food_cells[:f], food_lengths[:f])
+  deposit(colony_strengths, colony_lifespans, colony_cells[:c],
+          colony_lengths[:c])
+  counts[0] += numpy.count_nonzero(moving)
+  counts[1] += f + c
+  age[:count] += 1
+  return dropped
+
+
+@jit
+def evaporate(lifespans, factor):
+  """Decreases by factor the lifespans still positive (in place), in a
+  single pass over the flattened array."""
+  for i in range(len(lifespans)):
+    if lifespans[i] > 0:
+      lifespans[i] -= factor
+
+
+def step(ants, go_straight_probability):
+  """Performs a new action for every ant of the Population, as its step
+  method does."""
+  world = ants.world
+  n = ants.count
+  dirty = world.dirty
+  if dirty is not None:
+    dirty.update(ants.location[:n].tolist())
+  colonies = isinstance(world, entity.NestsWorld)
+  if colonies:
+    nests, nest_food = world.colony_nests, world.nest_food_quantities
+    layer = world.layer
+  else:
+    nests = numpy.array([world.nest], dtype=numpy.int64)
+    nest_food = numpy.array([world.nest_food_quantity], dtype=numpy.int64)
+    layer = 0
+  gsp = numpy.atleast_1d(numpy.asarray(go_straight_probability,
+                                       dtype=numpy.float64))
+  counts = numpy.zeros(len(COUNTERS), dtype=numpy.int64)
+  dropped = forage(n, ants.location, ants.direction, ants.food, ants.age,
+                   ants.key, ants.colony, ants.path_length, ants.path_head,
+                   ants.path, ants.neighbors, world.food_quantities,
+                   world.food_strengths.reshape(-1),
+                   world.food_lifespans.reshape(-1),
+                   world.colony_strengths.reshape(-1),
+                   world.colony_lifespans.reshape(-1), nests, nest_food, gsp,
+                   layer, counts)
+  if not colonies:
+    world.nest_food_quantity = int(nest_food[0])
+  world.food_quantity -= int(dropped)
+  if instrument.active is not None:
+    for name, n in zip(COUNTERS, counts.tolist()):
+      instrument.count(name, n)
+  if dirty is not None:
+    dirty.update(ants.location[:n].tolist())
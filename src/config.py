@@ -4,6 +4,90 @@
 import json
 
 
+# a pair of integers (e.g. the world size)
+PAIR = 'pair'
+# types of the configuration values (the integers are valid numbers)
+TYPES = {
+  'world_size': PAIR,
+  'world_storage': str,
+  'ants_storage': str,
+  'nest_location': PAIR,
+  'initial_food_quantity': int,
+  'max_ants_number': int,
+  'step_delay_ms': int,
+  'frames_per_second': int,
+  'max_speed': bool,
+  'zoom': int,
+  'food_places_number': int,
+  'food_quantity': int,
+  'life_expectancy_steps': int,
+  'food_quantity_per_ant': int,
+  'birth_delay_ms': int,
+  'death_delay_ms': int,
+  'go_straight_probability': float,
+  'behavior': str,
+  'compiled_behavior': bool,
+  'pheromone_decay': str,
+  'food_pheromone_decreasing_factor': float,
+  'colony_pheromone_decreasing_factor': float,
+  'ant_size': int,
+  'nest_size': int,
+  'pheromone_scale_decreasing_factor': int,
+  'draw_colony_pheromone_lifespan': bool,
+  'draw_food_pheromone_lifespan': bool,
+  'colony_pheromone_color': str,
+  'food_pheromone_color': str,
+  'food_color': str,
+  'nest_color': str,
+  'ant_color': str,
+  'ant_foraging_color': str,
+  'background_color': str,
+  'renderer': str,
+  'colonies': list,
+}
+# values allowed for the settings among a set of names (the behaviors are
+# added by behavior.register)
+CHOICES = {
+  'world_storage': {'cells', 'numpy'},
+  'ants_storage': {'objects', 'numpy'},
+  'pheromone_decay': {'eager', 'lazy'},
+  'renderer': {'shapes', 'framebuffer'},
+  'behavior': {'forage', 'wander'},
+}
+
+
+def valid(value, kind):
+  """Returns True if the value is of the given kind (see TYPES)."""
+  if kind == PAIR:
+    return (isinstance(value, (list, tuple)) and len(value) == 2 and
+            all(valid(v, int) for v in value))
+  if kind is bool:
+    return isinstance(value, bool)
+  if isinstance(value, bool):
+    return False
+  if kind is float:
+    return isinstance(value, (int, float))
+  return isinstance(value, kind)
+
+
+def validate(configuration):
+  """Raises a ValueError if some values of the configuration (or of its
+  colonies) have the wrong type or are not among their CHOICES; the keys not
+  in TYPES are left unchecked. Returns the configuration."""
+  wrong = sorted(k for k, kind in TYPES.items()
+                 if k in configuration and
+                 not (valid(configuration[k], kind) and
+                      (k not in CHOICES or configuration[k] in CHOICES[k])))
+  if wrong:
+    raise ValueError('Invalid configuration values: {}'.format(
+        ', '.join(wrong)))
+  for colony in configuration.get('colonies') or ():
+    if not isinstance(colony, dict):
+      raise ValueError('Invalid colony settings: {}'.format(colony))
+    validate(colony)
+  return configuration
+
+
 def serialize(filename, configuration):
   """Serialize the given configuration."""
   with open(filename, 'w') as f:
@@ -11,18 +95,22 @@ def serialize(filename, configuration):
 
 
 def deserialize(filename):
-  """Deerialize the given file."""
+  """Deserialize (and validate) the given file."""
   with open(filename, 'r') as f:
-    return json.load(f)
+    return validate(json.load(f))
 
 
 def default():
   config = dict()
   config['world_size'] = 50, 40
+  config['world_storage'] = 'cells'
+  config['ants_storage'] = 'objects'
   config['nest_location'] = 30, 20
   config['initial_food_quantity'] = 50
   config['max_ants_number'] = 200
   config['step_delay_ms'] = 100
+  config['frames_per_second'] = 25
+  config['max_speed'] = False
   config['zoom'] = 11
   config['food_places_number'] = 30
   config['food_quantity'] = 25
@@ -31,6 +119,9 @@ def default():
   config['birth_delay_ms'] = 500
   config['death_delay_ms'] = 500
   config['go_straight_probability'] = 0.9
+  config['behavior'] = 'forage'
+  config['compiled_behavior'] = True
+  config['pheromone_decay'] = 'eager'
   config['food_pheromone_decreasing_factor'] = 0.01
   config['colony_pheromone_decreasing_factor'] = 0.005
   config['ant_size'] = 5
@@ -45,4 +136,5 @@ def default():
   config['ant_color'] = 'Green'
   config['ant_foraging_color'] = 'Purple'
   config['background_color'] = 'White'
+  config['renderer'] = 'shapes'
   return 'config.json', config
@@ -0,0 +1,439 @@
+#! /usr/bin/env python
+"""Ants simulator ensemble module.
+An Ensemble runs the same configuration with many seeds in a single process:
+the K worlds (the members) are stacked in an EnsembleWorld, and the ants of
+all of them are in a single Population, so that each step of the ensemble is
+a single sim.step call, whatever the number of members.
+The cells of the member m are the block of locations starting at m * cells
+(as if the members were side by side along x), with a neighbors table that
+wraps every block on itself; the ants of a member have its number as colony,
+which selects their nest and its food. The pheromone of the members is in a
+single layer, since their cells don't overlap.
+
+Each member has the random numbers of its seed and keeps its ants in the same
+order of a Simulation of its own: a member runs exactly as a Simulation (of
+NumPy world and ants) with its seed. Once over (no more ants or no more food)
+a member is reported and its ants are removed, while the others go on."""
+
+
+import sys
+import csv
+import time
+import array
+import argparse
+import behavior
+import checkpoint
+import config
+import entity
+import instrument
+import population
+import rng
+import sim
+import sweep
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# members stepped together from the command line: beyond a few tens, the
+# cells of the members no longer fit the CPU caches and the steps get slower
+BATCH = 32
+
+
+class Member(object):
+  """View of a member of an EnsembleWorld as a world of its own, with its
+  size, random numbers and nest (see sim.place_food and entity.Ant). Its
+  locations are the ones in the EnsembleWorld."""
+
+  def __init__(self, world, member, seed):
+    """Creates and initializes the Member view."""
+    self.world = world
+    self.member = member
+    self.rng = rng.Streams(seed)
+    self.size = world.member_size
+    self.offset = member * world.member_cells
+    self.nest = int(world.colony_nests[member])
+    # food placed in the cells of the member
+    self.food_quantity = 0
+
+  def index(self, coords):
+    """Gets the location of the cell in (x, y) coordinates."""
+    x, y = coords
+    width, height = self.size
+    return self.offset + x % width * height + y % height
+
+  @property
+  def nests(self):
+    """Gets the location of the nest."""
+    return (self.nest,)
+
+  @property
+  def nest_food_quantity(self):
+    """Gets the food in the nest."""
+    return int(self.world.nest_food_quantities[self.member])
+
+  @nest_food_quantity.setter
+  def nest_food_quantity(self, value):
+    """Sets the food in the nest."""
+    self.world.nest_food_quantities[self.member] = value
+
+  def __getitem__(self, location):
+    """Gets a view of the cell in location."""
+    return self.world[location]
+
+  def mark_food(self, location):
+    """Updates the index of the cells with food (see World)."""
+    self.world.mark_food(location)
+
+  def mark_dirty(self, location):
+    """Marks the cell in location as changed (see World)."""
+    self.world.mark_dirty(location)
+
+
+
+class EnsembleWorld(entity.NestsWorld):
+  """NestsWorld of independent worlds of the same size, one for each seed
+  (see Member), whose nests are the colonies. The arrays are flat, with a
+  block of cells for each member; the pheromone of every member is in the
+  same layer (layer is 0)."""
+
+  def __init__(self, size, nest_location, nest_food_quantity, seeds):
+    """Creates and initializes the EnsembleWorld instance, with a member for
+    each seed."""
+    if numpy is None:
+      raise ImportError('EnsembleWorld requires NumPy')
+    # the random numbers are the ones of each member
+    self.rng = None
+    self.member_size = tuple(size)
+    width, height = size
+    self.colonies = len(seeds)
+    self.member_cells = width * height
+    self.size = (self.colonies * width, height)
+    cells = self.colonies * self.member_cells
+    self.food_quantities = numpy.zeros(cells, dtype=numpy.int64)
+    self.food_strengths = numpy.zeros(cells, dtype=numpy.int64)
+    self.food_lifespans = numpy.zeros(cells)
+    self.colony_strengths = numpy.zeros(cells, dtype=numpy.int64)
+    self.colony_lifespans = numpy.zeros(cells)
+    self.layer = 0
+    self.build_tables()
+    x, y = nest_location
+    nest = x % width * height + y % height
+    self.colony_nests = (numpy.arange(self.colonies, dtype=numpy.int64) *
+                         self.member_cells + nest)
+    self.nest = int(self.colony_nests[0])
+    self.nest_food_quantities = numpy.full(self.colonies, nest_food_quantity,
+                                           dtype=numpy.int64)
+    self.dirty = None
+    self.ants = population.Population(self)
+    self.food_quantity = 0
+    self.members = [Member(self, m, seed) for m, seed in enumerate(seeds)]
+
+  def build_tables(self):
+    """Builds the tables of the neighbors of each cell: the table of a member
+    repeated for each block, shifted to its locations."""
+    table = numpy.frombuffer(entity.neighbors_table(self.member_size),
+                             dtype=numpy.int32)
+    offsets = numpy.arange(self.colonies, dtype=numpy.int32) * numpy.int32(
+      self.member_cells)
+    table = table[None, :] + offsets[:, None]
+    self.neighbors = array.array('i')
+    self.neighbors.frombytes(numpy.ascontiguousarray(table).data.cast('B'))
+    self.adjacent = entity.ArrayNeighbors(self)
+
+  def member_ants(self):
+    """Gets the number of ants of each member."""
+    ants = self.ants
+    return numpy.bincount(ants.colony[:len(ants)], minlength=self.colonies)
+
+  def member_food(self):
+    """Gets the food left of each member: in its cells and carried by its
+    ants."""
+    ants = self.ants
+    n = len(ants)
+    carried = numpy.bincount(ants.colony[:n], weights=ants.food[:n],
+                             minlength=self.colonies)
+    cells = self.food_quantities.reshape(self.colonies, -1).sum(axis=1)
+    return cells + carried.astype(numpy.int64)
+
+
+
+def create_world(configuration, seeds):
+  """Creates the EnsembleWorld of the configuration with a member for each
+  seed, and places the food of each member."""
+  size = tuple(configuration['world_size'])
+  nest_loc = tuple(configuration['nest_location'])
+  food_qty = configuration['initial_food_quantity']
+  world = EnsembleWorld(size, nest_loc, food_qty, seeds)
+  for member in world.members:
+    sim.place_food(member, configuration['food_places_number'],
+                   configuration['food_quantity'])
+  world.food_quantity = sum(m.food_quantity for m in world.members)
+  return world
+
+
+def birth(world, food_qty, running, upper_bound=None):
+  """Adds a new ant to each running member if possible (see sim.birth).
+  Returns the number of ants born."""
+  ants = world.ants
+  fed = running & (world.nest_food_quantities >= food_qty)
+  if upper_bound:
+    fed &= world.member_ants() < upper_bound
+  born = numpy.flatnonzero(fed).tolist()
+  for m in born:
+    member = world.members[m]
+    verse = member.rng.stream('birth').randrange(8)
+    member.nest_food_quantity -= food_qty
+    ants.append(entity.Ant(member, verse), m)
+  return len(born)
+
+
+def death(world, life_expectancy):
+  """Kills an old ant of each member if any (see sim.death). Each dying ant
+  is replaced by the last ant of its member, so that the ants of a member
+  are in the order of its own Simulation. Returns the number of dead ants."""
+  ants = world.ants
+  n = len(ants)
+  colony = ants.colony[:n]
+  ancients = numpy.flatnonzero(ants.age[:n] > life_expectancy)
+  if not len(ancients):
+    return 0
+  # the ancients of each member, in order, and a random one of them
+  ancients = ancients[numpy.argsort(colony[ancients], kind='stable')]
+  members, first, counts = numpy.unique(colony[ancients], return_index=True,
+                                        return_counts=True)
+  streams = [world.members[m].rng.stream('death') for m in members.tolist()]
+  keys = numpy.array([s.key for s in streams], dtype=numpy.uint64)
+  counters = numpy.array([s.counter for s in streams], dtype=numpy.uint64)
+  for s in streams:
+    s.counter += 1
+  dying = ancients[first + (rng.uniforms(keys, counters) *
+                            counts).astype(numpy.int64)]
+  # drop their food
+  location, food = ants.location[dying], ants.food[dying]
+  home = location == world.colony_nests[members]
+  numpy.add.at(world.nest_food_quantities, members[home], food[home])
+  world.food_quantity -= int(food[home].sum())
+  numpy.add.at(world.food_quantities, location[~home], food[~home])
+  # the last ant of each member takes the place of the dying one
+  last = numpy.full(world.colonies, -1, dtype=numpy.int64)
+  numpy.maximum.at(last, colony, numpy.arange(n))
+  last = last[members]
+  for name in population.STATE:
+    a = getattr(ants, name)
+    a[dying] = a[last]
+  ants.take(last)
+  return len(dying)
+
+
+
+class Ensemble(object):
+  """Runs a simulation of the same configuration for each seed, as the
+  members of an EnsembleWorld. The configuration can't have colonies; the
+  world and ants storage settings are ignored (the members are always NumPy
+  arrays)."""
+
+  def __init__(self, configuration, seeds, world=None):
+    """Creates the world (unless given) and initializes the Ensemble
+    instance."""
+    if configuration.get('colonies'):
+      raise ValueError('An ensemble requires a configuration without '
+                       'colonies')
+    self.configuration = configuration
+    self.seeds = list(seeds)
+    self.world = world or create_world(configuration, self.seeds)
+    k = len(self.seeds)
+    self.steps = 0
+    self.elapsed = 0.0
+    self.peak_ants = numpy.zeros(k, dtype=numpy.int64)
+    self.initial_food_quantities = numpy.array(
+      [m.food_quantity for m in self.world.members], dtype=numpy.int64)
+    # members still running, and the reports of the ones over
+    self.running = numpy.ones(k, dtype=bool)
+    self.reports = dict()
+    step_delay = configuration['step_delay_ms']
+    self.birth_every = sim.cadence(configuration['birth_delay_ms'], step_delay)
+    self.death_every = sim.cadence(configuration['death_delay_ms'], step_delay)
+    self.kernel = behavior.kernel(configuration)
+    self.native = configuration.get('compiled_behavior', True)
+    self.go_straight_probability = numpy.full(
+      k, configuration['go_straight_probability'])
+
+  def advance(self):
+    """Moves every running member forward by one step (see
+    Simulation.advance). Returns the members over after the step."""
+    start = time.time()
+    c = self.configuration
+    world = self.world
+    if self.steps % self.birth_every == 0:
+      with instrument.phase('birth'):
+        birth(world, c['food_quantity_per_ant'], self.running,
+              c['max_ants_number'])
+    sim.step(world, self.go_straight_probability,
+             c['colony_pheromone_decreasing_factor'],
+             c['food_pheromone_decreasing_factor'], self.kernel, self.native)
+    if self.steps % self.death_every == 0:
+      with instrument.phase('death'):
+        death(world, c['life_expectancy_steps'])
+    self.steps += 1
+    instrument.end_step()
+    ants = world.member_ants()
+    numpy.maximum(self.peak_ants, ants, out=self.peak_ants)
+    food = world.member_food()
+    over = numpy.flatnonzero(self.running & ((ants == 0) | (food == 0)))
+    self.elapsed += time.time() - start
+    for m in over.tolist():
+      self.reports[m] = self.report(m, int(ants[m]), int(food[m]), True)
+    if len(over):
+      # the ants of the members over stop
+      self.running[over] = False
+      pop = world.ants
+      pop.take(numpy.flatnonzero(~self.running[pop.colony[:len(pop)]]))
+    return over.tolist()
+
+  def report(self, member, ants, world_food, over):
+    """Gets the report of the member (see Simulation.report), with the given
+    number of ants and food left."""
+    collected = int(self.initial_food_quantities[member]) - world_food
+    return {
+      'steps': self.steps,
+      'over': over,
+      'ants': ants,
+      'peak_ants': int(self.peak_ants[member]),
+      'nest_food': self.world.members[member].nest_food_quantity,
+      'world_food': world_food,
+      'food_collected': collected,
+      'food_collected_per_step': float(collected) / max(1, self.steps),
+      'elapsed': self.elapsed,
+      'steps_per_sec': self.steps / self.elapsed if self.elapsed else 0.0,
+    }
+
+  def run(self, steps):
+    """Advances the members until they're over or the given number of steps
+    has been reached. Generates the (member, seed, report) of each member as
+    soon as it's over (the ones still running at the end last)."""
+    while self.steps < steps and self.running.any():
+      for m in self.advance():
+        yield m, self.seeds[m], self.reports[m]
+    ants = self.world.member_ants()
+    food = self.world.member_food()
+    for m in numpy.flatnonzero(self.running).tolist():
+      self.reports[m] = self.report(m, int(ants[m]), int(food[m]), False)
+      yield m, self.seeds[m], self.reports[m]
+
+
+
+def save(ensemble, filename):
+  """Writes the checkpoint of the ensemble in filename (see checkpoint.save):
+  the cells and the ants of its world, the random numbers of each member and
+  the state of the members."""
+  world = ensemble.world
+  ants = world.ants
+  pack = checkpoint.pack
+  sections = checkpoint.columns(world) + [
+    ('ants.' + n, t, b) for n, t, b in checkpoint.ant_sections(ants)]
+  sections += [
+    ('nest_food_quantities', 'q', pack(world.nest_food_quantities, 'q')),
+    ('peak_ants', 'q', pack(ensemble.peak_ants, 'q')),
+    ('initial_food_quantities', 'q',
+     pack(ensemble.initial_food_quantities, 'q')),
+    ('running', 'B', pack(ensemble.running, 'B'))]
+  header = {
+    'configuration': ensemble.configuration,
+    'seeds': ensemble.seeds,
+    'steps': ensemble.steps,
+    'elapsed': ensemble.elapsed,
+    # the (member, report) of the members over
+    'reports': sorted(ensemble.reports.items()),
+    'world': {
+      'storage': 'ensemble',
+      'size': list(world.member_size),
+      'nests': list(world.nests),
+      'food_quantity': world.food_quantity,
+    },
+    'ants': {
+      'storage': 'numpy',
+      'count': len(ants),
+      'memory': ants.memory,
+    },
+    'rng': [m.rng.state() for m in world.members],
+  }
+  checkpoint.write(filename, header, sections)
+
+
+def restore(filename):
+  """Rebuilds the Ensemble saved in the checkpoint in filename (see save),
+  with the random numbers of its members, so that it continues as it would
+  have."""
+  header, section = checkpoint.load(filename)
+  w = header['world']
+  if w['storage'] != 'ensemble':
+    raise ValueError('Not an ensemble checkpoint: {}'.format(filename))
+  seeds = header['seeds']
+  world = EnsembleWorld(w['size'], (0, 0), 0, seeds)
+  # the arrays are used in place, their pages are copied only when changed
+  for name, _ in checkpoint.GRID:
+    setattr(world, name, section(name))
+  world.colony_nests[:] = w['nests']
+  world.nest = int(world.colony_nests[0])
+  world.nest_food_quantities[:] = section('nest_food_quantities')
+  world.food_quantity = w['food_quantity']
+  checkpoint.restore_ants(world, header, section)
+  for member, state in zip(world.members, header['rng']):
+    member.nest = int(world.colony_nests[member.member])
+    member.rng = rng.Streams.restore(state)
+  ensemble = Ensemble(header['configuration'], seeds, world)
+  ensemble.steps = header['steps']
+  ensemble.elapsed = header['elapsed']
+  ensemble.peak_ants[:] = section('peak_ants')
+  ensemble.initial_food_quantities[:] = section('initial_food_quantities')
+  ensemble.running[:] = section('running')
+  ensemble.reports = {m: report for m, report in header['reports']}
+  return ensemble
+
+
+
+def main(argv=None):
+  """Runs the members of an ensemble from the command line, in consecutive
+  Ensembles of a batch of members, writing a row of the results (see
+  sweep.COLUMNS) as soon as each member is over."""
+  parser = argparse.ArgumentParser(description='Ants simulator ensemble.')
+  parser.add_argument('config', nargs='?', help='program configuration file')
+  parser.add_argument('-k', '--members', type=int, default=64,
+                      help='number of members (default: %(default)s)')
+  parser.add_argument('-n', '--steps', type=int, default=10000,
+                      help='maximum number of steps (default: %(default)s)')
+  parser.add_argument('-s', '--seed', type=int, default=0,
+                      help='seed of the first member, the others follow '
+                      '(default: %(default)s)')
+  parser.add_argument('-b', '--batch', type=int, default=BATCH,
+                      help='members stepped together (default: %(default)s)')
+  parser.add_argument('-o', '--output', help='CSV results file (default: stdout)')
+  args = parser.parse_args(argv)
+  if args.config:
+    configuration = config.deserialize(args.config)
+  else:
+    _, configuration = config.default()
+  out = open(args.output, 'w') if args.output else sys.stdout
+  try:
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(('member', 'seed') + sweep.COLUMNS)
+    for first in range(0, args.members, args.batch):
+      seeds = range(args.seed + first,
+                    args.seed + min(args.members, first + args.batch))
+      ensemble = Ensemble(configuration, seeds)
+      for member, seed, report in ensemble.run(args.steps):
+        writer.writerow((first + member, seed) +
+                        tuple(report[c] for c in sweep.COLUMNS))
+        out.flush()
+  finally:
+    if args.output:
+      out.close()
+  return 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
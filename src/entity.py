@@ -2,91 +2,880 @@
 """Ants simulator entities module."""
 
 
+import math
+import array
+import collections
+import instrument
+import rng
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# delta used to move the ant and reach its neighbors (clockwise)
+DELTA = (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)
+# initial number of slots of the path of an ant (a power of 2)
+PATH_SLOTS = 16
+# multiplier used to spread the locations over the slots of a path
+PATH_MIXER = 0x9E3779B97F4A7C15
+# evaporations between two visits of all the live cells of a LazyWorld
+SETTLE_STEPS = 64
+
+
 
 def food_lifespan(cell):
   """Gets the food pheromone lifespan."""
-  return cell.food_ph[1]
+  return cell.food_lifespan
 
 
 def food_strength(cell):
   """Gets the food pheromone strength."""
-  return cell.food_ph[0]
+  return cell.food_strength
 
 
 def colony_lifespan(cell):
   """Gets the colony pheromone lifespan."""
-  return cell.colony_ph[1]
+  return cell.colony_lifespan
 
 
 def colony_strength(cell):
   """Gets the colony pheromone strength."""
-  return cell.colony_ph[0]
+  return cell.colony_strength
+
+
+def decayed(lifespan, factor, steps):
+  """Gets the lifespan after the given number of evaporations, each one
+  subtracting factor while the lifespan is positive, equal (to the last bit)
+  to the one of the repeated float subtractions. Within a binade, where the
+  spacing (unit) of the floats is constant, each subtraction removes factor
+  rounded to the unit: the steps that stay inside it are applied at once."""
+  while steps > 0 and lifespan > 0:
+    lifespan -= factor
+    steps -= 1
+    if not steps or lifespan <= 0 or factor <= 0:
+      break
+    _, exponent = math.frexp(lifespan)
+    unit = math.ldexp(1.0, exponent - 53)
+    # halfway between two units, the rounding depends on the lifespan
+    if math.fmod(factor, unit) * 2 == unit:
+      continue
+    rounded = round(factor / unit) * unit
+    if rounded > 0:
+      # the last one keeps at least a unit above the binade
+      low = math.ldexp(0.5, exponent)
+      jumps = min(steps, int((lifespan - low) / rounded) - 1)
+      if jumps > 0:
+        lifespan -= jumps * rounded
+        steps -= jumps
+  return lifespan
+
+
+def unit(value):
+  """Gets the spacing of the floats around value (its unit in the last
+  place, see decayed)."""
+  return math.ldexp(1.0, math.frexp(value)[1] - 53)
+
 
+def alive(lifespan, factor, steps):
+  """Returns True if the lifespan is still positive after the given number of
+  evaporations (see decayed). Each subtraction is rounded by at most half a
+  unit of the lifespan, therefore decayed is only needed close to 0."""
+  if lifespan <= 0:
+    return False
+  if not steps:
+    return True
+  left = lifespan - steps * factor
+  error = steps * (unit(lifespan) + unit(factor))
+  if abs(left) > error:
+    return left > 0
+  return decayed(lifespan, factor, steps) > 0
 
 
-class Cell:
+def neighbors_table(size):
+  """Builds the table of the neighbors of each cell of a torus of the given
+  size, as a flat array where the index of the neighbor of the cell i in
+  direction d (see DELTA) is at position i * 8 + d."""
+  width, height = size
+  if numpy is not None:
+    # the neighbor of (x, y) in direction d is the sum of a term of x and d
+    # and of a term of y and d: both are computed once, and the table is
+    # filled a column at a time, in place
+    dx, dy = numpy.array(DELTA, dtype=numpy.int32).T
+    xs = (numpy.arange(width, dtype=numpy.int32)[:, None] + dx) % width
+    ys = (numpy.arange(height, dtype=numpy.int32)[:, None] + dy) % height
+    xs *= numpy.int32(height)
+    neighbors = array.array('i', (0,)) * (width * height * 8)
+    table = numpy.frombuffer(neighbors, dtype=numpy.int32).reshape(
+      width, height, 8)
+    for x in range(width):
+      numpy.add(xs[x], ys, out=table[x])
+    return neighbors
+  table = array.array('i')
+  for x in range(width):
+    for y in range(height):
+      table.extend((x + dx) % width * height + (y + dy) % height
+                   for dx, dy in DELTA)
+  return table
+
+
+
+class Cell(object):
   """Represents a single cell."""
 
+  __slots__ = ('food_quantity', 'food_strength', 'food_lifespan',
+               'colony_strength', 'colony_lifespan')
+
   def __init__(self, food_quantity=0):
     """Creates and initializes the Cell instance."""
     self.food_quantity = food_quantity
-    # strength - lifespan
-    self.food_ph = [0, 0]
-    self.colony_ph = [0, 0]
+    self.food_strength = 0
+    self.food_lifespan = 0
+    self.colony_strength = 0
+    self.colony_lifespan = 0
 
   def food_fitness(self):
-    """Cell fitness for an ant seeking for food."""
-    return self.food_ph
+    """Cell fitness (strength, lifespan) for an ant seeking for food."""
+    return self.food_strength, self.food_lifespan
 
   def nest_fitness(self):
-    """Cell fitness for an ant seeking for its own nest."""
-    return self.colony_ph
+    """Cell fitness (strength, lifespan) for an ant seeking for its nest."""
+    return self.colony_strength, self.colony_lifespan
+
+
+
+class Decay(object):
+  """Evaporations of the pheromone of a LazyWorld: their number and the
+  factors subtracted from the lifespans by each one."""
+
+  __slots__ = ('steps', 'colony_factor', 'food_factor')
+
+  def __init__(self):
+    """Creates and initializes the Decay instance."""
+    self.steps = 0
+    self.colony_factor = 0
+    self.food_factor = 0
+
 
 
+# lifespans stored in the slots of a LazyCell
+_FOOD_LIFESPAN = Cell.food_lifespan
+_COLONY_LIFESPAN = Cell.colony_lifespan
 
-class World:
+
+class LazyCell(Cell):
+  """Cell of a LazyWorld: its lifespans are stored with the number of
+  evaporations of the world when they were last read or written, and the
+  evaporations since then are applied when they're read (see decayed)."""
+
+  __slots__ = ('decay', 'steps')
+
+  def __init__(self, decay, food_quantity=0):
+    """Creates and initializes the LazyCell instance."""
+    self.decay = decay
+    self.steps = decay.steps
+    Cell.__init__(self, food_quantity)
+
+  def settle(self):
+    """Applies the evaporations since the last access to the lifespans."""
+    decay = self.decay
+    steps = decay.steps - self.steps
+    if steps:
+      self.steps = decay.steps
+      # a single evaporation is a subtraction
+      food = _FOOD_LIFESPAN.__get__(self)
+      if food > 0:
+        _FOOD_LIFESPAN.__set__(self, food - decay.food_factor if steps == 1
+                               else decayed(food, decay.food_factor, steps))
+      colony = _COLONY_LIFESPAN.__get__(self)
+      if colony > 0:
+        _COLONY_LIFESPAN.__set__(
+            self, colony - decay.colony_factor if steps == 1
+            else decayed(colony, decay.colony_factor, steps))
+
+  @property
+  def food_lifespan(self):
+    """Gets the current food pheromone lifespan."""
+    self.settle()
+    return _FOOD_LIFESPAN.__get__(self)
+
+  @food_lifespan.setter
+  def food_lifespan(self, value):
+    """Sets the current food pheromone lifespan."""
+    self.settle()
+    _FOOD_LIFESPAN.__set__(self, value)
+
+  @property
+  def colony_lifespan(self):
+    """Gets the current colony pheromone lifespan."""
+    self.settle()
+    return _COLONY_LIFESPAN.__get__(self)
+
+  @colony_lifespan.setter
+  def colony_lifespan(self, value):
+    """Sets the current colony pheromone lifespan."""
+    self.settle()
+    _COLONY_LIFESPAN.__set__(self, value)
+
+
+
+class World(object):
   """Represents the entire world where the simulation takes place.
-  Assume that the board is a torus: http://en.wikipedia.org/wiki/Torus."""
+  Assume that the board is a torus: http://en.wikipedia.org/wiki/Torus.
+  The cells are stored in a flat list, where the cell (x, y) is at the index
+  (location) x * height + y. The cells are created on first access: a cell
+  never read or written is None, therefore a grid of any size is allocated
+  at once."""
+
+  # number of colonies (see ColoniesWorld)
+  colonies = 1
 
-  def __init__(self, size, nest_location, nest_food_quantity):
+  def __init__(self, size, nest_location, nest_food_quantity, seed=None):
     """Creates and initializes the World instance."""
+    # random numbers of the world (see rng)
+    self.rng = rng.Streams(seed)
     # build the grid
-    self.size = size
-    self.nest = nest_location
+    self.size = tuple(size)
     width, height = size
-    self.cells = [[Cell() for _ in range(height)] for _ in range(width)]
-    self.ants = []
+    self.cells = [None] * (width * height)
+    self.build_tables()
+    self.nest = self.index(nest_location)
+    # locations of the cells whose pheromone is still alive
+    self.live = set()
+    # locations of the cells with some food
+    self.food_cells = set()
+    # locations of the cells changed since the last redraw (if tracked)
+    self.dirty = None
+    self.ants = Ants()
     self.food_quantity = 0
     self.nest_food_quantity = nest_food_quantity
-    x, y = nest_location
 
-  def __getitem__(self, location):
-    """Gets the cell in location."""
-    x, y = location
+  def index(self, coords):
+    """Gets the location of the cell in (x, y) coordinates."""
+    x, y = coords
     width, height = self.size
-    return self.cells[x % width][y % height]
+    return x % width * height + y % height
+
+  def coords(self, location):
+    """Gets the (x, y) coordinates of the cell in location."""
+    return divmod(location, self.size[1])
+
+  def build_tables(self):
+    """Builds the tables of the neighbors of each cell: their locations, where
+    the neighbor of the cell in location in direction d is at position
+    location * 8 + d (see neighbors_table), and the lists of their cells by
+    location. Like the cells, the lists of the neighbor cells are built on
+    first access (see neighbor_cells)."""
+    self.neighbors = neighbors_table(self.size)
+    self.adjacent = [None] * len(self.cells)
+
+  def resize(self, size):
+    """Changes the size of the world.
+    The cells inside both sizes are kept, the others are dropped with their
+    food; the nest and the ants outside the new size are wrapped around it and
+    the ants forget their paths. The neighbors tables are rebuilt."""
+    old_width, old_height = self.size
+    width, height = size
+    kept = dict((x * old_height + y, x * height + y)
+                for x in range(min(width, old_width))
+                for y in range(min(height, old_height)))
+    food = self.grid_food_quantity()
+    self.move_cells(tuple(size), kept)
+    self.size = tuple(size)
+    self.build_tables()
+    self.food_quantity -= food - self.grid_food_quantity()
+    def relocate(location):
+      if location in kept:
+        return kept[location]
+      x, y = divmod(location, old_height)
+      return self.index((x, y))
+    self.relocate_nests(relocate)
+    self.relocate_ants(relocate)
+
+  @property
+  def nests(self):
+    """Gets the locations of the nests, one for each colony."""
+    return (self.nest,)
+
+  def relocate_nests(self, relocate):
+    """Moves the nest to the location given by the relocate function."""
+    self.nest = relocate(self.nest)
+
+  def grid_food_quantity(self):
+    """Gets the quantity of food in the cells."""
+    return sum(c.food_quantity for c in self.cells if c is not None)
+
+  def move_cells(self, size, kept):
+    """Builds the grid of the given size, moving the cells in kept (that maps
+    the old location to the new one)."""
+    width, height = size
+    cells = [None] * (width * height)
+    for old, new in kept.items():
+      cells[new] = self.cells[old]
+    self.cells = cells
+    self.live = set(kept[l] for l in self.live if l in kept)
+    self.food_cells = set(kept[l] for l in self.food_cells if l in kept)
+
+  def relocate_ants(self, relocate):
+    """Moves every ant to the location given by the relocate function."""
+    for a in self.ants:
+      a.location = relocate(a.location)
+      a.path.clear()
+
+  def __getitem__(self, location):
+    """Gets the cell in location, creating it on first access."""
+    cell = self.cells[location]
+    if cell is None:
+      cell = self.cells[location] = Cell()
+    return cell
+
+  def neighbor_cells(self, location):
+    """Gets the list of the neighbor cells (by direction) of the cell in
+    location, creating it on first access."""
+    cells = self.adjacent[location]
+    if cells is None:
+      i = location * 8
+      cells = self.adjacent[location] = [self[l]
+                                         for l in self.neighbors[i:i + 8]]
+    return cells
 
   def __setitem__(self, location, value):
     """Sets the cell in location."""
-    x, y = location
-    width, height = self.size
-    self.cells[x % width][y % height] = value
+    self.cells[location] = value
+    # the cell is the neighbor of its neighbors in the opposite direction
+    for d in range(8):
+      cells = self.adjacent[self.neighbors[location * 8 + d]]
+      if cells is not None:
+        cells[(d + 4) % 8] = value
+    if colony_lifespan(value) > 0 or food_lifespan(value) > 0:
+      self.mark_live(location)
+    self.mark_food(location)
+
+  def mark_live(self, location):
+    """Marks the cell in location as carrying some pheromone."""
+    self.live.add(location)
+
+  def mark_food(self, location):
+    """Updates the index of the cells with food after the food in location
+    changed."""
+    if self[location].food_quantity > 0:
+      self.food_cells.add(location)
+    else:
+      self.food_cells.discard(location)
+
+  def mark_dirty(self, location):
+    """Marks the cell in location as changed, if the changes are tracked."""
+    if self.dirty is not None:
+      self.dirty.add(location)
+
+  def evaporate(self, colony_factor, food_factor):
+    """Decreases the lifespan of the pheromone in every cell."""
+    instrument.count('evaporated', len(self.live))
+    # only the cells with some pheromone left need to be visited
+    for loc in list(self.live):
+      cell = self[loc]
+      if colony_lifespan(cell) > 0:
+        cell.colony_lifespan -= colony_factor
+      if food_lifespan(cell) > 0:
+        cell.food_lifespan -= food_factor
+      self.mark_dirty(loc)
+      # forget the cell once both pheromones are gone
+      if colony_lifespan(cell) <= 0 and food_lifespan(cell) <= 0:
+        self.live.discard(loc)
+
+  def settle(self):
+    """Brings the pheromone of the cells up to date (see LazyWorld): here
+    the evaporation is always applied at once."""
+
+  def live_count(self):
+    """Gets the number of cells with some pheromone."""
+    return len(self.live)
+
+
+
+class LazyWorld(World):
+  """World whose pheromone evaporates lazily: an evaporation only counts
+  one more step, and the lifespans of a cell are decayed when it's next read
+  (see LazyCell). The results are the same of the World, whose evaporation
+  visits every live cell at each step."""
+
+  def __init__(self, size, nest_location, nest_food_quantity, seed=None):
+    """Creates and initializes the LazyWorld instance."""
+    self.decay = Decay()
+    World.__init__(self, size, nest_location, nest_food_quantity, seed)
+
+  def __getitem__(self, location):
+    """Gets the cell in location, creating it on first access."""
+    cell = self.cells[location]
+    if cell is None:
+      cell = self.cells[location] = LazyCell(self.decay)
+    return cell
+
+  def __setitem__(self, location, value):
+    """Sets the cell in location (a Cell is copied in a LazyCell)."""
+    if not isinstance(value, LazyCell):
+      cell = LazyCell(self.decay)
+      for field in Cell.__slots__:
+        setattr(cell, field, getattr(value, field))
+      value = cell
+    World.__setitem__(self, location, value)
+
+  def evaporate(self, colony_factor, food_factor):
+    """Counts an evaporation of the pheromone with the given factors. The
+    live cells are visited (and marked as changed) if the changes are
+    tracked, otherwise every SETTLE_STEPS evaporations, to forget the ones
+    without pheromone."""
+    decay = self.decay
+    if (colony_factor, food_factor) != (decay.colony_factor,
+                                        decay.food_factor):
+      # the evaporations so far are applied with the previous factors
+      self.settle()
+      decay.colony_factor, decay.food_factor = colony_factor, food_factor
+    decay.steps += 1
+    if self.dirty is not None:
+      self.dirty.update(self.live)
+      self.settle()
+    elif decay.steps % SETTLE_STEPS == 0:
+      self.settle()
+
+  def live_count(self):
+    """Gets the number of cells with some pheromone, without applying the
+    pending evaporations (see alive)."""
+    decay = self.decay
+    cells = self.cells
+    count = 0
+    for loc in self.live:
+      cell = cells[loc]
+      steps = decay.steps - cell.steps
+      if (alive(_COLONY_LIFESPAN.__get__(cell), decay.colony_factor, steps) or
+          alive(_FOOD_LIFESPAN.__get__(cell), decay.food_factor, steps)):
+        count += 1
+    return count
+
+  def settle(self):
+    """Applies the pending evaporations to the live cells, forgetting the
+    cells whose pheromones are gone (as the World evaporation does)."""
+    cells = self.cells
+    instrument.count('evaporated', len(self.live))
+    live = set()
+    for loc in self.live:
+      cell = cells[loc]
+      cell.settle()
+      if (_COLONY_LIFESPAN.__get__(cell) > 0 or
+          _FOOD_LIFESPAN.__get__(cell) > 0):
+        live.add(loc)
+    self.live = live
+
+
+
+# names of the arrays of an ArrayWorld, in the same order of Cell.__slots__
+ARRAY_FIELDS = ('food_quantities', 'food_strengths', 'food_lifespans',
+                'colony_strengths', 'colony_lifespans')
+
+
+def _array_field(name):
+  """Builds the property of an ArrayCell that reads and writes its element of
+  the world array with the given name."""
+  def get(self):
+    return getattr(self.world, name).item(self.index)
+  def set(self, value):
+    getattr(self.world, name)[self.index] = value
+  return property(get, set)
+
+
+
+class ArrayCell(object):
+  """Represents a single cell stored in an ArrayWorld.
+  The cell is a view: reading and writing its attributes reads and writes the
+  arrays of the world it belongs to."""
+
+  __slots__ = ('world', 'index')
+
+  def __init__(self, world, index):
+    """Creates and initializes the ArrayCell view."""
+    self.world = world
+    self.index = index
+
+  food_quantity = _array_field('food_quantities')
+  food_strength = _array_field('food_strengths')
+  food_lifespan = _array_field('food_lifespans')
+  colony_strength = _array_field('colony_strengths')
+  colony_lifespan = _array_field('colony_lifespans')
+
+  def food_fitness(self):
+    """Cell fitness (strength, lifespan) for an ant seeking for food."""
+    return self.food_strength, self.food_lifespan
+
+  def nest_fitness(self):
+    """Cell fitness (strength, lifespan) for an ant seeking for its nest."""
+    return self.colony_strength, self.colony_lifespan
+
+
+
+class ArrayNeighbors(object):
+  """Table of the neighbor cells of an ArrayWorld, that builds the views on
+  demand (see World.build_tables)."""
+
+  __slots__ = ('world',)
+
+  def __init__(self, world):
+    """Creates and initializes the ArrayNeighbors table."""
+    self.world = world
+
+  def __getitem__(self, location):
+    """Gets the neighbor cells of the cell in location."""
+    return ArrayAdjacent(self.world, location * 8)
+
+
+
+class ArrayAdjacent(object):
+  """Neighbor cells of a cell of an ArrayWorld, whose views are built on
+  demand."""
+
+  __slots__ = ('world', 'index')
+
+  def __init__(self, world, index):
+    """Creates and initializes the ArrayAdjacent cells, whose first one is
+    at index of the neighbors table."""
+    self.world = world
+    self.index = index
+
+  def __getitem__(self, direction):
+    """Gets the view of the neighbor cell in direction."""
+    return ArrayCell(self.world, self.world.neighbors[self.index + direction])
+
+
+
+class ArrayWorld(World):
+  """Represents the entire world where the simulation takes place, storing the
+  cells in contiguous NumPy arrays instead of Cell instances: there's one array
+  per Cell attribute, named in plural (e.g. food_lifespans), indexed by
+  location."""
+
+  def __init__(self, size, nest_location, nest_food_quantity, seed=None):
+    """Creates and initializes the ArrayWorld instance."""
+    if numpy is None:
+      raise ImportError('ArrayWorld requires NumPy')
+    self.rng = rng.Streams(seed)
+    self.size = tuple(size)
+    width, height = size
+    cells = width * height
+    self.food_quantities = numpy.zeros(cells, dtype=numpy.int64)
+    self.food_strengths = numpy.zeros(cells, dtype=numpy.int64)
+    self.food_lifespans = numpy.zeros(cells)
+    self.colony_strengths = numpy.zeros(cells, dtype=numpy.int64)
+    self.colony_lifespans = numpy.zeros(cells)
+    self.build_tables()
+    self.nest = self.index(nest_location)
+    self.dirty = None
+    self.ants = Ants()
+    self.food_quantity = 0
+    self.nest_food_quantity = nest_food_quantity
+
+  def build_tables(self):
+    """Builds the tables of the neighbors of each cell (see World)."""
+    self.neighbors = neighbors_table(self.size)
+    self.adjacent = ArrayNeighbors(self)
+
+  def grid_food_quantity(self):
+    """Gets the quantity of food in the cells."""
+    return int(self.food_quantities.sum())
+
+  def move_cells(self, size, kept):
+    """Builds the arrays of the given size, moving the cells in kept (that maps
+    the old location to the new one)."""
+    moves = numpy.array(list(kept.items()), dtype=numpy.int64).reshape(-1, 2)
+    old, new = moves.T
+    for name in ARRAY_FIELDS:
+      values = getattr(self, name)
+      # the locations are the last axis (see ColoniesWorld)
+      resized = numpy.zeros(values.shape[:-1] + (size[0] * size[1],),
+                            dtype=values.dtype)
+      resized[..., new] = values[..., old]
+      setattr(self, name, resized)
+
+  def relocate_ants(self, relocate):
+    """Moves every ant to the location given by the relocate function."""
+    if isinstance(self.ants, Ants):
+      World.relocate_ants(self, relocate)
+    else:
+      self.ants.relocate(relocate)
+
+  def neighbors_array(self):
+    """Gets the neighbors table as a (cells, 8) NumPy array (a view)."""
+    return numpy.frombuffer(self.neighbors, dtype=numpy.int32).reshape(-1, 8)
+
+  def live_mask(self):
+    """Gets the mask of the cells with some pheromone."""
+    return (self.colony_lifespans > 0) | (self.food_lifespans > 0)
+
+  def live_count(self):
+    """Gets the number of cells with some pheromone."""
+    return int(numpy.count_nonzero(self.live_mask()))
+
+  def __getitem__(self, location):
+    """Gets a view of the cell in location."""
+    return ArrayCell(self, location)
+
+  def __setitem__(self, location, value):
+    """Copies the content of value in the cell in location."""
+    cell = self[location]
+    for name in Cell.__slots__:
+      setattr(cell, name, getattr(value, name))
+
+  def mark_live(self, location):
+    """Does nothing: the evaporation of an ArrayWorld is applied to the whole
+    arrays at once and doesn't need the index of live cells."""
+    pass
+
+  def mark_food(self, location):
+    """Does nothing: the cells with food of an ArrayWorld are found in its
+    food_quantities array."""
+    pass
+
 
 
+class NestsWorld(ArrayWorld):
+  """ArrayWorld with a nest for each of its colonies, each one with its own
+  store of food (nest_food_quantities). The colony of an ant selects its nest
+  in colony_nests and the offset of its pheromone in the flattened pheromone
+  arrays (its colony times layer); nest and nest_food_quantity are the nest of
+  the first colony and the food of all the nests. The subclasses lay out the
+  arrays (see ColoniesWorld and ensemble.EnsembleWorld)."""
 
-class Ant:
+  @property
+  def nests(self):
+    """Gets the locations of the nests, one for each colony."""
+    return tuple(self.colony_nests.tolist())
+
+  @property
+  def nest_food_quantity(self):
+    """Gets the food in all the nests."""
+    return int(self.nest_food_quantities.sum())
+
+  def relocate_nests(self, relocate):
+    """Moves the nests to the locations given by the relocate function."""
+    self.colony_nests[:] = [relocate(l) for l in self.nests]
+    self.nest = int(self.colony_nests[0])
+
+
+
+class ColoniesWorld(NestsWorld):
+  """NestsWorld shared by several colonies, each one with its own nest, store
+  of food and pheromone. The pheromone arrays are stacked: they have a row
+  (layer) for each colony, so that the ants of every colony are moved and the
+  pheromone of every colony evaporates at once, while the food_quantities are
+  shared. The cell views (see ArrayCell) show the pheromone of the first
+  colony."""
+
+  def __init__(self, size, nest_locations, nest_food_quantity, seed=None):
+    """Creates and initializes the ColoniesWorld instance, with a colony for
+    each nest location and the same food in every nest."""
+    if numpy is None:
+      raise ImportError('ColoniesWorld requires NumPy')
+    self.rng = rng.Streams(seed)
+    self.size = tuple(size)
+    width, height = size
+    self.colonies = len(nest_locations)
+    layers = self.colonies, width * height
+    self.food_quantities = numpy.zeros(width * height, dtype=numpy.int64)
+    self.food_strengths = numpy.zeros(layers, dtype=numpy.int64)
+    self.food_lifespans = numpy.zeros(layers)
+    self.colony_strengths = numpy.zeros(layers, dtype=numpy.int64)
+    self.colony_lifespans = numpy.zeros(layers)
+    # offset of the layer of a colony in the flattened pheromone arrays
+    self.layer = width * height
+    self.build_tables()
+    self.colony_nests = numpy.array([self.index(l) for l in nest_locations],
+                                    dtype=numpy.int64)
+    self.nest = int(self.colony_nests[0])
+    self.nest_food_quantities = numpy.full(self.colonies, nest_food_quantity,
+                                           dtype=numpy.int64)
+    self.dirty = None
+    self.ants = Ants()
+    self.food_quantity = 0
+
+  def live_mask(self):
+    """Gets the mask of the cells with the pheromone of some colony."""
+    return ((self.colony_lifespans > 0) | (self.food_lifespans > 0)).any(axis=0)
+
+
+
+class Path(object):
+  """Compact history of the locations an ant passed through.
+  The locations (flat indices) are kept in an open addressing hash table of
+  32 bit integers (http://en.wikipedia.org/wiki/Open_addressing), at most
+  half full, whose size is doubled when needed: 8 to 16 bytes for each
+  location, about a tenth of a set of coordinates."""
+
+  __slots__ = ('slots', 'shift', 'count')
+
+  def __init__(self):
+    """Creates and initializes an empty Path instance."""
+    self.clear()
+
+  def __len__(self):
+    """Gets the number of locations in the path."""
+    return self.count
+
+  def __iter__(self):
+    """Iterates over the locations of the path (in no particular order)."""
+    return (location for location in self.slots if location >= 0)
+
+  def find(self, location):
+    """Gets the slot of the location, or the empty slot where it belongs."""
+    slots = self.slots
+    mask = len(slots) - 1
+    i = (location * PATH_MIXER & 0xFFFFFFFFFFFFFFFF) >> self.shift
+    while slots[i] != location and slots[i] >= 0:
+      i = (i + 1) & mask
+    return i
+
+  def __contains__(self, location):
+    """Returns True if the location belongs to the path."""
+    return self.slots[self.find(location)] == location
+
+  def add(self, location):
+    """Adds the location to the path."""
+    i = self.find(location)
+    if self.slots[i] == location:
+      return
+    self.slots[i] = location
+    self.count += 1
+    if 2 * self.count > len(self.slots):
+      locations = list(self)
+      self.slots = array.array('i', (-1,)) * (2 * len(self.slots))
+      self.shift -= 1
+      for location in locations:
+        self.slots[self.find(location)] = location
+
+  def clear(self):
+    """Removes all the locations from the path."""
+    self.slots = array.array('i', (-1,)) * PATH_SLOTS
+    self.shift = 64 - (PATH_SLOTS.bit_length() - 1)
+    self.count = 0
+
+
+
+class Ant(object):
   """Represents a single ant."""
 
+  __slots__ = ('world', 'location', 'direction', 'path', 'food_quantity', 'age',
+               'key', 'index', 'elder')
+
   def __init__(self, world, direction):
     """Creates and initializes the Ant instance."""
     self.world = world
-    self.location = tuple(world.nest)
+    self.location = world.nest
     self.direction = direction
-    self.path = set()
+    self.path = Path()
     self.food_quantity = 0
     self.age = 0
-
+    # key of the random numbers of the ant (see rng)
+    self.key = world.rng.spawn()
+    # positions in the Ants list and in its elders (-1 if not elder)
+    self.index = -1
+    self.elder = -1
 
   def foraging(self):
     """Returns True if the ant's bringing some food, otherwise False."""
     return self.food_quantity > 0
+
+
+
+class Ants(object):
+  """The Ant instances of a world.
+  An ant is removed in constant time, moving the last ant in its place, and
+  the ants are indexed by age: the young ones are kept from the oldest to the
+  youngest (the order they were born) and move to the elders once older than
+  the given age, therefore the elders are found without visiting every ant.
+  A young ant removed is left in its place (with index -1) and dropped when
+  it's the oldest of the young ones: a removed ant can't be added again."""
+
+  def __init__(self):
+    """Creates and initializes an empty Ants instance."""
+    self.items = []
+    self.young = collections.deque()
+    self.elders = []
+    # age of the elders (None if the index has to be rebuilt)
+    self.age = None
+
+  def __len__(self):
+    """Gets the number of ants."""
+    return len(self.items)
+
+  def __iter__(self):
+    """Iterates over the ants."""
+    return iter(self.items)
+
+  def __getitem__(self, index):
+    """Gets the ant at index."""
+    return self.items[index]
+
+  def append(self, ant):
+    """Adds the ant."""
+    ant.index = len(self.items)
+    ant.elder = -1
+    self.items.append(ant)
+    # a newborn is the youngest ant, otherwise the index has to be rebuilt
+    if self.young and ant.age > self.young[-1].age:
+      self.age = None
+    self.young.append(ant)
+
+  def remove(self, ant):
+    """Removes the ant, in constant time."""
+    last = self.items.pop()
+    if last is not ant:
+      self.items[ant.index] = last
+      last.index = ant.index
+    if ant.elder >= 0:
+      last = self.elders.pop()
+      if last is not ant:
+        self.elders[ant.elder] = last
+        last.elder = ant.elder
+    ant.index = ant.elder = -1
+
+  def older(self, age):
+    """Gets the list of the ants older than age (that must not be changed)."""
+    if age != self.age:
+      self.reindex(age)
+    young, elders = self.young, self.elders
+    while young and (young[0].index < 0 or young[0].age > age):
+      ant = young.popleft()
+      if ant.index >= 0:
+        ant.elder = len(elders)
+        elders.append(ant)
+    return elders
+
+  def reindex(self, age):
+    """Rebuilds the index of the ants older than age."""
+    ants = sorted(self.items, key=lambda a: -a.age)
+    self.young = collections.deque(a for a in ants if a.age <= age)
+    self.elders = [a for a in ants if a.age > age]
+    for a in self.young:
+      a.elder = -1
+    for i, a in enumerate(self.elders):
+      a.elder = i
+    self.age = age
+
+  def ranks(self):
+    """Gets the position of each ant in the index: in the elders if it's
+    elder, otherwise -1 minus its position in the young ones."""
+    young = dict((id(a), i) for i, a in enumerate(
+      a for a in self.young if a.index >= 0))
+    return [a.elder if a.elder >= 0 else -1 - young[id(a)]
+            for a in self.items]
+
+  def rerank(self, ranks, age):
+    """Restores the index of the ants older than age from their ranks (see
+    ranks)."""
+    elders = sorted((r, a.index) for a, r in zip(self.items, ranks) if r >= 0)
+    young = sorted((-r, a.index) for a, r in zip(self.items, ranks) if r < 0)
+    self.elders = [self.items[i] for _, i in elders]
+    self.young = collections.deque(self.items[i] for _, i in young)
+    for a in self.young:
+      a.elder = -1
+    for i, a in enumerate(self.elders):
+      a.elder = i
+    self.age = age
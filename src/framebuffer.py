@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+"""Ants simulator framebuffer module.
+A Framebuffer draws a snapshot.WorldView as an RGB image, composed with NumPy
+instead of a shape per entity: its layers (the pheromones, the food and the
+ants of each cell) are kept up to date with the changed cells, and at each
+frame they're colored all at once and scaled to the window. When the world
+(zoomed) doesn't fit the window, the cells are reduced in blocks, each block
+drawn as its strongest cell: the time of a frame depends on the size of the
+window, not on the number of entities."""
+
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+
+def blend(image, color, alpha):
+  """Blends the color in the image (float RGB) with the alpha (one for each
+  pixel, in [0, 1])."""
+  alpha = alpha[..., None]
+  image *= 1 - alpha
+  image += alpha * numpy.asarray(color, dtype=numpy.float32)
+
+
+def downsample(layer, factor):
+  """Reduces the (width, height) layer in blocks of factor x factor cells,
+  keeping the max of each block."""
+  if factor == 1:
+    return layer
+  width, height = layer.shape
+  pad = ((0, -width % factor), (0, -height % factor))
+  layer = numpy.pad(layer, pad, mode='constant', constant_values=layer.min())
+  w, h = layer.shape
+  return layer.reshape(w // factor, factor, h // factor, factor).max(
+      axis=(1, 3))
+
+
+
+class Framebuffer(object):
+  """RGB image of a WorldView. The colors are (red, green, blue) tuples: the
+  background, colony and food pheromone and food ones, and a color for each
+  nest and for each ant flag (see snapshot)."""
+
+  def __init__(self, size, nests, colors, zoom, ph_factor, nest_size,
+               draw_colony=True, draw_food=False):
+    """Creates and initializes the (empty) Framebuffer of a world of the given
+    size."""
+    if numpy is None:
+      raise ImportError('Framebuffer requires NumPy')
+    self.size = tuple(size)
+    self.nests = tuple(nests)
+    self.colors = colors
+    self.zoom = zoom
+    self.ph_factor = ph_factor
+    self.nest_size = nest_size
+    self.draw_colony = draw_colony
+    self.draw_food = draw_food
+    cells = self.size[0] * self.size[1]
+    # layers of the cells, indexed by location
+    self.colony = numpy.zeros(cells, dtype=numpy.float32)
+    self.food_pheromone = numpy.zeros(cells, dtype=numpy.float32)
+    self.food = numpy.zeros(cells, dtype=numpy.float32)
+
+  def update(self, view, changed=None):
+    """Updates the layers with the cells of the view in changed (all if
+    None)."""
+    if changed is None:
+      for layer in (self.colony, self.food_pheromone, self.food):
+        layer[:] = 0
+      changed = list(view.cells)
+    else:
+      changed = list(changed)
+    if not changed:
+      return
+    cells = view.cells
+    values = numpy.array([cells.get(l, (0, 0, 0)) for l in changed],
+                         dtype=numpy.float32).reshape(-1, 3)
+    locations = numpy.array(changed, dtype=numpy.int64)
+    self.colony[locations] = values[:, 0]
+    self.food_pheromone[locations] = values[:, 1]
+    self.food[locations] = values[:, 2]
+
+  def ants(self, view):
+    """Gets the layer of the ants of the view: the flag of the ant in each
+    cell (the highest one if many), -1 if none."""
+    layer = numpy.full(len(self.colony), -1, dtype=numpy.int16)
+    if view.ants:
+      ants = numpy.array(view.ants, dtype=numpy.int64).reshape(-1, 2)
+      numpy.maximum.at(layer, ants[:, 0], ants[:, 1].astype(numpy.int16))
+    return layer
+
+  def scale(self, width, height):
+    """Gets the (cells per block, pixels per block) that fit the world in
+    the window of the given size, at most zoomed."""
+    columns, rows = self.size
+    pixels = min(self.zoom, width // columns, height // rows)
+    if pixels >= 1:
+      return 1, pixels
+    factor = max(-(-columns // max(width, 1)), -(-rows // max(height, 1)))
+    return factor, 1
+
+  def render(self, view, width, height):
+    """Composes the image (an array of height x width x 3 bytes) of the
+    view in a window of the given size."""
+    factor, pixels = self.scale(width, height)
+    columns, rows = self.size
+    def layer(values):
+      return downsample(values.reshape(columns, rows), factor)
+    colors = self.colors
+    ants = layer(self.ants(view))
+    image = numpy.empty(ants.shape + (3,), dtype=numpy.float32)
+    image[...] = colors['background']
+    # the pheromone radius is its lifespan scaled, in pixels of the cell
+    ph_scale = 1.0 / (self.ph_factor * max(self.zoom, 1))
+    if self.draw_colony:
+      blend(image, colors['colony_pheromone'],
+            numpy.clip(layer(self.colony) * ph_scale, 0, 1))
+    if self.draw_food:
+      blend(image, colors['food_pheromone'],
+            numpy.clip(layer(self.food_pheromone) * ph_scale, 0, 1))
+    blend(image, colors['food'],
+          numpy.clip(layer(self.food) / max(self.zoom, 1), 0, 1))
+    # the nests (at least a cell) and the ants are opaque
+    reach = self.nest_size // max(self.zoom, 1) // factor
+    for nest, color in zip(self.nests, colors['nests']):
+      x, y = divmod(nest, rows)
+      xs = numpy.arange(x // factor - reach, x // factor + reach + 1)
+      ys = numpy.arange(y // factor - reach, y // factor + reach + 1)
+      xs, ys = numpy.broadcast_arrays(xs[:, None], ys[None, :])
+      inside = (xs - x // factor) ** 2 + (ys - y // factor) ** 2 <= reach ** 2
+      image[xs[inside] % image.shape[0], ys[inside] % image.shape[1]] = color
+    for flag, color in enumerate(colors['ants']):
+      image[ants == flag] = color
+    # a block of pixels for each block of cells, centered as the shapes are
+    image = image.astype(numpy.uint8).transpose(1, 0, 2)
+    if pixels > 1:
+      image = image.repeat(pixels, axis=0).repeat(pixels, axis=1)
+      shift = -(pixels // 2)
+      image = numpy.roll(image, (shift, shift), axis=(0, 1))
+    frame = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    frame[...] = colors['background']
+    h, w = min(height, image.shape[0]), min(width, image.shape[1])
+    frame[:h, :w] = image[:h, :w]
+    return frame
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+"""Ants simulator instrumentation module.
+When enabled, the Instruments time the phases of each step (behavior,
+evaporation, births, deaths, drawing) with a monotonic clock, and count the
+events of each step: ant moves, pheromone deposits, fitness and random steps
+and evaporated cells. The totals are kept with a window of the latest steps,
+from which the rolling percentiles are computed.
+Disabled (the default) the module variable active is None: a phase costs a
+function call, a counter the check of active."""
+
+
+import time
+import collections
+
+
+# number of latest samples of the rolling percentiles
+WINDOW = 256
+PERCENTILES = 50, 90, 99
+
+# the enabled Instruments (None when disabled)
+active = None
+
+
+
+class Null(object):
+  """Phase that measures nothing, used when the instruments are disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+NULL = Null()
+
+
+
+class Phase(object):
+  """Measures the time spent in a phase (a with statement block)."""
+
+  __slots__ = ('instruments', 'name', 'start')
+
+  def __init__(self, instruments, name):
+    """Creates and initializes the Phase instance."""
+    self.instruments = instruments
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.instruments.time(self.name, time.perf_counter() - self.start)
+    return False
+
+
+
+def percentiles(samples):
+  """Gets the PERCENTILES of the samples (nearest rank)."""
+  ordered = sorted(samples)
+  if not ordered:
+    return dict(('p{}'.format(p), 0) for p in PERCENTILES)
+  return dict(('p{}'.format(p),
+               ordered[min(len(ordered) - 1, len(ordered) * p // 100)])
+              for p in PERCENTILES)
+
+
+
+class Instruments(object):
+  """Timers of the phases and counters of the events of the steps."""
+
+  def __init__(self, window=WINDOW):
+    """Creates and initializes the Instruments instance."""
+    self.window = window
+    self.steps = 0
+    # total seconds, number and latest durations of each phase
+    self.seconds = dict()
+    self.calls = dict()
+    self.durations = dict()
+    # totals, counts of the current step and of the latest steps
+    self.totals = dict()
+    self.current = collections.Counter()
+    self.counts = dict()
+
+  def phase(self, name):
+    """Gets the Phase that measures the phase with the given name."""
+    return Phase(self, name)
+
+  def time(self, name, seconds):
+    """Adds a duration of the phase with the given name."""
+    if name not in self.durations:
+      self.seconds[name] = 0.0
+      self.calls[name] = 0
+      self.durations[name] = collections.deque(maxlen=self.window)
+    self.seconds[name] += seconds
+    self.calls[name] += 1
+    self.durations[name].append(seconds)
+
+  def count(self, name, n=1):
+    """Counts n events of the current step."""
+    self.current[name] += n
+
+  def end_step(self):
+    """Closes the counts of the current step."""
+    for name in self.current:
+      if name not in self.counts:
+        self.totals[name] = 0
+        self.counts[name] = collections.deque(maxlen=self.window)
+    for name, counts in self.counts.items():
+      n = self.current.get(name, 0)
+      self.totals[name] += n
+      counts.append(n)
+    self.current = collections.Counter()
+    self.steps += 1
+
+  def report(self):
+    """Gets the statistics of the phases (milliseconds) and of the counters
+    (per step), as a JSON serializable dictionary."""
+    phases = dict()
+    for name, durations in self.durations.items():
+      stats = percentiles(d * 1000 for d in durations)
+      stats['calls'] = self.calls[name]
+      stats['total_ms'] = self.seconds[name] * 1000
+      stats['mean_ms'] = stats['total_ms'] / max(1, self.calls[name])
+      phases[name] = stats
+    counters = dict()
+    for name, counts in self.counts.items():
+      stats = percentiles(counts)
+      stats['total'] = self.totals[name]
+      stats['per_step'] = float(self.totals[name]) / max(1, self.steps)
+      counters[name] = stats
+    return {'steps': self.steps, 'phases': phases, 'counters': counters}
+
+  def summary(self):
+    """Gets a short description of the median and 90th percentile of each
+    phase (milliseconds)."""
+    parts = []
+    for name in sorted(self.durations):
+      stats = percentiles(list(self.durations[name]))
+      parts.append('{} {:.2f}/{:.2f}'.format(name, stats['p50'] * 1000,
+                                             stats['p90'] * 1000))
+    return ' '.join(parts)
+
+
+
+def enable(window=WINDOW):
+  """Enables new Instruments (unless already enabled) and returns them."""
+  global active
+  if active is None:
+    active = Instruments(window)
+  return active
+
+
+def disable():
+  """Disables the Instruments."""
+  global active
+  active = None
+
+
+def phase(name):
+  """Gets the context that measures the phase with the given name (that
+  does nothing if the instruments are disabled)."""
+  instruments = active
+  if instruments is None:
+    return NULL
+  return instruments.phase(name)
+
+
+def count(name, n=1):
+  """Counts n events of the current step, if the instruments are enabled."""
+  instruments = active
+  if instruments is not None:
+    instruments.count(name, n)
+
+
+def end_step():
+  """Closes the counts of the current step, if the instruments are
+  enabled."""
+  instruments = active
+  if instruments is not None:
+    instruments.end_step()
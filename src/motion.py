@@ -2,13 +2,14 @@
 """Ants simulator motion module."""
 
 
-import random
 import entity
+import instrument
+import rng
 
 
 
 # delta used to move the ant and reach its neighbors (clockwise)
-DELTA = (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)
+DELTA = entity.DELTA
 
 
 def still(ant):
@@ -42,26 +43,38 @@ def turn_around(ant):
 
 def forward(ant):
   """Moves the ant forward and update the path with pheromone."""
+  instruments = instrument.active
   # update the pheromone only if the ant not already passed through here.
   if ant.location not in ant.path:
     # check if the ant has to back home with food
+    here = ant.world[ant.location]
     if ant.foraging():
-      ph = entity.food_strength(ant.world[ant.location])
+      ph = entity.food_strength(here)
       if not ph or ph >= len(ant.path):
         # mark with colony pheromone only if we can't worsen the path
-        lifespan = entity.food_lifespan(ant.world[ant.location])
-        ant.world[ant.location].food_ph[:] = [len(ant.path), lifespan + 1]
+        here.food_strength = len(ant.path)
+        here.food_lifespan += 1
+        ant.world.mark_live(ant.location)
+        if instruments is not None:
+          instruments.count('deposits')
     # else if the ant has to find food
     else:
-      ph = entity.colony_strength(ant.world[ant.location])
+      ph = entity.colony_strength(here)
       if not ph or ph >= len(ant.path):
         # mark with colony pheromone only if we can't worsen the path
-        lifespan = entity.colony_lifespan(ant.world[ant.location])
-        ant.world[ant.location].colony_ph[:] = [len(ant.path), lifespan + 1]
+        here.colony_strength = len(ant.path)
+        here.colony_lifespan += 1
+        ant.world.mark_live(ant.location)
+        if instruments is not None:
+          instruments.count('deposits')
   # update the path
   ant.path.add(ant.location)
   # move forward
+  ant.world.mark_dirty(ant.location)
   ant.location = ahead(ant)
+  ant.world.mark_dirty(ant.location)
+  if instruments is not None:
+    instruments.count('moves')
 
 
 def cross_path(ant, ph_strength):
@@ -72,8 +85,8 @@ def cross_path(ant, ph_strength):
 
 def random_step(ant, go_straight_probability):
   """Perform a random move trying to avoid already followed paths."""
-  # perform a random choice
-  p = random.random()
+  # perform a random choice (see rng for the numbers of an ant)
+  p = rng.uniform(ant.key, rng.ant_counter(ant.age))
   # check if the ant can simply go forward
   if p < go_straight_probability and ahead(ant) not in ant.path:
     forward(ant)
@@ -87,7 +100,8 @@ def random_step(ant, go_straight_probability):
       turn_counterclockwise(ant)
     else:
       # perform a random move
-      move = random.choice([turn_clockwise, turn_counterclockwise, still])
+      moves = turn_clockwise, turn_counterclockwise, still
+      move = moves[rng.below(ant.key, rng.ant_counter(ant.age, 1), 3)]
       move(ant)
     # always move forward after a turn
     forward(ant)
@@ -100,11 +114,14 @@ def fitness_step(ant, fitness, go_straight_probability):
   best, d = None, None
   # search the "best" cell
   for o in observable:
-    f, lifespan = fitness(ant.world[neighbor(ant, o)])
+    f, lifespan = fitness(neighbor_cell(ant, o))
     if f > 0 and lifespan > 0 and (not best or f < best):
       # update the best cell
       best = f
       d = o
+  instruments = instrument.active
+  if instruments is not None:
+    instruments.count('fitness_steps' if d is not None else 'random_steps')
   # check if one ahead cell (at least) has pheromone
   if d is not None:
     # apply the move to approach the cell with pheromone
@@ -118,10 +135,15 @@ def fitness_step(ant, fitness, go_straight_probability):
 def neighbor(ant, direction):
   """Get the ant neighbor according to its current location.
   Assume that the board is a torus: http://en.wikipedia.org/wiki/Torus."""
-  x, y = ant.location
-  width, height = ant.world.size
-  dx, dy = DELTA[direction % 8]
-  return (x + dx) % width, (y + dy) % height
+  return ant.world.neighbors[ant.location * 8 + direction % 8]
+
+
+def neighbor_cell(ant, direction):
+  """Get the cell of the ant neighbor according to its current location."""
+  cells = ant.world.adjacent[ant.location]
+  if cells is None:
+    cells = ant.world.neighbor_cells(ant.location)
+  return cells[direction % 8]
 
 
 def ahead(ant):
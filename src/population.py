@@ -0,0 +1,369 @@
+#! /usr/bin/env python
+"""Ants simulator population module.
+A Population stores the ants of an ArrayWorld as parallel arrays (structure of
+arrays) and moves all of them at once with vectorized operations, instead of
+calling behavior.act for each Ant instance."""
+
+
+import entity
+import instrument
+import rng
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# number of most recent cells remembered in the path of each ant
+PATH_MEMORY = 32
+# arrays of the state of the ants
+STATE = ('location', 'direction', 'food', 'age', 'key', 'colony',
+         'path_length', 'path_head', 'path')
+
+
+
+class AntView(object):
+  """Read-only view of a single ant of a Population."""
+
+  def __init__(self, population, index):
+    """Creates and initializes the AntView instance."""
+    self.population = population
+    self.index = index
+
+  @property
+  def location(self):
+    """Gets the location of the ant."""
+    return int(self.population.location[self.index])
+
+  @property
+  def direction(self):
+    """Gets the direction of the ant."""
+    return int(self.population.direction[self.index])
+
+  @property
+  def food_quantity(self):
+    """Gets the quantity of food carried by the ant."""
+    return int(self.population.food[self.index])
+
+  @property
+  def age(self):
+    """Gets the age of the ant."""
+    return int(self.population.age[self.index])
+
+  @property
+  def colony(self):
+    """Gets the colony of the ant."""
+    return int(self.population.colony[self.index])
+
+  def foraging(self):
+    """Returns True if the ant's bringing some food, otherwise False."""
+    return self.food_quantity > 0
+
+
+
+class Population(object):
+  """Represents all the ants of an ArrayWorld as parallel arrays.
+  The path of each ant is approximated by a ring buffer of the PATH_MEMORY
+  most recent cells it passed through, while its length is counted exactly.
+  In a NestsWorld (e.g. a ColoniesWorld) the ants of every colony are in the
+  same Population: each ant reads and writes the pheromone layer of its own
+  colony."""
+
+  def __init__(self, world, capacity=64, memory=PATH_MEMORY):
+    """Creates and initializes an empty Population instance."""
+    if numpy is None:
+      raise ImportError('Population requires NumPy')
+    self.world = world
+    self.memory = memory
+    self.count = 0
+    self.location = numpy.zeros(capacity, dtype=numpy.int32)
+    self.direction = numpy.zeros(capacity, dtype=numpy.int64)
+    self.food = numpy.zeros(capacity, dtype=numpy.int64)
+    self.age = numpy.zeros(capacity, dtype=numpy.int64)
+    # keys of the random numbers of the ants (see rng)
+    self.key = numpy.zeros(capacity, dtype=numpy.uint64)
+    self.colony = numpy.zeros(capacity, dtype=numpy.int64)
+    self.path_length = numpy.zeros(capacity, dtype=numpy.int64)
+    self.path_head = numpy.zeros(capacity, dtype=numpy.int64)
+    self.path = numpy.full((capacity, memory), -1, dtype=numpy.int32)
+
+  @property
+  def neighbors(self):
+    """Gets the (cells, 8) table of the neighbors of each cell of the world."""
+    return self.world.neighbors_array()
+
+  def __len__(self):
+    """Gets the number of ants."""
+    return self.count
+
+  def __iter__(self):
+    """Iterates over the views of the ants."""
+    return (AntView(self, i) for i in range(self.count))
+
+  def grow(self):
+    """Doubles the capacity of the arrays."""
+    for name in STATE:
+      old = getattr(self, name)
+      new = numpy.resize(old, (2 * len(old),) + old.shape[1:])
+      setattr(self, name, new)
+    self.path[self.count:] = -1
+
+  def append(self, ant, colony=0):
+    """Adds a new ant of the colony with the same state of the given Ant (but
+    its path)."""
+    if self.count == len(self.location):
+      self.grow()
+    i = self.count
+    self.location[i] = ant.location
+    self.direction[i] = ant.direction
+    self.food[i] = ant.food_quantity
+    self.age[i] = ant.age
+    self.key[i] = ant.key
+    self.colony[i] = colony
+    self.path_length[i] = 0
+    self.path_head[i] = 0
+    self.path[i] = -1
+    self.count += 1
+
+  def remove(self, ant):
+    """Removes the ant of the given view, moving the last ant in its place."""
+    i, last = ant.index, self.count - 1
+    for name in STATE:
+      a = getattr(self, name)
+      a[i] = a[last]
+    self.count -= 1
+
+  def take(self, ids):
+    """Removes the ants with the given ids, keeping the order of the others.
+    Returns the arrays of their state (see extend)."""
+    n = self.count
+    state = dict((name, getattr(self, name)[ids].copy()) for name in STATE)
+    keep = numpy.ones(n, dtype=bool)
+    keep[ids] = False
+    for name in STATE:
+      a = getattr(self, name)
+      a[:keep.sum()] = a[:n][keep]
+    self.count = int(keep.sum())
+    return state
+
+  def extend(self, state):
+    """Appends the ants with the state arrays of take."""
+    n = len(state['location'])
+    while self.count + n > len(self.location):
+      self.grow()
+    for name in STATE:
+      getattr(self, name)[self.count:self.count + n] = state[name]
+    self.count += n
+
+  def relocate(self, relocate):
+    """Moves every ant to the location given by the relocate function."""
+    for i in range(self.count):
+      self.location[i] = relocate(int(self.location[i]))
+    self.clear_path(numpy.arange(self.count))
+
+  def layers(self, ids):
+    """Gets the offset of the pheromone layer of each ant in the flattened
+    pheromone arrays of the world (0 in a world with a single colony)."""
+    world = self.world
+    if not isinstance(world, entity.NestsWorld):
+      return 0
+    return self.colony[ids] * world.layer
+
+  def nests(self, ids):
+    """Gets the nest of each ant."""
+    world = self.world
+    if not isinstance(world, entity.NestsWorld):
+      return world.nest
+    return world.colony_nests[self.colony[ids]]
+
+  def in_path(self, ids, cells):
+    """Returns True for each ant that recently passed through its cell."""
+    return (self.path[ids] == cells[:, None]).any(axis=1)
+
+  def clear_path(self, ids):
+    """Clears the history of the ants."""
+    self.path[ids] = -1
+    self.path_length[ids] = 0
+    self.path_head[ids] = 0
+
+  def forward(self, ids):
+    """Moves the ants forward and update their path with pheromone."""
+    world = self.world
+    here = self.location[ids]
+    fresh = ~self.in_path(ids, here)
+    foraging = self.food[ids] > 0
+    layered = here + self.layers(ids)
+    # pheromone deposit: when several ants mark the same cell, the shortest
+    # path wins and the lifespan is reinforced once for each ant
+    for strengths, lifespans, mask in (
+        (world.food_strengths, world.food_lifespans, fresh & foraging),
+        (world.colony_strengths, world.colony_lifespans, fresh & ~foraging)):
+      # the cells of every layer at once
+      strengths, lifespans = strengths.reshape(-1), lifespans.reshape(-1)
+      cells, lengths = layered[mask], self.path_length[ids[mask]]
+      strength = strengths[cells]
+      better = (strength == 0) | (strength >= lengths)
+      cells, lengths = cells[better], lengths[better]
+      if len(cells):
+        order = numpy.lexsort((lengths, cells))
+        cells, lengths = cells[order], lengths[order]
+        marked, first, times = numpy.unique(cells, return_index=True,
+                                            return_counts=True)
+        strengths[marked] = lengths[first]
+        lifespans[marked] += times
+        instrument.count('deposits', len(cells))
+    # update the path
+    movers = ids[fresh]
+    head = self.path_head[movers]
+    self.path[movers, head] = here[fresh]
+    self.path_head[movers] = (head + 1) % self.memory
+    self.path_length[movers] += 1
+    # move forward
+    self.location[ids] = self.neighbors[here, self.direction[ids]]
+    instrument.count('moves', len(ids))
+
+  def approach(self, ids, targets, turns):
+    """Turns the ants that have a target cell in one of the given turns (the
+    first one in order) towards it. Returns the ids of the turned ants and of
+    the remaining ones."""
+    left = numpy.ones(len(ids), dtype=bool)
+    for t in turns:
+      d = (self.direction[ids] + t) % 8
+      hit = left & targets(self.neighbors[self.location[ids], d])
+      self.direction[ids[hit]] = d[hit]
+      left &= ~hit
+    return ids[~left], ids[left]
+
+  def fitness_step(self, ids, strengths, lifespans, go_straight_probability):
+    """Turns the ants according to the pheromone of the ahead cells.
+    Returns the ids of the ants that have to move forward."""
+    d = (self.direction[ids, None] + numpy.arange(-1, 2)) % 8
+    cells = self.neighbors[self.location[ids, None], d]
+    cells = cells + numpy.reshape(self.layers(ids), (-1, 1))
+    strengths, lifespans = strengths.reshape(-1), lifespans.reshape(-1)
+    strength, lifespan = strengths[cells], lifespans[cells]
+    valid = (strength > 0) & (lifespan > 0)
+    best = numpy.where(valid, strength, numpy.inf).argmin(axis=1)
+    found = valid.any(axis=1)
+    self.direction[ids[found]] = d[found, best[found]]
+    if instrument.active is not None:
+      following = int(numpy.count_nonzero(found))
+      instrument.count('fitness_steps', following)
+      instrument.count('random_steps', len(ids) - following)
+    wandering = self.random_step(ids[~found], go_straight_probability)
+    return numpy.concatenate((ids[found], wandering))
+
+  def random_step(self, ids, go_straight_probability):
+    """Performs a random turn trying to avoid already followed paths.
+    Returns the ids of the ants that have to move forward (all of them).
+    The random numbers are the same of motion.random_step (see rng)."""
+    if not len(ids):
+      return ids
+    if numpy.ndim(go_straight_probability):
+      go_straight_probability = go_straight_probability[ids]
+    keys, counter = self.key[ids], rng.ant_counter(self.age[ids])
+    p = rng.uniforms(keys, counter)
+    here, direction = self.location[ids], self.direction[ids]
+    def free(turn):
+      cells = self.neighbors[here, (direction + turn) % 8]
+      return ~self.in_path(ids, cells)
+    straight = (p < go_straight_probability) & free(0)
+    glp = go_straight_probability + (1 - go_straight_probability) / 2
+    clockwise = ~straight & (p < glp) & free(-1)
+    counterclockwise = ~straight & ~clockwise & free(1)
+    stuck = ~straight & ~clockwise & ~counterclockwise
+    turn = numpy.zeros(len(ids), dtype=numpy.int64)
+    turn[clockwise] = 1
+    turn[counterclockwise] = -1
+    # clockwise, counterclockwise or still
+    moves = numpy.array((1, -1, 0))
+    turn[stuck] = moves[rng.belows(keys[stuck], counter[stuck] + 1, 3)]
+    self.direction[ids] = (direction + turn) % 8
+    return ids
+
+  def seek_food(self, ids, go_straight_probability, pheromone=True):
+    """Tries to approach the ants to the cells with food (following the
+    pheromone unless told otherwise).
+    Returns the ids of the ants that have to move forward."""
+    world = self.world
+    food = world.food_quantities
+    # take the food in the current cell: when several ants are in the same
+    # cell only the first ones get it
+    here = self.location[ids]
+    taking = (food[here] > 0) & (here != self.nests(ids))
+    takers, cells = ids[taking], here[taking]
+    order = numpy.argsort(cells, kind='stable')
+    takers, cells = takers[order], cells[order]
+    _, first, times = numpy.unique(cells, return_index=True, return_counts=True)
+    rank = numpy.arange(len(cells)) - numpy.repeat(first, times)
+    lucky = rank < food[cells]
+    takers, cells = takers[lucky], cells[lucky]
+    numpy.subtract.at(food, cells, 1)
+    self.food[takers] += 1
+    self.clear_path(takers)
+    self.direction[takers] = (self.direction[takers] + 4) % 8
+    ids = numpy.setdiff1d(ids, takers, assume_unique=True)
+    nest = self.nests(ids)
+    # approach the food ahead
+    closing, ids = self.approach(ids, lambda c: (food[c] > 0) & (c != nest),
+                                 (-1, 0, 1))
+    if not pheromone:
+      return numpy.concatenate((closing, self.random_step(
+        ids, go_straight_probability)))
+    following = self.fitness_step(ids, world.food_strengths,
+                                  world.food_lifespans, go_straight_probability)
+    return numpy.concatenate((closing, following))
+
+  def seek_nest(self, ids, go_straight_probability, pheromone=True):
+    """Tries to approach the ants to their own nest (following the pheromone
+    unless told otherwise).
+    Returns the ids of the ants that have to move forward."""
+    world = self.world
+    # drop the food in the nest
+    home = self.location[ids] == self.nests(ids)
+    droppers = ids[home]
+    dropped = int(self.food[droppers].sum())
+    if isinstance(world, entity.NestsWorld):
+      numpy.add.at(world.nest_food_quantities, self.colony[droppers],
+                   self.food[droppers])
+    else:
+      world.nest_food_quantity += dropped
+    world.food_quantity -= dropped
+    self.food[droppers] = 0
+    self.clear_path(droppers)
+    self.direction[droppers] = (self.direction[droppers] + 4) % 8
+    # approach the nest ahead
+    ids = ids[~home]
+    nest = self.nests(ids)
+    closing, ids = self.approach(ids, lambda c: c == nest,
+                                 (-2, -1, 0, 1, 2))
+    if not pheromone:
+      return numpy.concatenate((closing, self.random_step(
+        ids, go_straight_probability)))
+    following = self.fitness_step(ids, world.colony_strengths,
+                                  world.colony_lifespans,
+                                  go_straight_probability)
+    return numpy.concatenate((closing, following))
+
+  def step(self, go_straight_probability, pheromone=True):
+    """Performs a new action for every ant according to its status. The
+    go straight probability can be an array, with a value for each colony.
+    Unless pheromone, the ants ignore the pheromone (see behavior.wander)."""
+    if numpy.ndim(go_straight_probability):
+      go_straight_probability = numpy.asarray(go_straight_probability)[
+        self.colony[:self.count]]
+    dirty = self.world.dirty
+    if dirty is not None:
+      dirty.update(self.location[:self.count].tolist())
+    ids = numpy.arange(self.count)
+    foraging = self.food[:self.count] > 0
+    homing = self.seek_nest(ids[foraging], go_straight_probability, pheromone)
+    searching = self.seek_food(ids[~foraging], go_straight_probability,
+                               pheromone)
+    # all the ants that didn't take or drop food move forward at once
+    self.forward(numpy.concatenate((homing, searching)))
+    # get older
+    self.age[:self.count] += 1
+    if dirty is not None:
+      dirty.update(self.location[:self.count].tolist())
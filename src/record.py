@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+"""Ants simulator recording module.
+A Recorder streams the history of a Simulation to an append-only file, in
+zlib compressed blocks written by a background thread:
+- the aggregates of every step (see FIELDS);
+- optionally, the locations of a sample of the ants;
+- optionally, the frames of the world (see snapshot.Snapshot): a keyframe with
+  all the non-empty cells every so often, and in between only the cells
+  changed since the previous frame.
+The blocks are handed to the writer through a bounded queue, therefore the
+memory used by a recording doesn't depend on the length of the run.
+
+The file starts with the MAGIC bytes, the format version and the length of a
+JSON header ('<II'); each block is a BLOCK prefix (kind, count of items,
+step of the first item, raw length and compressed length) followed by the
+compressed data."""
+
+
+import sys
+import json
+import zlib
+import array
+import queue
+import struct
+import threading
+import entity
+import population
+import snapshot
+
+
+MAGIC = b'ANTSREC\0'
+VERSION = 1
+PREFIX = struct.Struct('<II')
+# kind, count, first step, raw length, compressed length
+BLOCK = struct.Struct('<BIqII')
+# kinds of blocks
+AGGREGATES, POSITIONS, FRAMES = 1, 2, 3
+# aggregates of a step, packed as a ROW
+FIELDS = ('step', 'ants', 'births', 'deaths', 'foraging', 'nest_food',
+          'world_food', 'coverage')
+ROW = struct.Struct('<qqqqdqqd')
+# step, number of ants (followed by their locations)
+SAMPLE = struct.Struct('<qI')
+# step, full, over, nest food, world food, number of ants and of cells
+FRAME = struct.Struct('<qBBqqII')
+
+
+
+def pack(values, typecode):
+  """Packs the values as little-endian bytes."""
+  packed = array.array(typecode, values)
+  if sys.byteorder == 'big':
+    packed.byteswap()
+  return packed.tobytes()
+
+
+def unpack(data, offset, typecode, count):
+  """Unpacks count values from data at offset. Returns the values and the
+  offset that follows them."""
+  values = array.array(typecode)
+  end = offset + count * values.itemsize
+  values.frombytes(data[offset:end])
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return values, end
+
+
+def encode_frame(s):
+  """Packs the Snapshot s as bytes."""
+  ants, cells = s.ants, s.cells
+  return b''.join((
+    FRAME.pack(s.steps, s.full, s.over, s.nest_food, s.world_food, len(ants),
+               len(cells)),
+    pack([l for l, _ in ants], 'i'),
+    pack([f for _, f in ants], 'B'),
+    pack([c[0] for c in cells], 'i'),
+    pack([c[1] for c in cells], 'd'),
+    pack([c[2] for c in cells], 'd'),
+    pack([c[3] for c in cells], 'q')))
+
+
+def decode_frames(data):
+  """Unpacks the Snapshots packed in data."""
+  offset = 0
+  while offset < len(data):
+    steps, full, over, nest_food, world_food, n, m = FRAME.unpack_from(
+      data, offset)
+    offset += FRAME.size
+    locations, offset = unpack(data, offset, 'i', n)
+    foraging, offset = unpack(data, offset, 'B', n)
+    ants = tuple(zip(locations, foraging))
+    columns = []
+    for typecode in 'iddq':
+      values, offset = unpack(data, offset, typecode, m)
+      columns.append(values)
+    yield snapshot.Snapshot(steps, bool(over), nest_food, world_food, ants,
+                            tuple(zip(*columns)), bool(full))
+
+
+def coverage(world):
+  """Gets the fraction of the cells with some pheromone."""
+  width, height = world.size
+  return float(world.live_count()) / (width * height)
+
+
+def foraging(ants):
+  """Gets the number of ants that are bringing food."""
+  if isinstance(ants, population.Population):
+    return int(entity.numpy.count_nonzero(ants.food[:len(ants)]))
+  return sum(1 for a in ants if a.food_quantity > 0)
+
+
+def row(simulation, births, deaths):
+  """Packs the aggregates (see FIELDS) of the step just performed by the
+  simulation, with the number of ants born and dead in it."""
+  world = simulation.world
+  ants = world.ants
+  n = len(ants)
+  return ROW.pack(simulation.steps, n, births, deaths,
+                  float(foraging(ants)) / n if n else 0.0,
+                  world.nest_food_quantity, world.food_quantity,
+                  coverage(world))
+
+
+
+class Recorder(object):
+  """Records the history of a Simulation in a file (see the module).
+  The aggregates are recorded every step, the sampled locations of (at most)
+  sample ants every sample_every steps, and the frames every frame_every steps
+  with a keyframe every keyframe_every frames. Blocks hold up to block_items
+  aggregates or samples, or block_bytes of frames; at most queue_blocks
+  blocks wait for the writer (then recording waits for it)."""
+
+  def __init__(self, filename, simulation, sample=0, sample_every=10,
+               frame_every=0, keyframe_every=100, block_items=4096,
+               block_bytes=1 << 20, queue_blocks=8):
+    """Creates the Recorder instance, writes the file header and starts the
+    writer thread."""
+    self.sample = sample
+    self.sample_every = sample_every
+    self.frame_every = frame_every
+    self.keyframe_every = keyframe_every
+    self.block_items = block_items
+    self.block_bytes = block_bytes
+    self.frames = 0
+    # pending items of each kind: (first step, count, chunks, bytes)
+    self.pending = dict()
+    world = simulation.world
+    if frame_every and world.dirty is None:
+      # the frames hold only the cells changed since the previous one
+      world.dirty = set()
+    self.out = open(filename, 'wb')
+    header = json.dumps({
+      'configuration': simulation.configuration,
+      'size': list(world.size),
+      'nest': world.nest,
+      'nests': list(world.nests),
+      'fields': FIELDS,
+      'sample': sample,
+      'sample_every': sample_every,
+      'frame_every': frame_every,
+      'keyframe_every': keyframe_every,
+    }, sort_keys=True).encode('utf-8')
+    self.out.write(MAGIC + PREFIX.pack(VERSION, len(header)) + header)
+    self.queue = queue.Queue(queue_blocks)
+    self.writer = threading.Thread(target=self.write)
+    self.writer.daemon = True
+    self.writer.start()
+
+  def write(self):
+    """Compresses and appends the queued blocks until the None sentinel."""
+    while True:
+      block = self.queue.get()
+      if block is None:
+        break
+      kind, first, count, data = block
+      compressed = zlib.compress(data)
+      self.out.write(BLOCK.pack(kind, count, first, len(data),
+                                len(compressed)))
+      self.out.write(compressed)
+      self.out.flush()
+
+  def add(self, kind, step, data, split=False):
+    """Adds an item to the pending block of its kind, handing the block to
+    the writer once full. If split, the pending block is handed to the writer
+    before adding the item, which then starts a new block."""
+    if split and kind in self.pending:
+      self.flush(kind)
+    first, count, chunks, size = self.pending.get(kind, (step, 0, [], 0))
+    chunks.append(data)
+    self.pending[kind] = first, count + 1, chunks, size + len(data)
+    if kind == FRAMES:
+      if size + len(data) >= self.block_bytes:
+        self.flush(kind)
+    elif count + 1 >= self.block_items:
+      self.flush(kind)
+
+  def flush(self, kind):
+    """Hands the pending block of the given kind to the writer."""
+    first, count, chunks, _ = self.pending.pop(kind)
+    self.queue.put((kind, first, count, b''.join(chunks)))
+
+  def record(self, simulation, births, deaths):
+    """Records the step just performed by the simulation, with the number of
+    ants born and dead in it."""
+    world = simulation.world
+    ants = world.ants
+    step = simulation.steps
+    n = len(ants)
+    self.add(AGGREGATES, step, row(simulation, births, deaths))
+    if self.sample and step % self.sample_every == 0:
+      stride = max(1, n // self.sample)
+      locations = [a.location for a in ants][::stride][:self.sample]
+      self.add(POSITIONS, step, SAMPLE.pack(step, len(locations)) +
+               pack(locations, 'i'))
+    if self.frame_every and step % self.frame_every == 0:
+      key = self.frames % self.keyframe_every == 0
+      s = snapshot.capture(world, step, simulation.over(), key)
+      # a keyframe starts a new block, so that a reader can start from it
+      self.add(FRAMES, step, encode_frame(s), key)
+      self.frames += 1
+
+  def close(self):
+    """Writes the pending blocks and closes the file."""
+    for kind in sorted(self.pending):
+      self.flush(kind)
+    self.queue.put(None)
+    self.writer.join()
+    self.out.close()
+
+
+
+def read_header(f):
+  """Reads the header of the recording open in the binary file f, leaving
+  the file at its first block."""
+  if f.read(len(MAGIC)) != MAGIC:
+    raise ValueError('Not a recording: {}'.format(f.name))
+  version, length = PREFIX.unpack(f.read(PREFIX.size))
+  if version != VERSION:
+    raise ValueError('Unsupported recording version: {}'.format(version))
+  return json.loads(f.read(length).decode('utf-8'))
+
+
+def read(filename):
+  """Reads a recording. Returns its header and a generator of its
+  (kind, first step, count, data) blocks, that closes the file once
+  exhausted (see read_header to read only the header)."""
+  f = open(filename, 'rb')
+  try:
+    header = read_header(f)
+  except Exception:
+    f.close()
+    raise
+  def blocks():
+    with f:
+      while True:
+        prefix = f.read(BLOCK.size)
+        # a truncated block (e.g. the run was killed) ends the recording
+        if len(prefix) < BLOCK.size:
+          break
+        kind, count, first, _, length = BLOCK.unpack(prefix)
+        data = f.read(length)
+        if len(data) < length:
+          break
+        yield kind, first, count, zlib.decompress(data)
+  return header, blocks()
+
+
+def aggregates(filename):
+  """Generates the aggregates of each step of a recording, as dictionaries
+  with the FIELDS keys."""
+  _, blocks = read(filename)
+  for kind, _, count, data in blocks:
+    if kind == AGGREGATES:
+      for i in range(count):
+        yield dict(zip(FIELDS, ROW.unpack_from(data, i * ROW.size)))
+
+
+def samples(filename):
+  """Generates the (step, locations) of the sampled ants of a recording."""
+  _, blocks = read(filename)
+  for kind, _, count, data in blocks:
+    if kind == POSITIONS:
+      offset = 0
+      for _ in range(count):
+        step, n = SAMPLE.unpack_from(data, offset)
+        locations, offset = unpack(data, offset + SAMPLE.size, 'i', n)
+        yield step, locations.tolist()
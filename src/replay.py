@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+"""Ants simulator replay module.
+A Recording maps a file written by record.Recorder (with frames) and indexes
+its blocks of frames, without reading them: each block is decompressed only
+when needed. Since every keyframe starts a new block, the state of the world
+at any step is rebuilt from the last keyframe before it, applying at most a
+keyframe interval of frames.
+A Player plays a Recording in place of a worker.SimulationThread: the window
+takes its snapshots at its own frame rate, while the Player moves forward
+according to the wall clock, at any speed, and can seek to any step."""
+
+
+import bisect
+import mmap
+import time
+import zlib
+import record
+import snapshot
+
+
+# speed up of the max speed mode
+MAX_SPEED_FACTOR = 10
+
+
+
+class Recording(object):
+  """Index of the frames of a recording, mapped in memory."""
+
+  def __init__(self, filename):
+    """Maps the file and indexes its blocks of frames."""
+    with open(filename, 'rb') as f:
+      header = record.read_header(f)
+      self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.header = header
+    self.configuration = header['configuration']
+    self.size = tuple(header['size'])
+    self.nest = header['nest']
+    self.nests = header.get('nests', [self.nest])
+    # (first step, offset, length, keyframe) of each block of frames
+    self.blocks = []
+    buf = self.buf
+    offset = len(record.MAGIC) + record.PREFIX.size
+    offset += record.PREFIX.unpack_from(buf, len(record.MAGIC))[1]
+    while offset + record.BLOCK.size <= len(buf):
+      kind, _, first, _, length = record.BLOCK.unpack_from(buf, offset)
+      offset += record.BLOCK.size
+      if offset + length > len(buf):
+        break
+      if kind == record.FRAMES:
+        self.blocks.append((first, offset, length, self.peek(offset, length)))
+      offset += length
+    if not self.blocks or not self.blocks[0][3]:
+      raise ValueError('No frames in recording: {}'.format(filename))
+    # blocks and first steps of the keyframes
+    self.keys = [i for i, b in enumerate(self.blocks) if b[3]]
+    self.key_steps = [self.blocks[i][0] for i in self.keys]
+    self.first_step = self.blocks[0][0]
+    self.last_step = next(reversed(self.frames(len(self.blocks) - 1))).steps
+
+  def peek(self, offset, length):
+    """Returns True if the block at offset starts with a keyframe, only
+    decompressing the beginning of its first frame."""
+    data = memoryview(self.buf)[offset:offset + length]
+    head = zlib.decompressobj().decompress(data, record.FRAME.size)
+    return bool(record.FRAME.unpack(head)[1])
+
+  def frames(self, block):
+    """Gets the list of the frames (Snapshots) of the block."""
+    _, offset, length, _ = self.blocks[block]
+    data = zlib.decompress(self.buf[offset:offset + length])
+    return list(record.decode_frames(data))
+
+  def keyframe(self, step):
+    """Gets the block of the last keyframe at (or before) step."""
+    i = bisect.bisect_right(self.key_steps, step) - 1
+    return self.keys[max(i, 0)]
+
+  def close(self):
+    """Unmaps the file."""
+    self.buf.close()
+
+
+
+class Player(object):
+  """Plays a Recording, with the same interface of a SimulationThread.
+  The speed is in recorded steps per second."""
+
+  def __init__(self, recording, speed):
+    """Creates and initializes the (paused) Player at the first frame."""
+    self.recording = recording
+    self.size = recording.size
+    self.nest = recording.nest
+    self.nests = recording.nests
+    self.speed = speed
+    self.max_speed = False
+    self.running = False
+    self.finished = False
+    self.seek(recording.first_step)
+
+  def seek(self, step):
+    """Rebuilds the world at the last frame at (or before) step, starting from
+    the closest keyframe."""
+    self.view = snapshot.WorldView(self.size, self.nest, self.nests)
+    self.changed = None
+    self.block = self.recording.keyframe(step)
+    self.frames = self.recording.frames(self.block)
+    self.next = 0
+    self.forward(step, True)
+    self.position = float(self.view.steps)
+    self.finished = False
+
+  def peek_frame(self):
+    """Gets the next frame to apply (None at the end of the recording)."""
+    while self.next == len(self.frames):
+      if self.block + 1 == len(self.recording.blocks):
+        return None
+      self.block += 1
+      self.frames = self.recording.frames(self.block)
+      self.next = 0
+    return self.frames[self.next]
+
+  def forward(self, step, first=False):
+    """Applies the frames up to step (at least one if first). Returns False
+    at the end of the recording."""
+    while True:
+      frame = self.peek_frame()
+      if frame is None:
+        return False
+      if frame.steps > step and not first:
+        return True
+      first = False
+      changed = self.view.apply(frame)
+      if changed is None or self.changed is None:
+        self.changed = None
+      else:
+        self.changed.update(changed)
+      self.next += 1
+
+  def advance(self, step):
+    """Moves to the last frame at (or before) step: forward if it's close,
+    otherwise seeking it."""
+    if step < self.view.steps or (
+        self.recording.keyframe(step) > self.block):
+      self.seek(step)
+      return True
+    return self.forward(step)
+
+  def snapshot(self, full=False):
+    """Moves the player according to the time elapsed since the previous
+    snapshot, and takes the snapshot of the changes since then."""
+    now = time.time()
+    if self.running:
+      factor = MAX_SPEED_FACTOR if self.max_speed else 1
+      self.position += (now - self.clock) * self.speed * factor
+      if not self.advance(int(self.position)):
+        self.running = False
+        self.finished = True
+    self.clock = now
+    view = self.view
+    if full or self.changed is None:
+      cells = tuple((l,) + v for l, v in view.cells.items())
+      full = True
+    else:
+      cells = tuple((l,) + view.cells.get(l, (0, 0, 0)) for l in self.changed)
+    self.changed = set()
+    return snapshot.Snapshot(view.steps, view.over, view.nest_food_quantity,
+                             view.food_quantity, view.ants, cells, full)
+
+  def pause(self):
+    """Pauses the replay."""
+    self.running = False
+
+  def resume(self):
+    """Resumes the replay (from the beginning if it's over)."""
+    if self.finished:
+      self.seek(self.recording.first_step)
+    self.clock = time.time()
+    self.running = True
+
+  def stop(self):
+    """Stops the replay."""
+    self.running = False
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+"""Ants simulator random numbers module.
+The random numbers are counter-based: the n-th number of a stream is a hash
+(the SplitMix64 finalizer) of the stream key and of n, so it doesn't depend
+on the numbers drawn before it, in this stream or in any other one.
+Each subsystem of a world (e.g. the food placement) draws from its own Stream,
+while the numbers of an ant are keyed by the ant and counted by its age: the
+moves of the ants are the same whatever the order (or the batches) they're
+stepped in. With NumPy the numbers of many keys and counters are computed at
+once, equal to the ones computed one by one."""
+
+
+import zlib
+import random
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+MASK = (1 << 64) - 1
+# increment of the counters (the golden ratio, as in SplitMix64)
+GAMMA = 0x9E3779B97F4A7C15
+# multipliers of the SplitMix64 finalizer
+MIX1, MIX2 = 0xBF58476D1CE4E5B9, 0x94D049BB133111EB
+# scale of the 53 bits of a float in [0, 1)
+UNIT = 2.0 ** -53
+# numbers drawn by an ant at each age
+ANT_DRAWS = 2
+
+
+
+def mix(z):
+  """Hashes the 64 bits integer z."""
+  z = (z ^ (z >> 30)) * MIX1 & MASK
+  z = (z ^ (z >> 27)) * MIX2 & MASK
+  return z ^ (z >> 31)
+
+
+def derive(key, name):
+  """Derives the key of the substream of key with the given name (a string
+  or an integer)."""
+  if not isinstance(name, int):
+    name = zlib.crc32(name.encode('utf-8'))
+  return mix((key ^ mix(name + GAMMA & MASK)) + GAMMA & MASK)
+
+
+def uniform(key, counter):
+  """Gets the number of the stream key at counter, in [0, 1)."""
+  return (mix(key + counter * GAMMA & MASK) >> 11) * UNIT
+
+
+def below(key, counter, n):
+  """Gets the number of the stream key at counter, in [0, n)."""
+  return int(uniform(key, counter) * n)
+
+
+def uniforms(keys, counters):
+  """Gets the numbers of the keys at the counters (NumPy arrays), in [0, 1)."""
+  with numpy.errstate(over='ignore'):
+    z = keys.astype(numpy.uint64) + (counters.astype(numpy.uint64) *
+                                     numpy.uint64(GAMMA))
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(MIX1)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(MIX2)
+    z ^= z >> numpy.uint64(31)
+  return (z >> numpy.uint64(11)).astype(numpy.float64) * UNIT
+
+
+def belows(keys, counters, n):
+  """Gets the numbers of the keys at the counters (NumPy arrays), in [0, n)."""
+  return (uniforms(keys, counters) * n).astype(numpy.int64)
+
+
+def ant_counter(age, draw=0):
+  """Gets the counter of the draw-th number of an ant at the given age."""
+  return age * ANT_DRAWS + draw
+
+
+
+class Stream(object):
+  """Stream of random numbers of a subsystem."""
+
+  __slots__ = ('key', 'counter')
+
+  def __init__(self, key, counter=0):
+    """Creates and initializes the Stream instance."""
+    self.key = key
+    self.counter = counter
+
+  def random(self):
+    """Gets the next number, in [0, 1)."""
+    self.counter += 1
+    return uniform(self.key, self.counter - 1)
+
+  def randrange(self, n):
+    """Gets the next number, in [0, n)."""
+    return int(self.random() * n)
+
+  def choice(self, seq):
+    """Gets a random element of the sequence."""
+    return seq[self.randrange(len(seq))]
+
+
+
+class Streams(object):
+  """Random numbers of a world: a Stream for each subsystem, and the keys of
+  the ants (one for each ant ever born)."""
+
+  def __init__(self, seed=None):
+    """Creates and initializes the Streams instance. Without a seed, the seed
+    is drawn from the random module."""
+    if seed is None:
+      seed = random.getrandbits(64)
+    self.seed = seed
+    self.key = mix(seed & MASK)
+    self.streams = dict()
+    self.ants = 0
+
+  def stream(self, name):
+    """Gets the Stream of the subsystem with the given name."""
+    if name not in self.streams:
+      self.streams[name] = Stream(derive(self.key, name))
+    return self.streams[name]
+
+  def spawn(self):
+    """Gets the key of a new ant."""
+    self.ants += 1
+    return derive(derive(self.key, 'ants'), self.ants - 1)
+
+  def state(self):
+    """Gets the state (a JSON serializable dictionary)."""
+    return {
+      'seed': self.seed,
+      'ants': self.ants,
+      'counters': dict((n, s.counter) for n, s in self.streams.items()),
+    }
+
+  @classmethod
+  def restore(cls, state):
+    """Creates the Streams instance with the given state."""
+    streams = cls(state['seed'])
+    streams.ants = state['ants']
+    for name, counter in state['counters'].items():
+      streams.stream(name).counter = counter
+    return streams
@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+"""Ants simulator streaming server module.
+A Server advances a Simulation in an asyncio event loop and streams it to any
+number of viewers connected to a local socket: after a header (the
+configuration and the geometry of the world) and a keyframe of the whole
+world, each step is sent as a delta, the aggregates of the step (births and
+deaths included, see record.FIELDS) followed by a frame of the ants and of
+the changed cells (see record.encode_frame). Every keyframe_every steps the
+frame is a keyframe.
+Each viewer has its own bounded queue of messages, and the simulation never
+waits for the viewers: when the queue of a slow viewer is full it's emptied,
+and the viewer skips the deltas up to the next keyframe.
+
+A message is its kind and length (MESSAGE) followed by its zlib compressed
+payload."""
+
+
+import sys
+import json
+import zlib
+import struct
+import asyncio
+import argparse
+import config
+import record
+import sim
+import snapshot
+
+
+# kind and length of the payload of a message
+MESSAGE = struct.Struct('<BI')
+# kinds of message: the JSON header and the frames (aggregates and snapshot)
+HEADER, FRAME = 1, 2
+# default port on the local host
+PORT = 8642
+# steps between two keyframes
+KEYFRAME_EVERY = 100
+# messages waiting for a viewer before it's skipped to the next keyframe
+QUEUE_MESSAGES = 64
+
+
+
+def message(kind, payload):
+  """Packs a message of the given kind."""
+  data = zlib.compress(payload)
+  return MESSAGE.pack(kind, len(data)) + data
+
+
+def frame(payload):
+  """Unpacks the payload of a FRAME message as the aggregates (a dictionary
+  with the record.FIELDS keys) and the Snapshot of the step."""
+  aggregates = dict(zip(record.FIELDS, record.ROW.unpack_from(payload)))
+  return aggregates, next(record.decode_frames(payload[record.ROW.size:]))
+
+
+
+class Viewer(object):
+  """Connected viewer: the queue of the messages to send to it."""
+
+  def __init__(self, writer, queue_messages):
+    """Creates and initializes the Viewer instance."""
+    self.writer = writer
+    self.queue = asyncio.Queue(queue_messages)
+    # True if the deltas are skipped until the next keyframe
+    self.behind = False
+    self.skipped = 0
+
+  def offer(self, data, key):
+    """Queues the message (a keyframe if key) without waiting: if the queue
+    is full it's emptied, and the deltas are skipped until a keyframe."""
+    if self.queue.full():
+      while not self.queue.empty():
+        self.queue.get_nowait()
+        self.skipped += 1
+      self.behind = True
+    if self.behind and not key:
+      self.skipped += 1
+      return
+    self.behind = False
+    self.queue.put_nowait(data)
+
+  async def send(self):
+    """Writes the queued messages to the viewer, until it disconnects."""
+    writer = self.writer
+    while True:
+      writer.write(await self.queue.get())
+      await writer.drain()
+
+
+
+class Server(object):
+  """Advances a simulation, streaming its steps to the connected viewers.
+  Unless at max speed, it waits step_delay_ms between two steps."""
+
+  def __init__(self, simulation, step_delay_ms, keyframe_every=KEYFRAME_EVERY,
+               queue_messages=QUEUE_MESSAGES):
+    """Creates and initializes the Server instance."""
+    self.simulation = simulation
+    self.delay = step_delay_ms / 1000.0
+    self.max_speed = False
+    self.keyframe_every = keyframe_every
+    self.queue_messages = queue_messages
+    self.viewers = set()
+    # the deltas hold only the cells changed since the previous step
+    simulation.world.dirty = set()
+
+  def header(self):
+    """Gets the HEADER message."""
+    s = self.simulation
+    world = s.world
+    return message(HEADER, json.dumps({
+      'configuration': s.configuration,
+      'size': list(world.size),
+      'nest': world.nest,
+      'nests': list(world.nests),
+      'fields': record.FIELDS,
+      'keyframe_every': self.keyframe_every,
+    }, sort_keys=True).encode('utf-8'))
+
+  def frame(self, births=0, deaths=0, full=False):
+    """Gets the FRAME message of the current step."""
+    s = self.simulation
+    world = s.world
+    if full:
+      # a keyframe between two deltas leaves the changed cells to the next
+      dirty = world.dirty
+      frame = snapshot.capture(world, s.steps, s.over(), True)
+      world.dirty = dirty
+    else:
+      frame = snapshot.capture(world, s.steps, s.over())
+    payload = record.row(s, births, deaths) + record.encode_frame(frame)
+    return message(FRAME, payload)
+
+  async def serve(self, reader, writer):
+    """Streams the simulation to a new viewer, from a keyframe of the
+    current step."""
+    viewer = Viewer(writer, self.queue_messages)
+    viewer.offer(self.header(), True)
+    viewer.offer(self.frame(full=True), True)
+    self.viewers.add(viewer)
+    try:
+      await viewer.send()
+    except ConnectionError:
+      pass
+    finally:
+      self.viewers.discard(viewer)
+      writer.close()
+
+  async def run(self, steps):
+    """Advances the simulation until it's over or the given number of steps
+    has been reached, sending each step to the viewers."""
+    s = self.simulation
+    while s.steps < steps:
+      born, died = s.advance()
+      # the last step is a keyframe, for the viewers that are behind
+      last = s.over() or s.steps == steps
+      key = last or s.steps % self.keyframe_every == 0
+      data = self.frame(born, died, key)
+      for viewer in list(self.viewers):
+        viewer.offer(data, key)
+      if last:
+        break
+      # let the viewers be served
+      await asyncio.sleep(0 if self.max_speed else self.delay)
+
+  async def start(self, host, port, steps):
+    """Listens on host:port and runs the simulation, serving the viewers
+    until interrupted."""
+    listener = await asyncio.start_server(self.serve, host, port)
+    async with listener:
+      await self.run(steps)
+      await listener.serve_forever()
+
+
+
+def main(argv=None):
+  """Runs a simulation server from the command line."""
+  parser = argparse.ArgumentParser(description='Ants simulator server.')
+  parser.add_argument('config', nargs='?', help='program configuration file')
+  parser.add_argument('-n', '--steps', type=int, default=10000,
+                      help='maximum number of steps (default: %(default)s)')
+  parser.add_argument('-s', '--seed', type=int, help='random seed')
+  parser.add_argument('--host', default='localhost',
+                      help='address to listen on (default: %(default)s)')
+  parser.add_argument('-p', '--port', type=int, default=PORT,
+                      help='port to listen on (default: %(default)s)')
+  parser.add_argument('--keyframe-every', type=int, default=KEYFRAME_EVERY,
+                      help='steps between two keyframes '
+                      '(default: %(default)s)')
+  parser.add_argument('--max-speed', action='store_true',
+                      help="don't wait step_delay_ms between two steps")
+  args = parser.parse_args(argv)
+  if args.config:
+    configuration = config.deserialize(args.config)
+  else:
+    _, configuration = config.default()
+  simulation = sim.Simulation(configuration, args.seed)
+  server = Server(simulation, configuration['step_delay_ms'],
+                  args.keyframe_every)
+  server.max_speed = args.max_speed
+  try:
+    asyncio.run(server.start(args.host, args.port, args.steps))
+  except KeyboardInterrupt:
+    pass
+  return 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
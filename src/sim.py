@@ -2,9 +2,28 @@
 """Ants simulator module."""
 
 
-import random
+import sys
+import time
+import json
+import argparse
+import config
 import entity
 import behavior
+import compiled
+import population
+import instrument
+import checkpoint
+import record
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# settings of the configuration that each colony can override
+COLONY_SETTINGS = ('nest_location', 'go_straight_probability', 'ant_color',
+                   'ant_foraging_color', 'nest_color')
 
 
 
@@ -12,11 +31,19 @@ def place_food(world, cardinality, quantity):
   """Place some food in random cells of the world."""
   world.food_quantity = cardinality * quantity
   width, height = world.size
+  stream = world.rng.stream('food')
+  nests = world.nests
   i = 0
   while i < cardinality:
-    loc = random.randrange(0, width), random.randrange(0, height)
-    if loc != world.nest:
+    x, y = stream.randrange(width), stream.randrange(height)
+    loc = world.index((x, y))
+    if loc not in nests:
       world[loc].food_quantity += quantity
+      world.mark_food(loc)
+      world.mark_dirty(loc)
+    elif isinstance(world, entity.NestsWorld):
+      world.nest_food_quantities[nests.index(loc)] += quantity
+      world.food_quantity -= quantity
     else:
       world.nest_food_quantity += quantity
       world.food_quantity -= quantity
@@ -24,49 +51,354 @@ def place_food(world, cardinality, quantity):
 
 
 def birth(world, food_qty, upper_bound=None, direction=None):
-  """Add a new ant if possible."""
+  """Add a new ant if possible. Returns the new ant (or None)."""
   # check if the number of current ants is lower of the upper bound
   if not upper_bound or len(world.ants) < upper_bound:
     # check if the nest has enough food
     if world.nest_food_quantity >= food_qty:
-      verse = direction or random.randrange(0, 8)
+      verse = direction or world.rng.stream('birth').randrange(8)
       world.nest_food_quantity -= food_qty
-      world.ants.append(entity.Ant(world, verse))
+      ant = entity.Ant(world, verse)
+      world.ants.append(ant)
+      world.mark_dirty(world.nest)
+      return ant
 
 
 def death(world, life_expectancy):
-  """Kill an ald ant."""
+  """Kill an ald ant. Returns the dead ant (or None)."""
+  ants = world.ants
   # get the ants too old
-  ancients = [a for a in world.ants if a.age > life_expectancy]
-  if ancients:
+  if isinstance(ants, population.Population):
+    ancients = numpy.flatnonzero(ants.age[:len(ants)] > life_expectancy)
+  else:
+    ancients = ants.older(life_expectancy)
+  if len(ancients):
     # random choice of the dying ant
-    dying = random.choice(ancients)
+    dying = ancients[world.rng.stream('death').randrange(len(ancients))]
+    if isinstance(ants, population.Population):
+      dying = population.AntView(ants, int(dying))
     # drop the food of the dying ant
     if dying.location == world.nest:
       world.nest_food_quantity += dying.food_quantity
       world.food_quantity -= dying.food_quantity
     else:
       world[dying.location].food_quantity += dying.food_quantity
-    world.ants.remove(dying)
+      world.mark_food(dying.location)
+    world.mark_dirty(dying.location)
+    ants.remove(dying)
+    return dying
 
 
-def evaporate(world, colony_ph_factor, food_ph_factor):
-  width, height = world.size
-  x = 0
-  while x < width:
-    y = 0
-    while y < height:
-      if entity.colony_lifespan(world.cells[x][y]) > 0:
-        world.cells[x][y].colony_ph[1] -= colony_ph_factor
-      if entity.food_lifespan(world.cells[x][y]) > 0:
-        world.cells[x][y].food_ph[1] -= food_ph_factor
-      y += 1
-    x += 1
-
-
-def step(world, gsp, cphdf, fphdf):
-  """Move all the ants forward to the next generation."""
-  for a in world.ants:
-    behavior.act(a, gsp)
+def colonies_birth(world, food_qty, upper_bound=None):
+  """Add a new ant to each colony of a ColoniesWorld if possible (the upper
+  bound is per colony). Returns the number of ants born."""
+  ants = world.ants
+  counts = numpy.bincount(ants.colony[:len(ants)], minlength=world.colonies)
+  stream = world.rng.stream('birth')
+  born = 0
+  for colony, nest in enumerate(world.nests):
+    if upper_bound and counts[colony] >= upper_bound:
+      continue
+    if world.nest_food_quantities[colony] >= food_qty:
+      world.nest_food_quantities[colony] -= food_qty
+      ant = entity.Ant(world, stream.randrange(8))
+      ant.location = nest
+      ants.append(ant, colony)
+      world.mark_dirty(nest)
+      born += 1
+  return born
+
+
+def colonies_death(world, life_expectancy):
+  """Kill an old ant of each colony of a ColoniesWorld. Returns the number of
+  dead ants."""
+  ants = world.ants
+  n = len(ants)
+  ancients = numpy.flatnonzero(ants.age[:n] > life_expectancy)
+  stream = world.rng.stream('death')
+  dying = []
+  for colony in range(world.colonies):
+    elders = ancients[ants.colony[ancients] == colony]
+    if len(elders):
+      dying.append(int(elders[stream.randrange(len(elders))]))
+  # the last ants first, since each one is replaced by the last ant
+  for i in sorted(dying, reverse=True):
+    ant = population.AntView(ants, i)
+    if ant.location == world.colony_nests[ant.colony]:
+      world.nest_food_quantities[ant.colony] += ant.food_quantity
+      world.food_quantity -= ant.food_quantity
+    else:
+      world.food_quantities[ant.location] += ant.food_quantity
+    world.mark_dirty(ant.location)
+    ants.remove(ant)
+  return len(dying)
+
+
+def evaporate_arrays(world, colony_ph_factor, food_ph_factor, native=True):
+  """Pheromone evaporation over the arrays of an ArrayWorld (all the layers
+  of a ColoniesWorld at once), compiled if available and native (unless the
+  changed cells are tracked)."""
+  if instrument.active is not None:
+    instrument.count('evaporated', int(numpy.count_nonzero(world.live_mask())))
+  if native and compiled.numba is not None and world.dirty is None:
+    compiled.evaporate(world.colony_lifespans.reshape(-1), colony_ph_factor)
+    compiled.evaporate(world.food_lifespans.reshape(-1), food_ph_factor)
+    return
+  for lifespan, factor in ((world.colony_lifespans, colony_ph_factor),
+                           (world.food_lifespans, food_ph_factor)):
+    alive = lifespan > 0
+    # subtracting 0 from the others is faster than a masked subtraction
+    lifespan -= alive * factor
+    if world.dirty is not None:
+      if alive.ndim > 1:
+        alive = alive.any(axis=0)
+      world.dirty.update(numpy.flatnonzero(alive).tolist())
+
+
+def evaporate(world, colony_ph_factor, food_ph_factor, native=True):
+  """Decrease the lifespan of the pheromone in every cell of the world."""
+  if isinstance(world, entity.ArrayWorld):
+    evaporate_arrays(world, colony_ph_factor, food_ph_factor, native)
+  else:
+    world.evaporate(colony_ph_factor, food_ph_factor)
+
+
+def step(world, gsp, cphdf, fphdf, kernel=None, native=True):
+  """Move all the ants forward to the next generation, according to the
+  behavior kernel (by default the forage one, compiled if available and
+  native). With NumPy ants the go straight probability can be an array, with
+  a value for each colony."""
+  kernel = kernel or behavior.KERNELS['forage']
+  with instrument.phase('behavior'):
+    kernel.apply(world.ants, gsp, native)
   # simulate pheromone evaporation
-  evaporate(world, cphdf, fphdf)
+  with instrument.phase('evaporate'):
+    evaporate(world, cphdf, fphdf, native)
+
+
+
+def colony_settings(configuration):
+  """Gets the settings (see COLONY_SETTINGS) of each colony: the ones of the
+  configuration, unless overridden by its colonies list."""
+  colonies = configuration.get('colonies') or [dict()]
+  return [dict((k, colony.get(k, configuration[k])) for k in COLONY_SETTINGS)
+          for colony in colonies]
+
+
+def create_world(configuration, seed=None):
+  """Creates the world described by the configuration and places its food.
+  The seed of its random numbers is drawn from the random module if None."""
+  size = tuple(configuration['world_size'])
+  nest_loc = tuple(configuration['nest_location'])
+  food_qty = configuration['initial_food_quantity']
+  if (configuration.get('pheromone_decay') == 'lazy' and
+      configuration.get('world_storage') == 'numpy'):
+    raise ValueError('Lazy pheromone decay requires the cells world storage')
+  if configuration.get('colonies'):
+    if (configuration.get('world_storage') != 'numpy' or
+        configuration.get('ants_storage') != 'numpy'):
+      raise ValueError('Colonies require NumPy world and ants storage')
+    nests = [tuple(c['nest_location'])
+             for c in colony_settings(configuration)]
+    world = entity.ColoniesWorld(size, nests, food_qty, seed)
+  elif configuration.get('world_storage') == 'numpy':
+    world = entity.ArrayWorld(size, nest_loc, food_qty, seed)
+  elif configuration.get('pheromone_decay') == 'lazy':
+    world = entity.LazyWorld(size, nest_loc, food_qty, seed)
+  else:
+    world = entity.World(size, nest_loc, food_qty, seed)
+  food_cardinality = configuration['food_places_number']
+  food_qty = configuration['food_quantity']
+  place_food(world, food_cardinality, food_qty)
+  if configuration.get('ants_storage') == 'numpy':
+    if not isinstance(world, entity.ArrayWorld):
+      raise ValueError('NumPy ants storage requires NumPy world storage')
+    world.ants = population.Population(world)
+  return world
+
+
+def cadence(delay_ms, step_delay_ms):
+  """Converts a delay in milliseconds in a number of steps."""
+  if step_delay_ms <= 0:
+    return 1
+  return max(1, int(round(float(delay_ms) / step_delay_ms)))
+
+
+
+class Simulation:
+  """Runs a simulation without any display, as fast as possible.
+  The birth and death delays are converted in step cadences (relative to the
+  step delay), therefore a run only depends on the configuration and on the
+  random seed, and not on the wall clock."""
+
+  def __init__(self, configuration, seed=None, world=None):
+    """Creates the world (unless given) and initializes the Simulation
+    instance."""
+    self.configuration = configuration
+    self.world = world or create_world(configuration, seed)
+    self.steps = 0
+    self.peak_ants = 0
+    self.initial_food_quantity = self.world.food_quantity
+    self.elapsed = 0.0
+    # record.Recorder of the steps (if any)
+    self.recorder = None
+    step_delay = configuration['step_delay_ms']
+    self.birth_every = cadence(configuration['birth_delay_ms'], step_delay)
+    self.death_every = cadence(configuration['death_delay_ms'], step_delay)
+    self.kernel = behavior.kernel(configuration)
+    self.native = configuration.get('compiled_behavior', True)
+    self.colonies = isinstance(self.world, entity.ColoniesWorld)
+    if self.colonies:
+      # the go straight probability of each colony
+      self.go_straight_probability = numpy.array(
+        [c['go_straight_probability'] for c in colony_settings(configuration)])
+    else:
+      self.go_straight_probability = configuration['go_straight_probability']
+
+  def over(self):
+    """Returns True if there are no more ants or no more food to collect."""
+    return len(self.world.ants) == 0 or self.world.food_quantity == 0
+
+  def advance(self):
+    """Moves the simulation forward by one step, giving birth to a new ant
+    and killing an old one according to their cadences. Returns the number
+    of ants born and dead in the step."""
+    c = self.configuration
+    born = died = 0
+    if self.steps % self.birth_every == 0:
+      with instrument.phase('birth'):
+        if self.colonies:
+          born = colonies_birth(self.world, c['food_quantity_per_ant'],
+                                c['max_ants_number'])
+        else:
+          born = int(birth(self.world, c['food_quantity_per_ant'],
+                           c['max_ants_number']) is not None)
+    step(self.world, self.go_straight_probability,
+         c['colony_pheromone_decreasing_factor'],
+         c['food_pheromone_decreasing_factor'], self.kernel, self.native)
+    if self.steps % self.death_every == 0:
+      with instrument.phase('death'):
+        if self.colonies:
+          died = colonies_death(self.world, c['life_expectancy_steps'])
+        else:
+          died = int(death(self.world,
+                           c['life_expectancy_steps']) is not None)
+    self.peak_ants = max(self.peak_ants, len(self.world.ants))
+    self.steps += 1
+    instrument.end_step()
+    if self.recorder:
+      with instrument.phase('record'):
+        self.recorder.record(self, born, died)
+    return born, died
+
+  def run(self, steps):
+    """Advances the simulation until it's over or the given number of steps
+    has been reached. Returns the report of the simulation."""
+    start = time.time()
+    while self.steps < steps:
+      self.advance()
+      if self.over():
+        break
+    self.elapsed += time.time() - start
+    return self.report()
+
+  def report(self):
+    """Returns a dictionary with the current statistics of the simulation
+    (with several colonies, also the ants and the nest food of each one)."""
+    collected = self.initial_food_quantity - self.world.food_quantity
+    report = {
+      'steps': self.steps,
+      'over': self.over(),
+      'ants': len(self.world.ants),
+      'peak_ants': self.peak_ants,
+      'nest_food': self.world.nest_food_quantity,
+      'world_food': self.world.food_quantity,
+      'food_collected': collected,
+      'food_collected_per_step': float(collected) / max(1, self.steps),
+      'elapsed': self.elapsed,
+      'steps_per_sec': self.steps / self.elapsed if self.elapsed else 0.0,
+    }
+    if self.colonies:
+      world = self.world
+      ants = world.ants
+      report['colony_ants'] = numpy.bincount(
+        ants.colony[:len(ants)], minlength=world.colonies).tolist()
+      report['colony_nest_food'] = world.nest_food_quantities.tolist()
+    return report
+
+
+
+def main(argv=None):
+  """Runs a headless simulation from the command line."""
+  parser = argparse.ArgumentParser(description='Headless ants simulator.')
+  parser.add_argument('config', nargs='?', help='program configuration file')
+  parser.add_argument('-n', '--steps', type=int, default=10000,
+                      help='maximum number of steps (default: %(default)s)')
+  parser.add_argument('-s', '--seed', type=int, help='random seed')
+  parser.add_argument('--json', action='store_true',
+                      help='print the report as JSON')
+  parser.add_argument('--resume', help='checkpoint file to resume from')
+  parser.add_argument('--checkpoint',
+                      help='checkpoint file written at the end of the run')
+  parser.add_argument('--record', help='file where the run is recorded')
+  parser.add_argument('--record-sample', type=int, default=0,
+                      help='number of ants whose locations are recorded')
+  parser.add_argument('--record-frames', type=int, default=0,
+                      help='steps between two recorded frames of the world')
+  parser.add_argument('--profile',
+                      help='JSON file of the timings of the phases and of '
+                      'the counters of the steps')
+  parser.add_argument('--tiles', type=int, nargs=2, metavar=('TX', 'TY'),
+                      help='split the world in TX x TY tiles, each one '
+                      'stepped by its own process')
+  args = parser.parse_args(argv)
+  if args.tiles and (args.resume or args.checkpoint or args.record):
+    parser.error('--tiles cannot be used with checkpoints or recordings')
+  if args.profile:
+    instrument.enable()
+  if args.tiles:
+    # imported here, since tiles extends this module
+    import tiles
+    if args.config:
+      configuration = config.deserialize(args.config)
+    else:
+      _, configuration = config.default()
+    simulation = tiles.TiledSimulation(configuration, args.tiles, args.seed)
+  elif args.resume:
+    simulation = checkpoint.restore(args.resume)
+  else:
+    if args.config:
+      configuration = config.deserialize(args.config)
+    else:
+      _, configuration = config.default()
+    simulation = Simulation(configuration, args.seed)
+  if args.record:
+    simulation.recorder = record.Recorder(args.record, simulation,
+                                          sample=args.record_sample,
+                                          frame_every=args.record_frames)
+  try:
+    report = simulation.run(args.steps)
+  finally:
+    if simulation.recorder:
+      simulation.recorder.close()
+    if args.tiles:
+      simulation.close()
+  if args.checkpoint:
+    checkpoint.save(simulation, args.checkpoint)
+  if args.profile:
+    with open(args.profile, 'w') as f:
+      json.dump(instrument.active.report(), f, indent=2, sort_keys=True)
+    instrument.disable()
+  if args.json:
+    print(json.dumps(report, indent=2, sort_keys=True))
+  else:
+    print('Steps: {steps} ({steps_per_sec:.1f} steps/sec)'.format(**report))
+    print('Ants: {ants} (peak {peak_ants})'.format(**report))
+    print('Nest food: {nest_food}'.format(**report))
+    print('Food left: {world_food}'.format(**report))
+  return 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
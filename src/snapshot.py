@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+"""Ants simulator snapshots module.
+A Snapshot is an immutable copy of what's needed to draw a world: the ants and
+the state of the cells changed since the previous snapshot (or of all of them).
+A WorldView rebuilds the drawable state of a world applying its snapshots, so
+that it can be drawn while the world itself keeps changing."""
+
+
+import collections
+import entity
+
+
+# immutable copy of the state of a world:
+# - steps, over: the number of steps and if the simulation is over
+# - nest_food, world_food: the food in the nest and the food left
+# - ants: tuple of the (location, foraging) of each ant; with several colonies
+#   foraging is the number colony * 2 + foraging
+# - cells: tuple of the (location, colony lifespan, food lifespan, food
+#   quantity) of each changed cell; with several colonies the lifespans are
+#   the longest ones of the colonies
+# - full: True if cells holds all the non-empty cells (and only them)
+Snapshot = collections.namedtuple(
+  'Snapshot', 'steps over nest_food world_food ants cells full')
+
+
+def cell_state(world, location):
+  """Gets the (location, colony lifespan, food lifespan, food quantity) of the
+  cell in location."""
+  if isinstance(world, entity.ColoniesWorld):
+    return (location, world.colony_lifespans[:, location].max(),
+            world.food_lifespans[:, location].max(),
+            world.food_quantities.item(location))
+  cell = world[location]
+  return (location, entity.colony_lifespan(cell), entity.food_lifespan(cell),
+          cell.food_quantity)
+
+
+def nonempty(world):
+  """Gets the locations of the cells with food or pheromone."""
+  if isinstance(world, entity.ArrayWorld):
+    mask = (world.food_quantities > 0) | world.live_mask()
+    return entity.numpy.flatnonzero(mask).tolist()
+  # only the indexed cells with food or pheromone need to be visited
+  cells = world.cells
+  return [l for l in sorted(world.food_cells | world.live)
+          if cells[l].food_quantity > 0 or cells[l].colony_lifespan > 0 or
+          cells[l].food_lifespan > 0]
+
+
+def capture(world, steps=0, over=False, full=False):
+  """Takes the snapshot of the world. Unless full, only the cells marked as
+  dirty are copied and the dirty set is cleared."""
+  if full or world.dirty is None:
+    locations = nonempty(world)
+    full = True
+  else:
+    locations = world.dirty
+  cells = tuple(cell_state(world, l) for l in locations)
+  if world.dirty is not None:
+    world.dirty = set()
+  if isinstance(world, entity.NestsWorld):
+    ants = tuple((a.location, a.colony * 2 + a.foraging())
+                 for a in world.ants)
+  else:
+    ants = tuple((a.location, a.foraging()) for a in world.ants)
+  return Snapshot(steps, over, world.nest_food_quantity, world.food_quantity,
+                  ants, cells, full)
+
+
+
+class WorldView(object):
+  """Drawable state of a world, rebuilt from its snapshots."""
+
+  def __init__(self, size, nest, nests=None):
+    """Creates and initializes an empty WorldView instance. The nests of the
+    colonies are the nest alone unless given."""
+    self.size = tuple(size)
+    self.nest = nest
+    self.nests = tuple(nests or (nest,))
+    # (colony lifespan, food lifespan, food quantity) of the non-empty cells
+    self.cells = dict()
+    self.ants = ()
+    self.steps = 0
+    self.over = False
+    self.nest_food_quantity = 0
+    self.food_quantity = 0
+
+  def index(self, coords):
+    """Gets the location of the cell in (x, y) coordinates."""
+    x, y = coords
+    width, height = self.size
+    return x % width * height + y % height
+
+  def coords(self, location):
+    """Gets the (x, y) coordinates of the cell in location."""
+    return divmod(location, self.size[1])
+
+  def apply(self, snapshot):
+    """Updates the view with the snapshot. Returns the set of the locations
+    whose drawing changed (None if everything has to be drawn again)."""
+    changed = set(l for l, _ in self.ants)
+    if snapshot.full:
+      self.cells.clear()
+      changed = None
+    for location, colony_ph, food_ph, food in snapshot.cells:
+      if colony_ph > 0 or food_ph > 0 or food > 0:
+        self.cells[location] = colony_ph, food_ph, food
+      else:
+        self.cells.pop(location, None)
+      if changed is not None:
+        changed.add(location)
+    self.ants = snapshot.ants
+    if changed is not None:
+      changed.update(l for l, _ in self.ants)
+    self.steps = snapshot.steps
+    self.over = snapshot.over
+    self.nest_food_quantity = snapshot.nest_food
+    self.food_quantity = snapshot.world_food
+    return changed
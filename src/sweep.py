@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+"""Ants simulator parameter sweep module."""
+
+
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.connection
+import config
+import sim
+
+
+# statistics of a run written in the results table
+COLUMNS = ('steps', 'over', 'ants', 'peak_ants', 'nest_food', 'world_food',
+           'food_collected', 'food_collected_per_step', 'steps_per_sec')
+
+
+def validate(space):
+  """Raises a KeyError if the space contains unknown configuration keys."""
+  _, defaults = config.default()
+  unknown = sorted(k for k in space if k not in defaults)
+  if unknown:
+    raise KeyError('Unknown configuration keys: {}'.format(', '.join(unknown)))
+
+
+def grid(space):
+  """Generates every combination of the values in the space.
+  The space maps a configuration key to the list of its values."""
+  keys = sorted(space)
+  ranges = [k for k in keys if isinstance(space[k], dict)]
+  if ranges:
+    raise ValueError('Ranges can only be sampled: {}'.format(', '.join(ranges)))
+  for values in itertools.product(*(space[k] for k in keys)):
+    yield dict(zip(keys, values))
+
+
+def sample(space, count, rnd=random):
+  """Generates count random points of the space.
+  The space maps a configuration key to the list of its values, or to a
+  dictionary with the 'min' and 'max' bounds of a range (integer if both bounds
+  are integers, otherwise real)."""
+  keys = sorted(space)
+  i = 0
+  while i < count:
+    point = dict()
+    for k in keys:
+      values = space[k]
+      if isinstance(values, dict):
+        lo, hi = values['min'], values['max']
+        if isinstance(lo, int) and isinstance(hi, int):
+          point[k] = rnd.randint(lo, hi)
+        else:
+          point[k] = rnd.uniform(lo, hi)
+      else:
+        point[k] = rnd.choice(values)
+    yield point
+    i += 1
+
+
+def runs(points, repeats, seed):
+  """Generates the (run, seed, overrides) tuple of every run.
+  Each point is repeated with different seeds; the seed of a run only depends
+  on its index, so that a run can be reproduced on its own."""
+  run = 0
+  for point in points:
+    r = 0
+    while r < repeats:
+      yield run, seed + run, point
+      run += 1
+      r += 1
+
+
+def simulate(task):
+  """Runs a single simulation (in a worker process) and returns its row.
+  Any error is reported in the row instead of being raised."""
+  run, seed, overrides, configuration, steps = task
+  configuration = dict(configuration)
+  configuration.update(overrides)
+  try:
+    report = sim.Simulation(configuration, seed).run(steps)
+    return run, seed, overrides, report, None
+  except Exception as e:
+    return run, seed, overrides, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def work(conn, task):
+  """Sends the row of the simulation of the task (in its own process)."""
+  try:
+    conn.send(simulate(task))
+  finally:
+    conn.close()
+
+
+def sweep(configuration, tasks, steps, out, processes=None, timeout=None):
+  """Runs the simulations of the tasks, each one in its own process (at most
+  processes at once), writing a row of the out CSV file as soon as each
+  simulation is over.
+  A run whose process exits without a result (e.g. it crashed) is written
+  as lost, and one still running after timeout seconds is stopped and
+  written as timeout; the other runs go on. Returns the number of failed
+  runs."""
+  tasks = list(tasks)
+  keys = sorted(set(k for _, _, p in tasks for k in p))
+  writer = csv.writer(out, lineterminator='\n')
+  writer.writerow(('run', 'seed') + tuple(keys) + COLUMNS + ('error',))
+  def write(run, seed, overrides, report, error):
+    if report:
+      stats = tuple(report[c] for c in COLUMNS)
+    else:
+      stats = ('',) * len(COLUMNS)
+    point = tuple(json.dumps(overrides.get(k)) for k in keys)
+    writer.writerow((run, seed) + point + stats + (error or '',))
+    out.flush()
+  waiting = collections.deque(tasks)
+  processes = processes or multiprocessing.cpu_count()
+  # the process, the end of its pipe and the start time of each run
+  running = dict()
+  failed = 0
+  try:
+    while waiting or running:
+      while waiting and len(running) < processes:
+        run, seed, overrides = task = waiting.popleft()
+        reader, conn = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(
+          target=work, args=(conn, (run, seed, overrides, configuration, steps)))
+        process.daemon = True
+        process.start()
+        conn.close()
+        running[run] = task, process, reader, time.time()
+      wait = None
+      if timeout is not None:
+        first = min(started for _, _, _, started in running.values())
+        wait = max(0, first + timeout - time.time())
+      ready = set(multiprocessing.connection.wait(
+        [w for _, p, r, _ in running.values() for w in (r, p.sentinel)],
+        wait))
+      now = time.time()
+      for run in sorted(running):
+        (_, seed, overrides), process, reader, started = running[run]
+        result = None
+        if reader in ready or process.sentinel in ready:
+          try:
+            result = reader.recv()
+          except EOFError:
+            # the process exited without a result
+            result = run, seed, overrides, None, 'lost'
+        elif timeout is not None and now - started >= timeout:
+          process.terminate()
+          result = run, seed, overrides, None, 'timeout'
+        if result is None:
+          continue
+        del running[run]
+        reader.close()
+        process.join()
+        if not result[3]:
+          failed += 1
+        write(*result)
+  finally:
+    for _, process, reader, _ in running.values():
+      process.terminate()
+      process.join()
+      reader.close()
+  return failed
+
+
+def main(argv=None):
+  """Runs a parameter sweep from the command line."""
+  parser = argparse.ArgumentParser(description='Ants simulator sweep.')
+  parser.add_argument('space', help='JSON file with the values of each key')
+  parser.add_argument('-c', '--config', help='base program configuration file')
+  parser.add_argument('-n', '--steps', type=int, default=10000,
+                      help='maximum number of steps (default: %(default)s)')
+  parser.add_argument('-r', '--repeats', type=int, default=1,
+                      help='runs (seeds) per point (default: %(default)s)')
+  parser.add_argument('--samples', type=int,
+                      help='number of random points (default: full grid)')
+  parser.add_argument('-s', '--seed', type=int, default=0,
+                      help='base random seed (default: %(default)s)')
+  parser.add_argument('-p', '--processes', type=int,
+                      help='number of worker processes (default: CPU count)')
+  parser.add_argument('-t', '--timeout', type=float,
+                      help='seconds after which a run is stopped')
+  parser.add_argument('-o', '--output', help='CSV results file (default: stdout)')
+  args = parser.parse_args(argv)
+  if args.config:
+    configuration = config.deserialize(args.config)
+  else:
+    _, configuration = config.default()
+  with open(args.space, 'r') as f:
+    space = json.load(f)
+  validate(space)
+  if args.samples:
+    points = sample(space, args.samples, random.Random(args.seed))
+  else:
+    points = grid(space)
+  tasks = runs(points, args.repeats, args.seed)
+  if args.output:
+    with open(args.output, 'w') as out:
+      failed = sweep(configuration, tasks, args.steps, out, args.processes,
+                     args.timeout)
+  else:
+    failed = sweep(configuration, tasks, args.steps, sys.stdout,
+                   args.processes, args.timeout)
+  return 1 if failed else 0
+
+
+
+if __name__ == '__main__':
+  sys.exit(main())
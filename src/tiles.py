@@ -0,0 +1,373 @@
+#! /usr/bin/env python
+"""Ants simulator tiled module.
+A TiledSimulation splits the world in a grid of rectangular tiles, each one
+stepped by its own worker process. The cells are stored in shared memory;
+each worker keeps its tile in a local ArrayWorld with a halo (a ring of one
+cell) around it, and its ants in a local Population. Every step a worker:
+1. appends the ants handed off by the other tiles, kills the ant chosen at the
+   end of the previous step and (only the worker of the nest) gives birth;
+2. copies its halo from the shared cells, then waits for every other worker;
+3. steps its ants and evaporates the pheromone, reading the neighbor tiles
+   only through the halo (the ants act only on the cell they're in);
+4. writes back to the shared cells the border of its tile (the cells in the
+   halo of the other tiles), and hands off to the coordinator the ants moved
+   into the halo.
+
+Determinism: a tiled run only depends on the configuration, on the seed and
+on the grid of tiles. It's the same for any scheduling of the processes, since
+a worker only writes its own cells and reads the others through the halo,
+copied while nobody writes. The ants are handed off in the order of the
+tiles, and the dying ant is the elder with the lowest death score (a random
+number of its key). A tiled run differs from an untiled one: the halo shows the
+neighbor tiles as they were at the start of the step (e.g. the food taken
+there in the same step is still visible)."""
+
+
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import behavior
+import entity
+import population
+import rng
+import sim
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# salt of the keys of the ants for the death scores
+DEATH_SALT = 0xD1B54A32D192ED03
+
+
+
+def bounds(length, parts):
+  """Splits the range [0, length) in parts as equal as possible. Returns the
+  parts + 1 bounds."""
+  return [length * i // parts for i in range(parts + 1)]
+
+
+def axis(coords, start, end, length):
+  """Gets the local coordinates along an axis of the world coordinates of a
+  tile spanning [start, end) of length (-1 outside the tile and its halo).
+  The interior comes first: the halo of a tile spanning the whole axis holds
+  its own cells across the wrap of the torus."""
+  d = (coords - start) % length
+  inner = end - start
+  halo = numpy.where(d == length - 1, 0, numpy.where(d == inner, inner + 1, -1))
+  return numpy.where(d < inner, d + 1, halo)
+
+
+def create_shared(size, seed):
+  """Creates the shared memory blocks of the cells of a world of the given
+  size. Returns the blocks (by array name) and the ArrayWorld using them."""
+  cells = size[0] * size[1]
+  blocks = dict()
+  world = SharedWorld(size, seed)
+  for name in entity.ARRAY_FIELDS:
+    dtype = getattr(world, name).dtype
+    block = shared_memory.SharedMemory(create=True,
+                                       size=max(1, cells * dtype.itemsize))
+    array = numpy.ndarray(cells, dtype=dtype, buffer=block.buf)
+    array[:] = 0
+    setattr(world, name, array)
+    blocks[name] = block
+  return blocks, world
+
+
+
+class SharedWorld(entity.ArrayWorld):
+  """ArrayWorld whose cells are in shared memory, used only to place the food:
+  it doesn't build the neighbors tables."""
+
+  def __init__(self, size, seed):
+    """Creates and initializes an empty SharedWorld instance."""
+    entity.ArrayWorld.__init__(self, size, (0, 0), 0, seed)
+
+  def build_tables(self):
+    """Does nothing: the ants never move in a SharedWorld."""
+    pass
+
+
+
+class Tile(object):
+  """Geometry of a tile: its rectangle [x0, x1) x [y0, y1) of the world, and
+  the map of its local grid (the tile with its halo) to the world."""
+
+  def __init__(self, size, x0, x1, y0, y1):
+    """Creates and initializes the Tile instance."""
+    self.size = tuple(size)
+    self.x0, self.x1, self.y0, self.y1 = x0, x1, y0, y1
+    width, height = size
+    self.local_size = x1 - x0 + 2, y1 - y0 + 2
+    lw, lh = self.local_size
+    gx = (numpy.arange(lw) + x0 - 1) % width
+    gy = (numpy.arange(lh) + y0 - 1) % height
+    # location in the world of each local location
+    self.world_locations = (gx[:, None] * height + gy[None, :]).ravel()
+    inside = numpy.zeros((lw, lh), dtype=bool)
+    inside[1:-1, 1:-1] = True
+    self.inside = inside.ravel()
+    self.interior = numpy.flatnonzero(self.inside)
+    self.halo = numpy.flatnonzero(~self.inside)
+    # the cells of the tile in the halo of its neighbors
+    border = inside.copy()
+    border[2:-2, 2:-2] = False
+    self.border = numpy.flatnonzero(border.ravel())
+
+  def local(self, locations):
+    """Gets the local locations of the given world locations (-1 if they're
+    outside the tile and its halo)."""
+    width, height = self.size
+    lw, lh = self.local_size
+    gx, gy = numpy.divmod(locations, height)
+    lx = axis(gx, self.x0, self.x1, width)
+    ly = axis(gy, self.y0, self.y1, height)
+    valid = (locations >= 0) & (lx >= 0) & (ly >= 0)
+    return numpy.where(valid, lx * lh + ly, -1)
+
+
+
+def kill(world, ants, key):
+  """Kills the ant with the given key, if it's in the tile. Returns True if
+  it was found."""
+  found = numpy.flatnonzero(ants.key[:len(ants)] == numpy.uint64(key))
+  if not len(found):
+    return False
+  dying = population.AntView(ants, int(found[0]))
+  if dying.location == world.nest:
+    world.nest_food_quantity += dying.food_quantity
+    world.food_quantity -= dying.food_quantity
+  else:
+    world[dying.location].food_quantity += dying.food_quantity
+  ants.remove(dying)
+  return True
+
+
+def emigrate(tile, ants):
+  """Removes the ants moved into the halo of the tile. Returns their state,
+  with the locations of the world (see Population.take)."""
+  leaving = numpy.flatnonzero(~tile.inside[ants.location[:len(ants)]])
+  emigrants = ants.take(leaving)
+  emigrants['location'] = tile.world_locations[emigrants['location']]
+  path = emigrants['path']
+  emigrants['path'] = numpy.where(path >= 0, tile.world_locations[path], -1)
+  return emigrants
+
+
+def immigrate(tile, ants, state):
+  """Appends to the ants of the tile the ones handed off by emigrate."""
+  state['path'] = tile.local(state['path'])
+  state['location'] = tile.local(state['location'])
+  ants.extend(state)
+
+
+def work(conn, barrier, names, tile, nest, food_quantity, configuration,
+         seed):
+  """Steps the tile (in a worker process) following the commands of the
+  coordinator received from conn (see the module)."""
+  blocks = dict((n, shared_memory.SharedMemory(name=b))
+                for n, b in names.items())
+  c = configuration
+  cells = tile.size[0] * tile.size[1]
+  world = entity.ArrayWorld(tile.local_size, (0, 0), 0, seed)
+  shared = dict()
+  for name in entity.ARRAY_FIELDS:
+    dtype = getattr(world, name).dtype
+    shared[name] = numpy.ndarray(cells, dtype=dtype, buffer=blocks[name].buf)
+    getattr(world, name)[:] = shared[name][tile.world_locations]
+  local_nest = int(tile.local(numpy.array([nest]))[0])
+  owner = local_nest >= 0 and tile.inside[local_nest]
+  world.nest = local_nest
+  if owner:
+    world.nest_food_quantity = c['initial_food_quantity']
+    world.food_quantity = food_quantity
+  ants = population.Population(world)
+  world.ants = ants
+  kernel = behavior.kernel(c)
+  native = c.get('compiled_behavior', True)
+  try:
+    while True:
+      command = conn.recv()
+      if command is None:
+        # the whole tile, for the final state of the world
+        for name in entity.ARRAY_FIELDS:
+          shared[name][tile.world_locations[tile.interior]] = getattr(
+            world, name)[tile.interior]
+        break
+      # processor time of the step, not counting the wait of the barrier
+      start = time.process_time()
+      immigrants, killed, birth, deaths = command
+      for state in immigrants:
+        immigrate(tile, ants, state)
+      if killed is not None:
+        kill(world, ants, killed)
+      if birth and owner:
+        sim.birth(world, c['food_quantity_per_ant'])
+      for name in entity.ARRAY_FIELDS:
+        getattr(world, name)[tile.halo] = shared[name][
+          tile.world_locations[tile.halo]]
+      barrier.wait()
+      kernel.apply(ants, c['go_straight_probability'], native)
+      sim.evaporate_arrays(world, c['colony_pheromone_decreasing_factor'],
+                           c['food_pheromone_decreasing_factor'], native)
+      for name in entity.ARRAY_FIELDS:
+        shared[name][tile.world_locations[tile.border]] = getattr(
+          world, name)[tile.border]
+      # the candidate to die: the elder with the lowest score
+      candidate = None
+      n = len(ants)
+      if deaths is not None and n:
+        elders = numpy.flatnonzero(ants.age[:n] > c['life_expectancy_steps'])
+        if len(elders):
+          keys = ants.key[elders]
+          scores = rng.uniforms(keys ^ numpy.uint64(DEATH_SALT),
+                                numpy.full(len(keys), deaths))
+          best = scores.argmin()
+          candidate = float(scores[best]), int(keys[best])
+      emigrants = emigrate(tile, ants)
+      conn.send((emigrants, candidate, len(ants), world.nest_food_quantity,
+                 world.food_quantity, owner, time.process_time() - start))
+  finally:
+    conn.close()
+    for block in blocks.values():
+      block.close()
+
+
+
+class TiledSimulation(sim.Simulation):
+  """Runs a simulation split in tiles[0] x tiles[1] worker processes (see the
+  module). The cells and the ants are always stored in NumPy arrays."""
+
+  def __init__(self, configuration, tiles, seed=None):
+    """Creates the world, places its food and starts the workers."""
+    if numpy is None:
+      raise ImportError('TiledSimulation requires NumPy')
+    if configuration.get('colonies'):
+      raise ValueError('Tiles support a single colony')
+    self.configuration = c = configuration
+    size = tuple(c['world_size'])
+    width, height = size
+    if seed is None:
+      seed = rng.Streams().seed
+    self.blocks, world = create_shared(size, seed)
+    world.nest = world.index(tuple(c['nest_location']))
+    world.nest_food_quantity = c['initial_food_quantity']
+    sim.place_food(world, c['food_places_number'], c['food_quantity'])
+    self.world = world
+    self.steps = 0
+    self.peak_ants = 0
+    self.ants = 0
+    self.initial_food_quantity = world.food_quantity
+    self.elapsed = 0.0
+    self.recorder = None
+    self.colonies = False
+    step_delay = c['step_delay_ms']
+    self.birth_every = sim.cadence(c['birth_delay_ms'], step_delay)
+    self.death_every = sim.cadence(c['death_delay_ms'], step_delay)
+    self.deaths = 0
+    self.killed = None
+    # the ants to hand off to each tile at the next step
+    xs, ys = bounds(width, tiles[0]), bounds(height, tiles[1])
+    self.x_bounds, self.y_bounds = numpy.array(xs), numpy.array(ys)
+    self.tiles = [Tile(size, xs[i], xs[i + 1], ys[j], ys[j + 1])
+                  for i in range(tiles[0]) for j in range(tiles[1])]
+    if any(t.x1 <= t.x0 or t.y1 <= t.y0 for t in self.tiles):
+      raise ValueError('Too many tiles for the world size')
+    self.pending = [[] for _ in self.tiles]
+    # processor seconds of each worker, and the sum of the slowest worker of
+    # each step: with a core for each tile, the steps take at least critical
+    self.busy = [0.0] * len(self.tiles)
+    self.critical = 0.0
+    barrier = multiprocessing.Barrier(len(self.tiles))
+    names = dict((n, b.name) for n, b in self.blocks.items())
+    self.connections = []
+    self.workers = []
+    for t in self.tiles:
+      parent, child = multiprocessing.Pipe()
+      w = multiprocessing.Process(target=work, args=(
+        child, barrier, names, t, world.nest, world.food_quantity, c, seed))
+      w.daemon = True
+      w.start()
+      child.close()
+      self.connections.append(parent)
+      self.workers.append(w)
+
+  def owner(self, locations):
+    """Gets the index of the tile of each world location."""
+    height = self.world.size[1]
+    gx, gy = numpy.divmod(locations, height)
+    i = numpy.searchsorted(self.x_bounds, gx, side='right') - 1
+    j = numpy.searchsorted(self.y_bounds, gy, side='right') - 1
+    return i * (len(self.y_bounds) - 1) + j
+
+  def route(self, emigrants):
+    """Hands off the ants (the state arrays of Population.take, with the
+    locations of the world) to their tiles at the next step."""
+    if not len(emigrants['location']):
+      return
+    owners = self.owner(emigrants['location'])
+    for t in numpy.unique(owners):
+      moving = owners == t
+      self.pending[t].append(dict((n, a[moving])
+                                  for n, a in emigrants.items()))
+    self.ants += len(owners)
+
+  def over(self):
+    """Returns True if there are no more ants or no more food to collect."""
+    return self.ants == 0 or self.world.food_quantity == 0
+
+  def advance(self):
+    """Moves the simulation forward by one step in every tile."""
+    c = self.configuration
+    birth = (self.steps % self.birth_every == 0 and
+             (not c['max_ants_number'] or self.ants < c['max_ants_number']))
+    death = self.steps % self.death_every == 0
+    for conn, immigrants in zip(self.connections, self.pending):
+      conn.send((immigrants, self.killed, birth,
+                 self.deaths if death else None))
+    replies = [conn.recv() for conn in self.connections]
+    self.pending = [[] for _ in self.tiles]
+    self.critical += max(reply[-1] for reply in replies)
+    self.ants = 0
+    candidates = []
+    for i, reply in enumerate(replies):
+      emigrants, candidate, ants, nest_food, food, owner, busy = reply
+      self.busy[i] += busy
+      self.ants += ants
+      if owner:
+        self.world.nest_food_quantity = nest_food
+        self.world.food_quantity = food
+      if candidate:
+        candidates.append(candidate)
+      # hand off, in the order of the tiles
+      self.route(emigrants)
+    self.killed = None
+    if candidates:
+      self.killed = min(candidates)[1]
+      self.deaths += 1
+      self.ants -= 1
+    self.peak_ants = max(self.peak_ants, self.ants)
+    self.steps += 1
+
+  def report(self):
+    """Returns a dictionary with the current statistics of the simulation."""
+    report = sim.Simulation.report(self)
+    report['ants'] = self.ants
+    return report
+
+  def close(self):
+    """Stops the workers and releases the shared memory. The world keeps a
+    copy of its final cells."""
+    for conn in self.connections:
+      conn.send(None)
+      conn.close()
+    for w in self.workers:
+      w.join()
+    for name in entity.ARRAY_FIELDS:
+      setattr(self.world, name, getattr(self.world, name).copy())
+    for block in self.blocks.values():
+      block.close()
+      block.unlink()
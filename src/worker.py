@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+"""Ants simulator background worker module."""
+
+
+import time
+import threading
+import snapshot
+
+
+
+class SimulationThread(threading.Thread):
+  """Advances a simulation in a background thread, independently of who draws
+  it: the world is only read through the snapshots taken by snapshot().
+  Unless at max speed, the thread waits step_delay_ms between two steps."""
+
+  def __init__(self, simulation, step_delay_ms):
+    """Creates and initializes the (paused) SimulationThread instance."""
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.simulation = simulation
+    self.delay = step_delay_ms / 1000.0
+    self.max_speed = False
+    self.lock = threading.Lock()
+    self.running = threading.Event()
+    self.stopped = False
+    self.finished = False
+
+  def run(self):
+    """Advances the simulation until it's over or the thread is stopped."""
+    while not self.stopped:
+      if not self.running.wait(0.1):
+        continue
+      with self.lock:
+        self.simulation.advance()
+        self.finished = self.simulation.over()
+      if self.finished:
+        self.running.clear()
+        break
+      if not self.max_speed:
+        time.sleep(self.delay)
+
+  def snapshot(self, full=False):
+    """Takes the snapshot of the world changes since the previous one."""
+    with self.lock:
+      s = self.simulation
+      return snapshot.capture(s.world, s.steps, self.finished, full)
+
+  def pause(self):
+    """Pauses the simulation (after the current step)."""
+    self.running.clear()
+
+  def resume(self):
+    """Resumes the simulation."""
+    self.running.set()
+
+  def stop(self):
+    """Stops the thread (after the current step)."""
+    self.stopped = True
+    self.running.set()
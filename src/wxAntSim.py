@@ -1,13 +1,17 @@
 #! /usr/bin/env python
 
-import sys
 import os
+import argparse
 import wx
 
 import config
 import sim
-import entity
-import motion
+import snapshot
+import worker
+import replay
+import client
+import framebuffer
+import instrument
 
 
 
@@ -17,191 +21,396 @@ configuration = None
 
 
 
+class Style(object):
+  """Drawing settings of a configuration, read once (with their brushes) so
+  that the redraws don't look them up again."""
+
+  def __init__(self, configuration):
+    """Creates and initializes the Style of the configuration (the wx.App
+    must already exist)."""
+    self.zoom = configuration['zoom']
+    self.ph_factor = configuration['pheromone_scale_decreasing_factor']
+    self.ant_size = configuration['ant_size']
+    self.nest_size = configuration['nest_size']
+    self.draw_colony_pheromone = configuration['draw_colony_pheromone_lifespan']
+    self.draw_food_pheromone = configuration['draw_food_pheromone_lifespan']
+    self.pen = wx.Pen('Black', 1, wx.SOLID)
+    self.background = wx.Brush(configuration['background_color'], wx.SOLID)
+    self.colony_pheromone = wx.Brush(configuration['colony_pheromone_color'],
+                                     wx.SOLID)
+    self.food_pheromone = wx.Brush(configuration['food_pheromone_color'],
+                                   wx.SOLID)
+    self.food = wx.Brush(configuration['food_color'], wx.SOLID)
+    colonies = sim.colony_settings(configuration)
+    self.nests = [wx.Brush(c['nest_color'], wx.SOLID) for c in colonies]
+    # brushes of the ants (searching and foraging) of each colony
+    self.ants = [(wx.Brush(c['ant_color'], wx.SOLID),
+                  wx.Brush(c['ant_foraging_color'], wx.SOLID))
+                 for c in colonies]
+    # RGB colors of the framebuffer (the ants ones by flag, see snapshot)
+    def rgb(name):
+      return tuple(wx.Colour(name).Get(False))
+    self.colors = {
+      'background': rgb(configuration['background_color']),
+      'colony_pheromone': rgb(configuration['colony_pheromone_color']),
+      'food_pheromone': rgb(configuration['food_pheromone_color']),
+      'food': rgb(configuration['food_color']),
+      'nests': [rgb(c['nest_color']) for c in colonies],
+      'ants': [rgb(c[k]) for c in colonies
+               for k in ('ant_color', 'ant_foraging_color')],
+    }
+
+
+
 class AntSimWindow(wx.Window):
   """Canvas where to draw entities."""
 
-  def __init__(self, parent, update_info):
-    """Initializes the window."""
+  def __init__(self, parent, update_info, player=None):
+    """Initializes the window: it draws a new simulation, or the recording
+    played by the given replay.Player (or the stream of a server viewed by
+    a client.Client)."""
     wx.Window.__init__(self, parent, -1)
     # init properties
     self.SetBackgroundColour(configuration['background_color'])
+    self.style = Style(configuration)
     self.update = update_info
-    self.steps = 0
     # Window event binding
+    self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
     self.Bind(wx.EVT_PAINT, self.OnPaint)
-    # init entities
-    size = configuration['world_size']
-    nest_loc = tuple(configuration['nest_location'])
-    food_qty = configuration['initial_food_quantity']
-    self.world = entity.World(size, nest_loc, food_qty)
-    food_cardinality = configuration['food_places_number']
-    food_qty = configuration['food_quantity']
-    sim.place_food(self.world, food_cardinality, food_qty)
+    self.Bind(wx.EVT_SIZE, self.OnSize)
+    self.Bind(wx.EVT_TIMER, self.OnTimer)
+    # init entities: the simulation runs in its own thread (or the recording
+    # is played), while the window draws the view of the world rebuilt from
+    # its snapshots
+    self.replay = player is not None
+    if self.replay:
+      self.worker = player
+      size, nest, nests = player.size, player.nest, player.nests
+    else:
+      self.simulation = sim.Simulation(configuration)
+      self.world = self.simulation.world
+      self.world.dirty = set()
+      self.worker = worker.SimulationThread(self.simulation,
+                                            configuration['step_delay_ms'])
+      size, nest = self.world.size, self.world.nest
+      nests = self.world.nests
+    self.view = snapshot.WorldView(size, nest, nests)
+    self.view.apply(self.worker.snapshot(full=True))
+    # the world is drawn with a shape for each entity, or composed in an
+    # image at each frame (see framebuffer)
+    self.framebuffer = None
+    if configuration.get('renderer') == 'framebuffer':
+      style = self.style
+      self.framebuffer = framebuffer.Framebuffer(
+          size, nests, style.colors, style.zoom, style.ph_factor,
+          style.nest_size, style.draw_colony_pheromone,
+          style.draw_food_pheromone)
+    self.worker.max_speed = configuration.get('max_speed', False)
+    if not self.replay:
+      self.worker.start()
+    # retained drawing of the world, updated only where the cells change
+    self.buffer = None
+    # largest distance (pixels) from its cell center drawn by an entity
+    self.extent = max(self.style.ant_size, self.style.nest_size)
+    # redraw at a fixed frame rate, whatever the speed of the simulation
+    self.timer = wx.Timer(self)
+    self.timer.Start(1000 // configuration.get('frames_per_second', 25))
 
 
   def OnPaint(self, evt):
     """OnPaint event handler."""
-    self.DrawEntities(wx.PaintDC(self))
-
-  def DrawEntities(self, dc):
-    """set up the device context (DC) for painting"""
-    dc.SetPen(wx.Pen('Black', 1, wx.SOLID))
-    zoom = configuration['zoom']
-    ph_factor = configuration['pheromone_scale_decreasing_factor']
-    dcpl = configuration['draw_colony_pheromone_lifespan']
-    dfpl = configuration['draw_food_pheromone_lifespan']
-    cpc = wx.Brush(configuration['colony_pheromone_color'], wx.SOLID)
-    fpc = wx.Brush(configuration['food_pheromone_color'], wx.SOLID)
-    fc = wx.Brush(configuration['food_color'], wx.SOLID)
-    afc =  wx.Brush(configuration['ant_foraging_color'], wx.SOLID)
-    ac =  wx.Brush(configuration['ant_color'], wx.SOLID)
+    if self.buffer is None:
+      self.InitBuffer()
+    wx.BufferedPaintDC(self, self.buffer)
+
+  def OnSize(self, evt):
+    """OnSize event handler."""
+    self.buffer = None
+    self.Refresh(False)
+
+  def InitBuffer(self):
+    """Creates the back buffer and draws the whole world in it."""
+    if self.framebuffer is not None:
+      self.framebuffer.update(self.view)
+      self.Blit()
+      return
+    width, height = self.GetClientSize()
+    self.buffer = wx.Bitmap(max(width, 1), max(height, 1))
+    dc = wx.MemoryDC(self.buffer)
+    dc.SetBackground(self.style.background)
+    dc.Clear()
+    self.DrawEntities(dc)
+    dc.SelectObject(wx.NullBitmap)
+
+  def UpdateBuffer(self, dirty):
+    """Redraws in the back buffer only the area of the dirty cells, and
+    invalidates that area of the window."""
+    if self.buffer is None or not dirty:
+      return
+    if self.framebuffer is not None:
+      # the whole image is composed again
+      self.framebuffer.update(self.view, dirty)
+      self.Blit()
+      self.Refresh(False)
+      return
+    zoom = self.style.zoom
+    ph_factor = self.style.ph_factor
+    # the extent of the changed cells could have grown
+    for loc in dirty:
+      colony_ph, food_ph, qty = self.view.cells.get(loc, (0, 0, 0))
+      self.extent = max(self.extent, qty // 2 + 1, colony_ph // ph_factor,
+                        food_ph // ph_factor)
+    # the area of a changed cell can be covered by the entities of the cells
+    # within twice the extent (plus the width of the pen)
+    extent = int(self.extent) + 1
+    reach = -(-2 * extent // zoom)
+    rects = []
+    around = set()
+    for loc in dirty:
+      x, y = self.view.coords(loc)
+      rects.append(wx.Rect(x * zoom - extent, y * zoom - extent,
+                           2 * extent + 1, 2 * extent + 1))
+      around.update(self.view.index((x + dx, y + dy))
+                    for dx in range(-reach, reach + 1)
+                    for dy in range(-reach, reach + 1))
+    region = wx.Region()
+    for r in rects:
+      region.Union(r)
+    dc = wx.MemoryDC(self.buffer)
+    dc.SetDeviceClippingRegion(region)
+    # erase the changed area and draw again what's around it
+    dc.SetPen(wx.TRANSPARENT_PEN)
+    dc.SetBrush(self.style.background)
+    for r in rects:
+      dc.DrawRectangle(r)
+    self.DrawEntities(dc, around)
+    dc.DestroyClippingRegion()
+    dc.SelectObject(wx.NullBitmap)
+    for r in rects:
+      self.RefreshRect(r, False)
+
+  def Blit(self):
+    """Composes the image of the view (see framebuffer) and uploads it in
+    the back buffer."""
+    width, height = self.GetClientSize()
+    width, height = max(width, 1), max(height, 1)
+    image = self.framebuffer.render(self.view, width, height)
+    self.buffer = wx.Bitmap.FromBuffer(width, height, image)
+
+  def DrawEntities(self, dc, locations=None):
+    """Draws the entities of the cells in the locations set (all if None)."""
+    view = self.view
+    if locations is None:
+      width, height = view.size
+      locations = range(width * height)
+      ordered = sorted(view.cells)
+    else:
+      ordered = sorted(l for l in locations if l in view.cells)
+    style = self.style
+    dc.SetPen(style.pen)
+    zoom = style.zoom
+    ph_factor = style.ph_factor
+    dcpl = style.draw_colony_pheromone
+    dfpl = style.draw_food_pheromone
+    cpc = style.colony_pheromone
+    fpc = style.food_pheromone
+    fc = style.food
+    ac = style.ants
     # draw pheromone
-    width, height = self.world.size
-    x = 0
-    while x < width:
-      y = 0
-      while y < height:
-        # draw colony pheromone lifespan
-        colony_ph = entity.colony_lifespan(self.world.cells[x][y])
-        if dcpl and colony_ph > 0:
-          dc.SetBrush(cpc)
-          dc.DrawCircle(x * zoom, y * zoom, colony_ph // ph_factor)
-        # draw food pheromone lifespan
-        food_ph = entity.food_lifespan(self.world.cells[x][y])
-        if dfpl and food_ph > 0:
-          dc.SetBrush(fpc)
-          dc.DrawCircle(x * zoom, y * zoom, food_ph // ph_factor)
-        y += 1
-      x += 1
+    for loc in ordered:
+      colony_ph, food_ph, _ = view.cells[loc]
+      x, y = view.coords(loc)
+      # draw colony pheromone lifespan
+      if dcpl and colony_ph > 0:
+        dc.SetBrush(cpc)
+        dc.DrawCircle(x * zoom, y * zoom, colony_ph // ph_factor)
+      # draw food pheromone lifespan
+      if dfpl and food_ph > 0:
+        dc.SetBrush(fpc)
+        dc.DrawCircle(x * zoom, y * zoom, food_ph // ph_factor)
     # draw food
-    x = 0
-    while x < width:
-      y = 0
-      while y < height:
-        if self.world.cells[x][y].food_quantity > 0:
-          dc.SetBrush(fc)
-          qty = self.world.cells[x][y].food_quantity
-          shift = qty // 2
-          dc.DrawRectangle(x * zoom - shift, y * zoom - shift, qty, qty)
-        y += 1
-      x += 1
-    # draw nest
-    x, y = self.world.nest
-    dc.SetBrush(wx.Brush(configuration['nest_color'], wx.SOLID))
-    dc.DrawCircle(x * zoom, y * zoom, configuration['nest_size'])
-    # draw ants
-    for a in self.world.ants:
-      x, y = a.location
-      if a.foraging():
-        dc.SetBrush(afc)
+    dc.SetBrush(fc)
+    for loc in ordered:
+      qty = view.cells[loc][2]
+      if qty > 0:
+        x, y = view.coords(loc)
+        shift = qty // 2
+        dc.DrawRectangle(x * zoom - shift, y * zoom - shift, qty, qty)
+    # draw nests
+    for nest, brush in zip(view.nests, style.nests):
+      if nest in locations:
+        x, y = view.coords(nest)
+        dc.SetBrush(brush)
+        dc.DrawCircle(x * zoom, y * zoom, style.nest_size)
+    # draw ants (the colony is packed with the foraging flag, see snapshot)
+    for loc, foraging in view.ants:
+      if loc not in locations:
+        continue
+      x, y = view.coords(loc)
+      colony, foraging = divmod(int(foraging), 2)
+      dc.SetBrush(ac[colony][foraging])
+      dc.DrawCircle(x * zoom, y * zoom, style.ant_size)
+
+  def OnTimer(self, evt):
+    """Draws the changes of the world since the previous frame."""
+    with instrument.phase('draw'):
+      dirty = self.view.apply(self.worker.snapshot())
+      if dirty is None:
+        self.buffer = None
+        self.Refresh(False)
       else:
-        dc.SetBrush(ac)
-      dc.DrawCircle(x * zoom, y * zoom, configuration['ant_size'])
-
-  def StartSimulation(self):
-    """Resume the simulation."""
-    self.Birth()
-    self.Run()
-    self.Death()
-
-  def Run(self):
-    """Move ants to the next generation if the simulation isn't over."""
-    gsp = configuration['go_straight_probability']
-    fphdf = configuration['food_pheromone_decreasing_factor']
-    cphdf = configuration['colony_pheromone_decreasing_factor']
-    sim.step(self.world, gsp, cphdf, fphdf)
+        self.UpdateBuffer(dirty)
     # update the status bar
-    nest_food = self.world.nest_food_quantity
-    world_food = self.world.food_quantity
-    self.update(self.steps, len(self.world.ants), nest_food, world_food)
-    # check if the simulation is over
-    if len(self.world.ants) == 0 or self.world.food_quantity == 0:
-      info = 'Steps {}'.format(self.steps)
+    view = self.view
+    self.update(view.steps, len(view.ants), view.nest_food_quantity,
+                view.food_quantity)
+    # check if the simulation is over (a replay can still be seeked)
+    if view.over and not self.replay:
+      self.timer.Stop()
+      info = 'Steps {}'.format(view.steps)
       wx.MessageBox(info, 'Simulation Over!', wx.OK | wx.ICON_ASTERISK)
       self.GetParent().Destroy()
-    else:
-      self.steps += 1
-      self.Refresh()
-      if not self.GetParent().paused:
-        wx.CallLater(configuration['step_delay_ms'], self.Run)
 
-  def Birth(self):
-    """Check if a new ant can born."""
-    food_per_ant = configuration['food_quantity_per_ant']
-    max_ants = configuration['max_ants_number']
-    sim.birth(self.world, food_per_ant, max_ants)
-    if not self.GetParent().paused:
-      wx.CallLater(configuration['birth_delay_ms'], self.Birth)
+  def StartSimulation(self):
+    """Resume the simulation."""
+    self.worker.resume()
 
-  def Death(self):
-    """Check if an ancient ant has to die."""
-    sim.death(self.world, configuration['life_expectancy_steps'])
-    if not self.GetParent().paused:
-      wx.CallLater(configuration['death_delay_ms'], self.Death)
+  def PauseSimulation(self):
+    """Pause the simulation."""
+    self.worker.pause()
+
+  def SetMaxSpeed(self, enabled):
+    """Runs the simulation as fast as possible (many steps per frame) if
+    enabled, otherwise waits step_delay_ms between two steps."""
+    self.worker.max_speed = enabled
+
+  def Seek(self, step):
+    """Moves the replay to the given step."""
+    self.worker.seek(step)
+
+  def StopSimulation(self):
+    """Stop the simulation thread and the redraws."""
+    self.timer.Stop()
+    self.worker.stop()
 
 
 
 class AntSimFrame(wx.Frame):
 
-  def __init__(self, size, title='Ants', pos=wx.DefaultPosition):
+  def __init__(self, size, title='Ants', pos=wx.DefaultPosition, player=None):
     no_resize = (wx.DEFAULT_FRAME_STYLE ^ 
                 (wx.RESIZE_BORDER | wx.MINIMIZE_BOX | wx.MAXIMIZE_BOX))
     wx.Frame.__init__(self, None, -1, title, pos, size, style=no_resize)
     # init properties
     self.RUN_ID = 1
+    self.FAST_ID = 2
+    self.PROFILE_ID = 3
     self.paused = True
+    self.player = player
     # init widgets
     self.InitStatusBar()
     #self.InitMenuBar()
     self.InitToolBar()
-    self.window = AntSimWindow(self, self.UpdateStatusBar)
+    self.window = AntSimWindow(self, self.UpdateStatusBar, player)
+    self.Bind(wx.EVT_CLOSE, self.OnClose)
 
 
   def InitStatusBar(self):
     """Create and initialized the statusbar."""
     self.statusbar = self.CreateStatusBar()
-    self.statusbar.SetFieldsCount(4)
+    self.statusbar.SetFieldsCount(5)
 
   def UpdateStatusBar(self, gen, ants, nest_food, world_food):
+    if self.slider is not None:
+      self.slider.SetValue(gen)
     self.statusbar.SetStatusText('Steps: {}'.format(gen), 0)
     self.statusbar.SetStatusText('Ants: {}'.format(ants), 1)
     self.statusbar.SetStatusText('Nest food: {}'.format(nest_food), 2)
     self.statusbar.SetStatusText('Food left: {}'.format(world_food), 3)
+    # median and 90th percentile of the phases (see instrument)
+    instruments = instrument.active
+    if instruments is not None:
+      self.statusbar.SetStatusText(instruments.summary(), 4)
 
   def InitToolBar(self):
     """Create and initialized the statusbar."""
     self.toolbar = self.CreateToolBar()
-    fn = os.path.join(os.path.dirname(__file__), '../img/play.png')
-    img = wx.Image(fn, wx.BITMAP_TYPE_ANY)
-    img = img.Scale(40, 40, wx.IMAGE_QUALITY_HIGH).ConvertToBitmap()
-    item = self.toolbar.AddSimpleTool(self.RUN_ID, img, 'Run')
+    # the icons of the run tool are loaded once
+    self.play_bitmap = self.LoadBitmap('play.png')
+    self.pause_bitmap = self.LoadBitmap('pause.png')
+    item = self.toolbar.AddSimpleTool(self.RUN_ID, self.play_bitmap, 'Run')
     self.Bind(wx.EVT_MENU, self.Run, item)
+    img = wx.ArtProvider.GetBitmap(wx.ART_GO_FORWARD, wx.ART_TOOLBAR, (40, 40))
+    item = self.toolbar.AddSimpleTool(self.FAST_ID, img, 'Max speed',
+                                      isToggle=True)
+    self.Bind(wx.EVT_MENU, self.MaxSpeed, item)
+    img = wx.ArtProvider.GetBitmap(wx.ART_REPORT_VIEW, wx.ART_TOOLBAR, (40, 40))
+    item = self.toolbar.AddSimpleTool(self.PROFILE_ID, img, 'Profile',
+                                      isToggle=True)
+    self.Bind(wx.EVT_MENU, self.Profile, item)
+    # a recording can be seeked, a stream can't
+    self.slider = None
+    if isinstance(self.player, replay.Player):
+      recording = self.player.recording
+      self.slider = wx.Slider(self.toolbar, -1, recording.first_step,
+                              recording.first_step, recording.last_step,
+                              size=(200, -1))
+      self.toolbar.AddControl(self.slider)
+      self.slider.Bind(wx.EVT_SLIDER, self.Seek)
     self.toolbar.Realize()
 
+  def LoadBitmap(self, name):
+    """Loads the icon with the given name, scaled to the toolbar size."""
+    fn = os.path.join(os.path.dirname(__file__), '../img', name)
+    img = wx.Image(fn, wx.BITMAP_TYPE_ANY)
+    return img.Scale(40, 40, wx.IMAGE_QUALITY_HIGH).ConvertToBitmap()
+
+  def OnClose(self, evt):
+    """OnClose event handler."""
+    self.window.StopSimulation()
+    evt.Skip()
+
+  def Seek(self, evt):
+    """Move the replay to the step of the slider."""
+    self.window.Seek(self.slider.GetValue())
+
+  def MaxSpeed(self, evt):
+    """Toggle the max speed mode."""
+    self.window.SetMaxSpeed(self.toolbar.GetToolState(self.FAST_ID))
+
+  def Profile(self, evt):
+    """Toggle the instruments (see instrument)."""
+    if self.toolbar.GetToolState(self.PROFILE_ID):
+      instrument.enable()
+    else:
+      instrument.disable()
+      self.statusbar.SetStatusText('', 4)
+
   def Run(self, evt):
     """Run the simulation."""
     if self.paused:
       self.paused = False
       self.window.StartSimulation()
-      fn = os.path.join(os.path.dirname(__file__), '../img/pause.png')
-      img = wx.Image(fn, wx.BITMAP_TYPE_ANY)
-      img = img.Scale(40, 40, wx.IMAGE_QUALITY_HIGH).ConvertToBitmap()
-      self.toolbar.SetToolNormalBitmap(id=self.RUN_ID, bitmap=img)
+      self.toolbar.SetToolNormalBitmap(id=self.RUN_ID,
+                                       bitmap=self.pause_bitmap)
     else:
       self.paused = True
-      fn = os.path.join(os.path.dirname(__file__), '../img/play.png')
-      img = wx.Image(fn, wx.BITMAP_TYPE_ANY)
-      img = img.Scale(40, 40, wx.IMAGE_QUALITY_HIGH).ConvertToBitmap()
-      self.toolbar.SetToolNormalBitmap(id=self.RUN_ID, bitmap=img)
+      self.window.PauseSimulation()
+      self.toolbar.SetToolNormalBitmap(id=self.RUN_ID,
+                                       bitmap=self.play_bitmap)
 
 
 
 class AntSimApp(wx.App):
 
+  def __init__(self, player=None):
+    self.player = player
+    wx.App.__init__(self)
+
   def OnInit(self):
     w, h = configuration['world_size']
     zoom = configuration['zoom']
-    self.frame = AntSimFrame(size=(w * zoom, h * zoom))
+    self.frame = AntSimFrame(size=(w * zoom, h * zoom), player=self.player)
     self.frame.Show()
     self.SetTopWindow(self.frame)
     return True
@@ -209,15 +418,42 @@ class AntSimApp(wx.App):
 
 
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Ants simulator.')
+  parser.add_argument('config', nargs='?', help='program configuration file')
+  parser.add_argument('--replay', help='recording (with frames) to play')
+  parser.add_argument('--speed', type=float,
+                      help='recorded steps per second of the replay')
+  parser.add_argument('--connect', metavar='HOST:PORT',
+                      help='server (see server.py) whose stream to view')
+  args = parser.parse_args()
+  player = None
   # check if a program configuration file is provided
-  if len(sys.argv) > 1:
-    configuration = config.deserialize(sys.argv[1])
+  if args.config:
+    configuration = config.deserialize(args.config)
+  elif args.replay or args.connect:
+    # use the configuration of the recorded (or served) simulation
+    configuration = None
   elif os.path.isfile('config.json'):
     configuration = config.deserialize('config.json')
   else:
     # use default configuration
     _, configuration = config.default()
+  if args.replay:
+    recording = replay.Recording(args.replay)
+    if configuration is None:
+      configuration = recording.configuration
+    # the world (and the window) has the size of the recorded one
+    configuration['world_size'] = recording.size
+    speed = args.speed or 1000.0 / max(1, configuration['step_delay_ms'])
+    player = replay.Player(recording, speed)
+  elif args.connect:
+    host, _, port = args.connect.rpartition(':')
+    player = client.Client(host or 'localhost', int(port))
+    if configuration is None:
+      configuration = player.configuration
+    # the world (and the window) has the size of the served one
+    configuration['world_size'] = player.size
   #filename, configuration = config.default()
   #config.serialize(filename, configuration)
-  app = AntSimApp()
+  app = AntSimApp(player)
   app.MainLoop()
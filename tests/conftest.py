@@ -0,0 +1,6 @@
+"""The modules of the simulator are imported from the src directory."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
@@ -0,0 +1,48 @@
+"""Tests of the validation of the configuration."""
+
+import pytest
+
+import behavior
+import config
+
+
+def test_default_is_valid():
+  _, configuration = config.default()
+  assert config.validate(configuration) is configuration
+
+
+@pytest.mark.parametrize('key, value', [
+  ('world_storage', 'numpy '),
+  ('ants_storage', 'array'),
+  ('renderer', 'frambuffer'),
+  ('pheromone_decay', 'slow'),
+  ('behavior', 'explore'),
+  ('world_size', [100]),
+  ('max_speed', 1),
+])
+def test_invalid_value(key, value):
+  _, configuration = config.default()
+  configuration[key] = value
+  with pytest.raises(ValueError, match=key):
+    config.validate(configuration)
+
+
+def test_invalid_colony_value():
+  _, configuration = config.default()
+  configuration['colonies'] = [{'nest_location': [10, 10]},
+                               {'behavior': 'Forage'}]
+  with pytest.raises(ValueError, match='behavior'):
+    config.validate(configuration)
+
+
+def test_registered_behavior():
+  _, configuration = config.default()
+  configuration['behavior'] = 'stay'
+  with pytest.raises(ValueError, match='behavior'):
+    config.validate(configuration)
+  behavior.register(behavior.Kernel('stay', lambda ant, gsp: None))
+  try:
+    assert config.validate(configuration) is configuration
+  finally:
+    del behavior.KERNELS['stay']
+    config.CHOICES['behavior'].discard('stay')
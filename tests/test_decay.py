@@ -0,0 +1,102 @@
+"""Tests of the lazy evaporation of the pheromone: the lifespans must be the
+same, to the last bit, of the eager evaporations."""
+
+import math
+import random
+
+import pytest
+
+import config
+import entity
+import record
+import sim
+
+
+def subtracted(lifespan, factor, steps):
+  """Evaporates the lifespan one step at a time."""
+  for _ in range(steps):
+    if lifespan <= 0:
+      break
+    lifespan -= factor
+  return lifespan
+
+
+def test_random_cases():
+  rnd = random.Random(0)
+  for _ in range(5000):
+    lifespan = rnd.choice([rnd.uniform(0, 100), float(rnd.randrange(1, 50)),
+                           math.ldexp(1.0, rnd.randrange(-3, 8))])
+    factor = rnd.choice([0.005, 0.01, 0.1, rnd.uniform(0, 0.5)])
+    steps = rnd.choice([0, 1, 2, rnd.randrange(100), rnd.randrange(100000)])
+    assert entity.decayed(lifespan, factor, steps) == subtracted(
+      lifespan, factor, steps), (lifespan, factor, steps)
+
+
+@pytest.mark.parametrize('lifespan', [0.3, 1.0, 3.7, 1024.5, -1.0, 0.0])
+@pytest.mark.parametrize('factor', [0.005, 0.01, 2.0])
+def test_single_step(lifespan, factor):
+  assert entity.decayed(lifespan, factor, 1) == subtracted(lifespan, factor, 1)
+
+
+@pytest.mark.parametrize('exponent', [1, 3, 10])
+@pytest.mark.parametrize('units', [0.5, 1.5, 2.5])
+def test_halfway_factors(exponent, units):
+  # lifespans in [2 ** (exponent - 1), 2 ** exponent): the factor is halfway
+  # between two units, and each subtraction rounds to the even float
+  unit = math.ldexp(1.0, exponent - 53)
+  factor = units * unit
+  assert math.fmod(factor, unit) * 2 == unit
+  lifespan = math.ldexp(1.0, exponent) - 7 * unit
+  for steps in (1, 2, 3, 10, 1000):
+    assert entity.decayed(lifespan, factor, steps) == subtracted(
+      lifespan, factor, steps), steps
+
+
+@pytest.mark.parametrize('lifespan', [1.0, 2.0, 64.0, 1.0 + 1e-12])
+def test_binade_boundaries(lifespan):
+  for steps in (1, 2, 99, 100, 101, 5000):
+    assert entity.decayed(lifespan, 0.01, steps) == subtracted(
+      lifespan, 0.01, steps), steps
+
+
+def test_lazy_run_is_eager_run():
+  reports = []
+  for decay in ('eager', 'lazy'):
+    _, configuration = config.default()
+    configuration.update(pheromone_decay=decay, birth_delay_ms=100,
+                         life_expectancy_steps=300)
+    report = sim.Simulation(configuration, 7).run(800)
+    reports.append(dict((k, report[k]) for k in
+                        ('steps', 'ants', 'peak_ants', 'nest_food',
+                         'world_food')))
+  assert reports[0] == reports[1]
+
+
+def test_alive_near_the_end():
+  rnd = random.Random(1)
+  for _ in range(5000):
+    factor = rnd.choice([0.005, 0.01, rnd.uniform(0, 0.5)])
+    steps = rnd.randrange(1, 200)
+    # lifespans ending within a few units of 0
+    lifespan = steps * factor + rnd.randrange(-4, 5) * entity.unit(steps * factor)
+    assert entity.alive(lifespan, factor, steps) == (
+      subtracted(lifespan, factor, steps) > 0), (lifespan, factor, steps)
+
+
+def test_coverage_of_a_lazy_world_is_read_only():
+  coverages = []
+  for decay in ('eager', 'lazy'):
+    _, configuration = config.default()
+    configuration.update(pheromone_decay=decay, birth_delay_ms=100)
+    simulation = sim.Simulation(configuration, 7)
+    steps = []
+    for _ in range(300):
+      simulation.advance()
+      steps.append(record.coverage(simulation.world))
+    coverages.append(steps)
+  world = simulation.world
+  pending = [world.cells[l].steps for l in world.live]
+  assert any(s != world.decay.steps for s in pending)
+  record.coverage(world)
+  assert [world.cells[l].steps for l in world.live] == pending
+  assert coverages[0] == coverages[1]
@@ -0,0 +1,78 @@
+"""Tests of the checkpoints and of the snapshots of an ensemble."""
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import checkpoint
+import config
+import ensemble
+import entity
+import snapshot
+
+
+SEEDS = 3, 4, 5
+
+
+def create():
+  """Creates a small ensemble of the default configuration."""
+  _, configuration = config.default()
+  configuration['world_size'] = 30, 20
+  configuration['nest_location'] = 10, 10
+  return ensemble.Ensemble(configuration, SEEDS)
+
+
+def advance(e, steps):
+  """Advances the ensemble by the given number of steps."""
+  for _ in range(steps):
+    e.advance()
+
+
+def state(e):
+  """Gets the state of the world and of the members of the ensemble."""
+  world = e.world
+  n = len(world.ants)
+  return ([getattr(world, name).tolist() for name in entity.ARRAY_FIELDS] +
+          [world.nest_food_quantities.tolist(), world.food_quantity,
+           world.ants.location[:n].tolist(), world.ants.colony[:n].tolist(),
+           world.ants.path[:n].tolist(), e.peak_ants.tolist(),
+           e.running.tolist(), e.steps])
+
+
+def test_checkpoint(tmp_path):
+  filename = str(tmp_path / 'ensemble.ckpt')
+  e = create()
+  advance(e, 150)
+  ensemble.save(e, filename)
+  restored = ensemble.restore(filename)
+  assert isinstance(restored.world, ensemble.EnsembleWorld)
+  assert state(restored) == state(e)
+  advance(e, 100)
+  advance(restored, 100)
+  assert state(restored) == state(e)
+
+
+def test_simulation_checkpoint_rejects_ensemble(tmp_path):
+  e = create()
+  with pytest.raises(ValueError, match='EnsembleWorld'):
+    checkpoint.save(e, str(tmp_path / 'ensemble.ckpt'))
+
+
+def test_snapshot():
+  e = create()
+  advance(e, 50)
+  world = e.world
+  shot = snapshot.capture(world, e.steps, full=True)
+  cells = {l: (cl, fl, fq) for l, cl, fl, fq in shot.cells}
+  mask = (world.food_quantities > 0) | world.live_mask()
+  assert sorted(cells) == numpy.flatnonzero(mask).tolist()
+  for l, (cl, fl, fq) in cells.items():
+    assert cl == max(world.colony_lifespans[l], 0)
+    assert fl == max(world.food_lifespans[l], 0)
+    assert fq == world.food_quantities[l]
+  n = len(world.ants)
+  assert [a for a, _ in shot.ants] == world.ants.location[:n].tolist()
+  assert [f // 2 for _, f in shot.ants] == world.ants.colony[:n].tolist()
+  view = snapshot.WorldView(world.size, world.nest, world.nests)
+  view.apply(shot)
+  assert len(view.cells) == len(cells)
@@ -0,0 +1,65 @@
+"""Tests of the entities of the simulator."""
+
+import random
+
+import entity
+
+
+def test_path_is_exact():
+  rnd = random.Random(0)
+  path, reference = entity.Path(), set()
+  for _ in range(20000):
+    location = rnd.randrange(2000 * 2000)
+    path.add(location)
+    reference.add(location)
+    assert len(path) == len(reference)
+  assert set(path) == reference
+  assert all(location in path for location in reference)
+  assert not any(location in path
+                 for location in range(2000 * 2000, 2000 * 2000 + 1000))
+
+
+def test_path_length_counts_distinct_locations():
+  path = entity.Path()
+  for location in range(10000):
+    path.add(location)
+    path.add(location)
+  assert len(path) == 10000
+  path.clear()
+  assert len(path) == 0 and 0 not in path
+
+
+def test_removed_young_ants_are_dropped_from_the_index():
+  world = entity.World((20, 10), (5, 5), 0, 0)
+  ants = entity.Ants()
+  born = []
+  for age in range(10, 0, -1):
+    ant = entity.Ant(world, 0)
+    ant.age = age
+    ants.append(ant)
+    born.append(ant)
+  assert [a.age for a in ants.older(4)] == [10, 9, 8, 7, 6, 5]
+  # the oldest young ant and one in the middle
+  ants.remove(born[6])
+  ants.remove(born[8])
+  assert len(ants) == 8
+  assert all(ants[a.index] is a for a in ants)
+  for ant in ants:
+    ant.age += 3
+  older = ants.older(4)
+  assert sorted(a.age for a in older) == [6, 8, 9, 10, 11, 12, 13]
+  assert born[6] not in older and born[8] not in older
+  assert ants.ranks().count(-1) == 1
+
+
+def test_neighbor_cells_follow_the_replaced_cells():
+  world = entity.World((20, 10), (5, 5), 0, 0)
+  location = world.index((0, 0))
+  cells = world.neighbor_cells(location)
+  assert [world.cells[l] for l in world.neighbors[:8]] == cells
+  east = world.index((1, 0))
+  cell = entity.Cell()
+  cell.food_quantity = 3
+  world[east] = cell
+  assert world.neighbor_cells(location)[entity.DELTA.index((1, 0))] is cell
+  assert world.adjacent[world.index((5, 5))] is None
@@ -0,0 +1,25 @@
+"""Tests of the recordings played back."""
+
+import gc
+import warnings
+
+import config
+import record
+import replay
+import sim
+
+
+def test_recording_closes_its_file(tmp_path):
+  filename = str(tmp_path / 'run.rec')
+  _, configuration = config.default()
+  simulation = sim.Simulation(configuration, 7)
+  simulation.recorder = record.Recorder(filename, simulation, frame_every=5)
+  simulation.run(100)
+  simulation.recorder.close()
+  with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always', ResourceWarning)
+    recording = replay.Recording(filename)
+    assert recording.first_step == 5
+    del recording
+    gc.collect()
+  assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
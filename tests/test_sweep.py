@@ -0,0 +1,59 @@
+"""Tests of the parameter sweeps."""
+
+import io
+import os
+import csv
+import time
+import multiprocessing
+
+import pytest
+
+import config
+import sweep
+
+
+pytestmark = pytest.mark.skipif(
+  multiprocessing.get_start_method() != 'fork',
+  reason='the runs must inherit the patched simulate')
+
+
+def rows(out):
+  """Gets the rows of the results, by run."""
+  out.seek(0)
+  return dict((int(r['run']), r) for r in csv.DictReader(out))
+
+
+def test_crashed_run_is_the_only_one_lost(monkeypatch):
+  simulate = sweep.simulate
+  def crashing(task):
+    if task[0] == 1:
+      os._exit(1)
+    return simulate(task)
+  monkeypatch.setattr(sweep, 'simulate', crashing)
+  _, configuration = config.default()
+  tasks = [(r, r, {'go_straight_probability': 0.9}) for r in range(4)]
+  out = io.StringIO()
+  assert sweep.sweep(configuration, tasks, 20, out, 2) == 1
+  results = rows(out)
+  assert sorted(results) == [0, 1, 2, 3]
+  assert results[1]['error'] == 'lost'
+  assert all(results[r]['error'] == '' and results[r]['steps'] == '20'
+             for r in (0, 2, 3))
+
+
+def test_timeout_stops_only_the_slow_run(monkeypatch):
+  simulate = sweep.simulate
+  def slow(task):
+    if task[0] == 0:
+      time.sleep(60)
+    return simulate(task)
+  monkeypatch.setattr(sweep, 'simulate', slow)
+  _, configuration = config.default()
+  tasks = [(r, r, {}) for r in range(3)]
+  out = io.StringIO()
+  start = time.time()
+  assert sweep.sweep(configuration, tasks, 20, out, 2, timeout=1.0) == 1
+  assert time.time() - start < 30
+  results = rows(out)
+  assert results[0]['error'] == 'timeout'
+  assert results[1]['error'] == results[2]['error'] == ''
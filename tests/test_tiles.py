@@ -0,0 +1,67 @@
+"""Tests of the geometry of the tiles and of the hand off of the ants."""
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import entity
+import population
+import tiles
+
+
+SIZE = 100, 70
+
+
+def east_edge(tile):
+  """Gets a local location on the east edge of the interior of the tile."""
+  lh = tile.local_size[1]
+  return (tile.x1 - tile.x0) * lh + 1
+
+
+@pytest.mark.parametrize('grid', [(1, 1), (1, 2), (2, 1), (2, 2), (3, 2)])
+def test_interior_maps_to_itself(grid):
+  width, height = SIZE
+  xs, ys = tiles.bounds(width, grid[0]), tiles.bounds(height, grid[1])
+  for i in range(grid[0]):
+    for j in range(grid[1]):
+      tile = tiles.Tile(SIZE, xs[i], xs[i + 1], ys[j], ys[j + 1])
+      interior = tile.world_locations[tile.interior]
+      assert (tile.local(interior) == tile.interior).all()
+
+
+def test_last_column_of_a_tile_spanning_the_axis():
+  tile = tiles.Tile(SIZE, 0, 100, 0, 35)
+  lh = tile.local_size[1]
+  location = tile.local(numpy.array([99 * SIZE[1] + 10]))[0]
+  assert location == 100 * lh + 11
+  assert tile.inside[location]
+
+
+def test_outside_and_missing_locations():
+  tile = tiles.Tile(SIZE, 0, 50, 0, 35)
+  lh = tile.local_size[1]
+  world = numpy.array([-1, 60 * SIZE[1] + 10, 99 * SIZE[1] + 10,
+                       50 * SIZE[1] + 69])
+  assert tile.local(world).tolist() == [-1, -1, 11, 51 * lh]
+
+
+@pytest.mark.parametrize('bounds', [(0, 100, 0, 35), (0, 100, 0, 70)])
+def test_hand_off_across_the_wrap(bounds):
+  # a single tile on the x axis: the ant leaving it eastwards comes back in
+  # from the west, inside the same tile
+  tile = tiles.Tile(SIZE, *bounds)
+  world = entity.ArrayWorld(tile.local_size, (0, 0), 0, 0)
+  ants = population.Population(world)
+  east = entity.DELTA.index((1, 0))
+  ant = entity.Ant(world, east)
+  ant.location = east_edge(tile)
+  ants.append(ant)
+  ants.location[0] = world.neighbors_array()[ant.location, east]
+  assert not tile.inside[ants.location[0]]
+  emigrants = tiles.emigrate(tile, ants)
+  assert len(ants) == 0
+  assert emigrants['location'][0] // SIZE[1] == 0
+  tiles.immigrate(tile, ants, emigrants)
+  assert len(ants) == 1
+  assert tile.inside[ants.location[0]]
+  assert ants.location[0] // tile.local_size[1] == 1